@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# Micro-benchmarks of the thermostat code that runs every few seconds, for comparing
+# performance across changes.
+#
+# The thermostat is set up the way simulator.py does it (headless, FakeRPi, simulated clock,
+# state and relay stats in a temporary directory, history in RAM, logging and MQTT off unless
+# a benchmark turns them on), so its files are left alone.
+# Each benchmark is called in a loop sized to take at least --min-time seconds, with the
+# garbage collector off, and this is repeated --repeat times; the best time per call is
+# the number to compare (the median is shown to judge the noise).
+#
+# Usage:
+#   python3 benchmark.py [--filter tick] [--save baseline.json]
+#   python3 benchmark.py --compare baseline.json
+#
+# Run it from the thermostat directory, so thermostat_settings.json and
+# thermostat_schedule.json are used.
+
+import argparse
+import contextlib
+import gc
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import simulator
+from simulator import thermostat
+from logpipeline import LogPipeline
+from weeklyschedule import WeeklyTimeline
+
+
+class NullFile:
+    # Log file (and stdout) sink: the records are formatted, but not written anywhere
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def measure(func, repeat: int, minTime: float) -> list:
+    # Seconds per call of each of repeat runs, each run long enough to time reliably
+    def run(number: int) -> float:
+        started = time.perf_counter()
+        for i in range(number):
+            func()
+        return time.perf_counter() - started
+
+    gcEnabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        # Some paths print (eg. the test schedule notice), that is not what is measured
+        with contextlib.redirect_stdout(NullFile()):
+            # Warm up (caches, lazily built objects), then find a loop count taking at least minTime
+            run(1)
+            number = 1
+            elapsed = run(number)
+            while elapsed < minTime:
+                number = max(number * 2, int(number * minTime / elapsed * 1.1)) if elapsed > 0 else number * 10
+                elapsed = run(number)
+
+            return [run(number) / number for i in range(repeat)]
+    finally:
+        if gcEnabled:
+            gc.enable()
+
+
+def benchmarks(clock: simulator.SimulatedClock, sensor) -> list:
+    # (name, function) pairs, the setup each one needs is done in its function's closure
+    current = thermostat.thermostatModel.current
+    setTemp = current.setTemp
+    thermostat.update_state(heat=True, cool=False, fan=False, hold=False)
+
+    # Control loop tick: check_sensor_temp picks up the sensor reading and runs
+    # change_system_settings; steady keeps the relays as they are, switching flips the heat
+    # relay on every tick
+    def tick(temp):
+        sensor.set_temperature(simulator.raw_sensor_temp(temp))
+        thermostat.tempSampler.sample()
+        thermostat.check_sensor_temp(thermostat.tempCheckInterval)
+        clock.advance(thermostat.tempCheckInterval)
+
+    switching = [setTemp - 1.0, setTemp + 1.0]
+
+    def tick_switching():
+        switching.reverse()
+        tick(switching[0])
+
+    # Faikin decisions on a temperature sweep around the set temperature
+    sweep = [setTemp + (i - 10) * 0.2 for i in range(21)]
+    sweepIndex = [0]
+
+    def faikin(strategy):
+        simulator.use_strategy(clock, strategy)
+        controller = thermostat.faikinController
+
+        def decide():
+            thermostat.faikinController = controller
+            sweepIndex[0] = (sweepIndex[0] + 1) % len(sweep)
+            thermostat.update_state(currentTemp=sweep[sweepIndex[0]])
+            state = thermostat.thermostatModel.current
+            thermostat.faikin_command(state, thermostat.get_state_json(state))
+            clock.advance(thermostat.tempCheckInterval)
+
+        return decide
+
+    # Unless the schedule file changed (or reparse forces it), reloadSchedule only checks its
+    # modification time and reuses the test timeline; reparsing builds and applies the
+    # timelines (and the test schedule's) again
+    def reload_schedule(test, reparse=False):
+        def reload():
+            thermostat.useTestSchedule = test
+            if reparse:
+                thermostat.scheduleMTime = None
+                thermostat.testTimeline = None
+            thermostat.reloadSchedule()
+
+        return reload
+
+    def build_test_schedule():
+        WeeklyTimeline(thermostat.getTestSchedule())
+
+    # Logging, at the state level, through a running pipeline writing to a file that
+    # discards the output
+    thermostat.logFile = NullFile()
+    thermostat.logLevel = thermostat.LOG_LEVEL_STATE
+    pipeline = LogPipeline(thermostat.write_log_file)
+    pipeline.start()
+    thermostat.logPipeline = pipeline
+
+    def log_state():
+        thermostat.log_queued(thermostat.LOG_LEVEL_STATE, thermostat.CHILD_DEVICE_TEMP, thermostat.MSG_SUBTYPE_TEMPERATURE,
+                              "%s", setTemp)
+
+    def log_filtered():
+        thermostat.log_queued(thermostat.LOG_LEVEL_DEBUG, thermostat.CHILD_DEVICE_TEMP,
+                              thermostat.MSG_SUBTYPE_CUSTOM + "/raw", "%s", setTemp)
+
+    records = [(clock.time(), thermostat.LOG_LEVEL_STATE, thermostat.CHILD_DEVICE_TEMP,
+                thermostat.MSG_SUBTYPE_TEMPERATURE, "%s", (setTemp + i * 0.1,), thermostat.MSG_TYPE_SET, True)
+               for i in range(64)]
+
+    web = thermostat.WebInterface()
+
+    return [
+        ("tick (steady)", lambda: tick(setTemp)),
+        ("tick (switching)", tick_switching),
+        ("get_status", thermostat.get_status),
+        ("get_api_status", thermostat.get_api_status),
+        ("publish_status", thermostat.publish_status),
+        ("climate_payload", lambda: thermostat.climate_payload(thermostat.thermostatModel.current)),
+        ("WebInterface.index", web.index),
+        ("reloadSchedule", reload_schedule(False)),
+        ("reloadSchedule (test schedule)", reload_schedule(True)),
+        ("reloadSchedule (reparse)", reload_schedule(False, reparse=True)),
+        ("reloadSchedule (test schedule, reparse)", reload_schedule(True, reparse=True)),
+        ("getTestSchedule + WeeklyTimeline", build_test_schedule),
+        ("log_queued (state)", log_state),
+        ("log_queued (filtered out)", log_filtered),
+        ("write_log_file (64 records)", lambda: thermostat.write_log_file(records)),
+        ("get_state_json", thermostat.get_state_json),
+        ("faikin_command (step)", faikin("step")),
+        ("faikin_command (pi)", faikin("pi")),
+        ("faikin_command (weather)", faikin("weather"))
+    ]
+
+
+def format_time(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return "%8.2f ms" % (seconds * 1e3)
+    return "%8.2f us" % (seconds * 1e6)
+
+
+def run_benchmarks(args, clock: simulator.SimulatedClock, sensor):
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+
+    results = {}
+
+    for name, func in benchmarks(clock, sensor):
+        if args.filter and args.filter not in name:
+            continue
+
+        times = measure(func, args.repeat, args.min_time)
+        results[name] = {"best": min(times), "median": statistics.median(times)}
+
+        line = "%-40s %s  (median %s)" % (name, format_time(results[name]["best"]),
+                                          format_time(results[name]["median"]).strip())
+        if name in baseline:
+            line += "  %+6.1f%%" % ((results[name]["best"] / baseline[name]["best"] - 1.0) * 100.0)
+
+        print(line)
+        sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results},
+                      file, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thermostat micro-benchmarks")
+    parser.add_argument("--headless", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7, help="timed runs per benchmark (default 7)")
+    parser.add_argument("--min-time", type=float, default=0.1, help="minimum seconds per run (default 0.1)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="show the change against results saved with --save")
+    args = parser.parse_args()
+
+    # The state and relay stats go to a temporary directory, removed again at the end
+    with tempfile.TemporaryDirectory(prefix="thermostat-bench-") as workDir:
+        clock = simulator.SimulatedClock(time.time())
+        sensor = simulator.isolate(clock, workDir)
+        run_benchmarks(args, clock, sensor)
+
+
+if __name__ == "__main__":
+    main()
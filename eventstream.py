@@ -0,0 +1,73 @@
+import json
+import threading
+from collections import deque
+
+
+class EventBroadcaster:
+    # Server-Sent Events fan-out. Each event is serialized once into a small shared ring;
+    # subscribers just follow the sequence numbers, so publishing costs the same no matter
+    # how many browsers are listening. A subscriber that falls further behind than the ring
+    # gets a None, telling it to resynchronise from a full snapshot.
+
+    def __init__(self, backlog: int = 32, maxSubscribers: int = 8):
+        self.backlog = backlog
+        self.maxSubscribers = maxSubscribers
+        self.subscribers = 0
+        self.closed = False
+        self._seq = 0
+        self._events = deque(maxlen=backlog)
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def format(event: str, payload: bytes, eventId=None) -> bytes:
+        head = b"" if eventId is None else b"id: " + str(eventId).encode("ascii") + b"\n"
+        return head + b"event: " + event.encode("ascii") + b"\ndata: " + payload + b"\n\n"
+
+    def publish(self, event: str, data):
+        payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, self.format(event, payload, self._seq)))
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self.closed or self.subscribers >= self.maxSubscribers:
+                return False
+            self.subscribers += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def position(self) -> int:
+        return self._seq
+
+    def subscribe(self, lastId: int, keepalive: float = 15.0):
+        # Generator yielding serialized events (or b": keepalive" comments while idle)
+        # published after lastId, see position()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.closed or self._seq > lastId, timeout=keepalive)
+
+                if self.closed:
+                    return
+
+                pending = [event for event in self._events if event[0] > lastId]
+                missed = self._seq > lastId and (not pending or pending[0][0] > lastId + 1)
+                lastId = self._seq
+
+            if missed:
+                yield None
+            elif pending:
+                for seq, message in pending:
+                    yield message
+            else:
+                yield b": keepalive\n\n"
@@ -0,0 +1,244 @@
+import collections
+import time
+
+from hysteresistimer import HysteresisTimer
+
+MIN_DEMAND = 30
+MAX_DEMAND = 100
+
+# What the Faikin gets when there is nothing to regulate (auto mode)
+DEFAULT_SETTING = ("3", 70)
+
+# Inputs of one control decision. mode is the Faikin mode ("H", "C" or "A"), power whether the
+# unit should run at all (autop of the Faikin state).
+ControlInputs = collections.namedtuple("ControlInputs",
+                                       "currentTemp targetTemp roundedTemp outsideTemp mode power")
+
+
+def clamp_demand(demand: float) -> float:
+    return min(max(demand, MIN_DEMAND), MAX_DEMAND)
+
+
+def quantize_demand(demand: float, step: int = 5) -> int:
+    # Small output changes do not reach the unit, so it is not restaged on every tick
+    return int(clamp_demand(round(demand / step) * step))
+
+
+def fan_for_demand(demand: float) -> str:
+    # Fan speed "1".."5" going with a demand, matching the step table
+    if demand <= 40:
+        return "1"
+    if demand <= 60:
+        return "2"
+    if demand <= 80:
+        return "3"
+    if demand <= 95:
+        return "4"
+    return "5"
+
+
+def room_error(inputs: ControlInputs) -> float:
+    # How far the room is from the target, positive when more heating/cooling is needed
+    if inputs.mode == "H":
+        return inputs.targetTemp - inputs.currentTemp
+    return inputs.currentTemp - inputs.targetTemp
+
+
+class StepTableStrategy:
+    # The original fan/demand lookup: fixed steps by how far the room is from the target.
+    # Nothing is changed while the temperature moved less than tolerance since the last
+    # decision (and the target stayed the same).
+
+    def __init__(self, tolerance: float = 0.2, fanHysteresis: float = 0.5):
+        self.tolerance = tolerance
+        self.fanHysteresis = fanHysteresis
+        self.prevTemp = None
+
+    def decide(self, inputs: ControlInputs, targetChanged: bool, now: float):
+        if self.prevTemp is None:
+            self.prevTemp = inputs.currentTemp
+
+        if not targetChanged and abs(inputs.currentTemp - self.prevTemp) < self.tolerance:
+            return None
+
+        self.prevTemp = inputs.currentTemp
+
+        if inputs.mode not in ("H", "C"):
+            return DEFAULT_SETTING
+
+        # Above/below the target by more than fanHysteresis, as seen from the heating side
+        tempDiff = inputs.currentTemp - inputs.targetTemp if inputs.mode == "H" else inputs.targetTemp - inputs.currentTemp
+
+        if abs(tempDiff) <= self.tolerance:
+            return DEFAULT_SETTING
+
+        if inputs.mode == "H":
+            if tempDiff > self.fanHysteresis:
+                return ("1", 30) if abs(tempDiff) > 3 else ("2", 50)
+            if tempDiff < -self.fanHysteresis:
+                return ("5", 100) if abs(tempDiff) > 2 else ("4", 95)
+        else:
+            if tempDiff > self.fanHysteresis:
+                return ("4", 95) if abs(tempDiff) > 2 else ("5", 100)
+            if tempDiff < -self.fanHysteresis:
+                return ("1", 30) if abs(tempDiff) > 2 else ("2", 50)
+
+        return DEFAULT_SETTING
+
+
+class PIStrategy:
+    # Demand from a PI controller on the room error: bias + kp * error + integral, where the
+    # integral grows by ki per degree and minute of error (and is kept within the demand
+    # range, so it does not wind up while the unit is at its limit). Errors within deadband
+    # count as none.
+
+    def __init__(self, kp: float = 15.0, ki: float = 1.0, bias: float = 70.0, deadband: float = 0.1):
+        self.kp = kp
+        self.ki = ki
+        self.bias = bias
+        self.deadband = deadband
+        self.integral = 0.0
+        self.mode = None
+        self.lastTime = None
+
+    def decide(self, inputs: ControlInputs, targetChanged: bool, now: float):
+        if inputs.mode not in ("H", "C"):
+            self.mode = None
+            return DEFAULT_SETTING
+
+        if inputs.mode != self.mode:
+            self.mode = inputs.mode
+            self.integral = 0.0
+            self.lastTime = None
+
+        error = room_error(inputs)
+        if abs(error) < self.deadband:
+            error = 0.0
+
+        # Minutes since the last decision, capped so a long pause does not look like a long error
+        minutes = 0.0 if self.lastTime is None else min(now - self.lastTime, 600.0) / 60.0
+        self.lastTime = now
+
+        self.integral = min(max(self.integral + self.ki * error * minutes, MIN_DEMAND - self.bias),
+                            MAX_DEMAND - self.bias)
+
+        demand = quantize_demand(self.bias + self.kp * error + self.integral)
+
+        return fan_for_demand(demand), demand
+
+
+class WeatherCompensatedStrategy:
+    # Demand follows a heating (cooling) curve: the further the outside temperature is below
+    # (above) the target, the more the unit has to deliver, slope percent per degree on top
+    # of the minimum. The room error corrects the curve by kp percent per degree.
+
+    def __init__(self, slope: float = 2.5, kp: float = 10.0, deadband: float = 0.1):
+        self.slope = slope
+        self.kp = kp
+        self.deadband = deadband
+
+    def decide(self, inputs: ControlInputs, targetChanged: bool, now: float):
+        if inputs.mode not in ("H", "C"):
+            return DEFAULT_SETTING
+
+        if inputs.mode == "H":
+            load = inputs.targetTemp - inputs.outsideTemp
+        else:
+            load = inputs.outsideTemp - inputs.targetTemp
+
+        error = room_error(inputs)
+        if abs(error) < self.deadband:
+            error = 0.0
+
+        demand = quantize_demand(MIN_DEMAND + self.slope * max(load, 0.0) + self.kp * error)
+
+        return fan_for_demand(demand), demand
+
+
+STRATEGIES = {
+    "step": StepTableStrategy,
+    "pi": PIStrategy,
+    "weather": WeatherCompensatedStrategy
+}
+
+
+def create_strategy(name: str, **options):
+    if name not in STRATEGIES:
+        raise ValueError("Unknown Faikin control strategy: " + repr(name) + " (expected one of " +
+                         ", ".join(STRATEGIES) + ")")
+
+    return STRATEGIES[name](**options)
+
+
+class FaikinController:
+    # Turns the thermostat state into Faikin control commands. The strategy picks the fan
+    # speed and demand; the controller adds what applies to all of them: the unit is switched
+    # off when the room is more than cutoff degrees past the target, and the fan/demand is
+    # changed at most once every minChangeInterval seconds (except right after the target
+    # changed), so the compressor is not restaged on every sensor reading. A setting held
+    # back by that is kept pending and applied once the interval is over, even if the
+    # strategy has nothing new to say by then. off() switches the unit off without asking the
+    # strategy (eg. while there is no current temperature); the next update() sends a full
+    # command again.
+
+    def __init__(self, strategy, minChangeInterval: float = 10.0, cutoff: float = 4.0, now=time.monotonic):
+        self.strategy = strategy
+        self.cutoff = cutoff
+        self.now = now
+        self.changeTimer = HysteresisTimer(minChangeInterval, now=now)
+        self.targetTemp = None
+        self.setting = None
+        self.pending = None
+        self.stopped = False
+        self.changes = 0
+
+    def update(self, inputs: ControlInputs):
+        # The control command as a dict, or None when there is nothing new to send
+        now = self.now()
+
+        targetChanged = inputs.targetTemp != self.targetTemp
+        if targetChanged:
+            self.targetTemp = inputs.targetTemp
+            self.changeTimer.reset()
+
+        decided = self.strategy.decide(inputs, targetChanged, now)
+        if decided is not None:
+            self.pending = decided
+        elif self.pending == self.setting and not self.stopped:
+            return None
+
+        if self.pending != self.setting:
+            if self.setting is None or self.changeTimer.check():
+                self.setting = self.pending
+                self.changes += 1
+            elif decided is None and not self.stopped:
+                # Still waiting for the interval, nothing new to send
+                return None
+
+        power = inputs.power
+        if (inputs.mode == "H" and inputs.targetTemp + self.cutoff < inputs.roundedTemp) or \
+                (inputs.mode == "C" and inputs.targetTemp - self.cutoff > inputs.roundedTemp):
+            power = False
+
+        self.stopped = False
+
+        return self._command(inputs, power)
+
+    def off(self, inputs: ControlInputs):
+        # The command switching the unit off, keeping the fan/demand setting for later
+        self.stopped = True
+
+        return self._command(inputs, False)
+
+    def _command(self, inputs: ControlInputs, power: bool) -> dict:
+        fan, demand = self.setting or DEFAULT_SETTING
+
+        return {
+            "env": inputs.currentTemp,
+            "temp": inputs.targetTemp,
+            "powerful": False,
+            "power": power,
+            "mode": inputs.mode,
+            "fan": fan,
+            "demand": demand
+        }
@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class HeadlessClock:
+    # Stand-in for the Kivy Clock when running without a display: the subset of its API the
+    # thermostat uses (schedule_once, schedule_interval, create_trigger), with callbacks run
+    # on the thread that calls run(), the way Kivy runs them on its main loop. Scheduling is
+    # safe from any thread.
+
+    def __init__(self, now=time.monotonic):
+        self.now = now
+        self._events = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def _schedule(self, event, when: float):
+        with self._cond:
+            event.due = when
+            heapq.heappush(self._events, (when, next(self._seq), event))
+            self._cond.notify()
+
+    def _unschedule(self, event):
+        # Lazily: a cancelled event stays in the heap until it comes due, and is skipped then
+        with self._cond:
+            event.due = None
+
+    def schedule_once(self, callback, timeout: float = 0):
+        event = ClockEvent(self, callback, timeout, False)
+        event()
+        return event
+
+    def schedule_interval(self, callback, timeout: float):
+        event = ClockEvent(self, callback, timeout, True)
+        event()
+        return event
+
+    def create_trigger(self, callback, timeout: float = 0):
+        return ClockEvent(self, callback, timeout, False)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._events:
+                        wait = self._events[0][0] - self.now()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+
+                if self._stopped:
+                    return
+
+                when, seq, event = heapq.heappop(self._events)
+
+                # Cancelled, or rescheduled since this entry was pushed
+                if event.due != when:
+                    continue
+
+                event.due = None
+                if event.interval:
+                    self._schedule(event, when + event.timeout)
+
+            started = self.now()
+            if event.callback(started - event.scheduled) is False and event.interval:
+                event.cancel()
+            event.scheduled = started
+
+
+class ClockEvent:
+    # Calling a pending event does nothing, like a Kivy trigger; cancel() unschedules it
+
+    def __init__(self, clock: HeadlessClock, callback, timeout: float, interval: bool):
+        self.clock = clock
+        self.callback = callback
+        self.timeout = timeout
+        self.interval = interval
+        self.due = None
+        self.scheduled = clock.now()
+
+    def __call__(self, *args):
+        if self.due is None:
+            self.scheduled = self.clock.now()
+            self.clock._schedule(self, self.scheduled + self.timeout)
+
+    def cancel(self):
+        self.clock._unschedule(self)
+
+    @property
+    def is_triggered(self) -> bool:
+        return self.due is not None
+
+
+class HeadlessWidget:
+    # Keeps the attributes the thermostat reads and writes on its widgets (text, state,
+    # value, ...), so the code updating the UI runs unchanged, without drawing anything
+
+    def __init__(self, **kwargs):
+        self.state = "normal"
+        self.text = ""
+        self.value = 0
+        self.__dict__.update(kwargs)
+
+    def bind(self, **kwargs):
+        pass
+
+    def add_widget(self, widget):
+        pass
+
+
+class JsonSettings:
+    # Read only replacement for the Kivy JsonStore the settings are loaded with
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._data = {}
+
+        if os.path.exists(filename):
+            with open(filename, encoding="utf-8") as f:
+                self._data = json.load(f)
+
+    def exists(self, key: str) -> bool:
+        return key in self._data
+
+    def get(self, key: str) -> dict:
+        return self._data[key]
@@ -0,0 +1,449 @@
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+# (name, bucket seconds, capacity): 1 week of minutes, 90 days of quarter hours, 2 years of hours
+DEFAULT_TIERS = (
+    ("1m", 60, 7 * 24 * 60),
+    ("15m", 15 * 60, 90 * 24 * 4),
+    ("1h", 60 * 60, 2 * 365 * 24)
+)
+
+RING_MAGIC = b"THST"
+RING_VERSION = 1
+# magic, version, record size, capacity, next write index, record count
+RING_HEADER = struct.Struct("<4sHHIII")
+TIMESTAMP = struct.Struct("<d")
+
+NAN = float("nan")
+
+RAW_TIER = "raw"
+
+# Samples from before this (2020-01-01) are taken as the clock not being set yet, eg. a Pi
+# without RTC before its NTP sync
+MIN_VALID_TIME = 1577836800.0
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
+
+
+def parse_duration(text: str) -> float:
+    # "90", "90s", "15m", "24h", "7d", "2w" -> seconds
+    text = str(text).strip().lower()
+
+    if text and text[-1] in DURATION_UNITS:
+        seconds = float(text[:-1]) * DURATION_UNITS[text[-1]]
+    else:
+        seconds = float(text)
+
+    # inf/nan (or a number overflowing to inf) would break the bucket arithmetic
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError("Expected a positive duration, got: " + repr(text))
+
+    return seconds
+
+
+class RecordRing:
+    # Fixed capacity ring of fixed width struct records, in a bytearray or (given a
+    # filename) in a memory mapped file of constant size. Once full, each append
+    # overwrites the oldest record.
+
+    def __init__(self, recordStruct: struct.Struct, capacity: int, filename: str = None):
+        self.record = recordStruct
+        self.capacity = capacity
+        self.filename = filename
+        self.next = 0
+        self.count = 0
+        self._file = None
+
+        size = RING_HEADER.size + recordStruct.size * capacity
+
+        if filename is None:
+            self.buffer = bytearray(size)
+            return
+
+        mode = "r+b" if os.path.exists(filename) else "w+b"
+        self._file = open(filename, mode)
+
+        if os.fstat(self._file.fileno()).st_size != size:
+            self._file.truncate(size)
+
+        self.buffer = mmap.mmap(self._file.fileno(), size)
+        magic, version, recordSize, capacity, next, count = RING_HEADER.unpack_from(self.buffer, 0)
+
+        if (magic, version, recordSize, capacity) == (RING_MAGIC, RING_VERSION, recordStruct.size, self.capacity) \
+                and next < capacity and count <= capacity:
+            self.next = next
+            self.count = count
+        else:
+            # New file, or the layout changed: start over
+            self.buffer[:] = bytes(size)
+            self._write_header()
+
+    def _write_header(self):
+        RING_HEADER.pack_into(self.buffer, 0, RING_MAGIC, RING_VERSION, self.record.size, self.capacity,
+                              self.next, self.count)
+
+    def append(self, values):
+        self.record.pack_into(self.buffer, RING_HEADER.size + self.next * self.record.size, *values)
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._write_header()
+
+    def truncate(self, when: float):
+        # Drops the records at or after when, which are the newest ones
+        keep = self.bisect(when)
+        self.next = (self.next - (self.count - keep)) % self.capacity
+        self.count = keep
+        self._write_header()
+
+    def __len__(self):
+        return self.count
+
+    def records(self):
+        # Oldest first
+        start = self.next - self.count
+
+        for i in range(start, self.next):
+            yield self.record.unpack_from(self.buffer, RING_HEADER.size + (i % self.capacity) * self.record.size)
+
+    def timestamp(self, index: int) -> float:
+        # Timestamp (first field) of the index'th oldest record
+        offset = RING_HEADER.size + ((self.next - self.count + index) % self.capacity) * self.record.size
+        return TIMESTAMP.unpack_from(self.buffer, offset)[0]
+
+    def oldest(self):
+        return self.timestamp(0) if self.count else None
+
+    def bisect(self, when: float) -> int:
+        # Index of the first record at or after when (records are in time order)
+        lo, hi = 0, self.count
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) < when:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def slice(self, lo: int, hi: int) -> list:
+        # Records lo..hi-1 (oldest first), unpacked from at most two contiguous runs
+        result = []
+        first = self.next - self.count + lo
+
+        while lo < hi:
+            start = first % self.capacity
+            n = min(hi - lo, self.capacity - start)
+            offset = RING_HEADER.size + start * self.record.size
+            result += self.record.iter_unpack(memoryview(self.buffer)[offset:offset + n * self.record.size])
+            first += n
+            lo += n
+
+        return result
+
+    def flush(self):
+        if self._file is not None:
+            self.buffer.flush()
+
+    def close(self):
+        if self._file is not None:
+            self.buffer.flush()
+            self.buffer.close()
+            self._file.close()
+            self._file = None
+
+
+class Bucket:
+    # Running min/max/time weighted average of each series over one tier bucket. Values
+    # are treated as steps: each one holds until the next sample, so relay states (0/1)
+    # average out to a duty cycle.
+
+    def __init__(self, start: float, width: float, last: list, lastTime: float):
+        n = len(last)
+        self.start = start
+        self.end = start + width
+        self.mins = [NAN] * n
+        self.maxs = [NAN] * n
+        self.sums = [0.0] * n
+        self.weights = [0.0] * n
+        self.last = list(last)
+        self.lastTime = max(start, lastTime)
+
+        # A value carried over from the previous bucket counts for this one too
+        for i, value in enumerate(self.last):
+            if not math.isnan(value):
+                self.mins[i] = self.maxs[i] = value
+
+    def advance(self, until: float):
+        dt = until - self.lastTime
+
+        if dt > 0:
+            for i, value in enumerate(self.last):
+                if not math.isnan(value):
+                    self.sums[i] += value * dt
+                    self.weights[i] += dt
+
+        self.lastTime = max(self.lastTime, until)
+
+    def add(self, when: float, values: list):
+        self.advance(when)
+
+        for i, value in enumerate(values):
+            if not math.isnan(value):
+                if not value >= self.mins[i]:
+                    self.mins[i] = value
+                if not value <= self.maxs[i]:
+                    self.maxs[i] = value
+
+        self.last = list(values)
+
+    def snapshot(self, until: float) -> tuple:
+        # The record as if the bucket ended at until, without closing it
+        dt = max(0.0, min(until, self.end) - self.lastTime)
+        record = [self.start]
+
+        for i, value in enumerate(self.last):
+            total, weight = self.sums[i], self.weights[i]
+            if not math.isnan(value):
+                total += value * dt
+                weight += dt
+            record += [self.mins[i], total / weight if weight > 0 else value, self.maxs[i]]
+
+        return tuple(record)
+
+    def close(self) -> tuple:
+        self.advance(self.end)
+        return self.snapshot(self.end)
+
+
+class HistoryStore:
+    # Fixed size history of a set of numeric series. Every sample goes into a raw ring
+    # kept in RAM; each tier keeps one min/avg/max record per bucket in a memory mapped
+    # ring file, so neither RAM nor the SD card footprint grows over time. Missing or
+    # non numeric values (None, "n/a") are stored as NaN.
+    # The clock going back by up to maxStepBack seconds drops samples until it catches up
+    # again; a larger step is taken as the earlier time having been wrong: everything after
+    # the new time is dropped from the rings, and on_discontinuity(lastTime, when) is called.
+
+    def __init__(self, series, directory: str = None, rawCapacity: int = 3600, tiers=DEFAULT_TIERS, now=time.time,
+                 maxStepBack: float = 300.0, on_discontinuity=None):
+        self.series = list(series)
+        self.directory = directory
+        self.now = now
+        self.maxStepBack = maxStepBack
+        self.on_discontinuity = on_discontinuity
+        self.samples = 0
+        self.discontinuities = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._last = [NAN] * len(self.series)
+        self._lastTime = 0.0
+
+        self.raw = RecordRing(struct.Struct("<d" + "f" * len(self.series)), rawCapacity)
+        self.tiers = {}
+        self.widths = {}
+        self._buckets = {}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        tierStruct = struct.Struct("<d" + "fff" * len(self.series))
+
+        for name, width, capacity in tiers:
+            filename = None if directory is None else os.path.join(directory, "history_" + name + ".ring")
+            self.tiers[name] = RecordRing(tierStruct, capacity, filename)
+            self.widths[name] = width
+            self._buckets[name] = None
+
+            # A saved bucket was closed by a sample at or after its end; starting from there
+            # keeps the rings in time order when the clock comes up behind (no RTC)
+            ring = self.tiers[name]
+            if len(ring):
+                self._lastTime = max(self._lastTime, ring.timestamp(len(ring) - 1) + width)
+
+    def record(self, values: dict, when: float = None):
+        # values maps series names to numbers (or None); series left out keep their last value
+        when = self.now() if when is None else when
+
+        with self._lock:
+            if self.closed or when < MIN_VALID_TIME:
+                return
+
+            # The rings have to stay in time order
+            if when < self._lastTime:
+                if self._lastTime - when <= self.maxStepBack:
+                    return
+                self._step_back(when)
+
+            sample = list(self._last)
+            for i, name in enumerate(self.series):
+                if name in values:
+                    try:
+                        sample[i] = float(values[name])
+                    except (TypeError, ValueError):
+                        sample[i] = NAN
+
+            self.raw.append([when] + sample)
+
+            for name, ring in self.tiers.items():
+                width = self.widths[name]
+                bucket = self._buckets[name]
+
+                if bucket is not None and when >= bucket.end:
+                    ring.append(bucket.close())
+                    bucket = None
+
+                if bucket is None:
+                    bucket = Bucket(when - when % width, width, self._last, self._lastTime)
+                    self._buckets[name] = bucket
+
+                bucket.add(when, sample)
+
+            self._last = sample
+            self._lastTime = when
+            self.samples += 1
+
+    def _step_back(self, when: float):
+        lastTime = self._lastTime
+
+        self.raw.truncate(when)
+        for name, ring in self.tiers.items():
+            # The bucket when falls into is started over
+            ring.truncate(when - when % self.widths[name])
+            self._buckets[name] = None
+
+        self._lastTime = when
+        self.discontinuities += 1
+
+        if self.on_discontinuity is not None:
+            self.on_discontinuity(lastTime, when)
+
+    def flush(self):
+        with self._lock:
+            for ring in self.tiers.values():
+                ring.flush()
+
+    def close(self):
+        # The bucket in progress is not written, it is only partly covered
+        with self._lock:
+            self.closed = True
+            for ring in self.tiers.values():
+                ring.close()
+
+    def tier_names(self) -> list:
+        return [RAW_TIER] + list(self.tiers)
+
+    def _select_tier(self, start: float, end: float, points: int) -> str:
+        # The coarsest tier that still has at least points buckets over the range, moving
+        # to coarser tiers while it does not reach back to start (or as far as any tier does)
+        names = self.tier_names()
+        rings = [self.raw] + list(self.tiers.values())
+        widths = [0] + list(self.widths.values())
+
+        oldest = [ring.oldest() for ring in rings]
+        known = [when for when in oldest if when is not None]
+        reach = max(start, min(known)) if known else start
+
+        chosen = 0
+        for i, width in enumerate(widths):
+            if width <= (end - start) / points:
+                chosen = i
+
+        for i in range(chosen, len(names)):
+            if oldest[i] is not None and oldest[i] <= reach:
+                return names[i]
+
+        return names[chosen]
+
+    def query(self, start: float, end: float, series=None, points: int = 300, tier: str = None) -> dict:
+        # Columnar min/avg/max of the series between start and end, in at most points
+        # buckets, served from the best fitting tier (or the given one)
+        names = self.series if series is None else list(series)
+
+        for name in names:
+            if name not in self.series:
+                raise ValueError("Unknown series: " + str(name))
+
+        if tier is None:
+            tier = self._select_tier(start, end, max(1, points))
+        elif tier not in self.tier_names():
+            raise ValueError("Unknown tier: " + str(tier))
+
+        width = self.widths.get(tier, 0)
+        step = max(width, (end - start) / max(1, points))
+        if width:
+            step = math.ceil(step / width) * width
+
+        # Only the copy out of the ring happens under the lock
+        with self._lock:
+            if tier == RAW_TIER:
+                ring = self.raw
+            else:
+                ring = self.tiers[tier]
+
+            records = ring.slice(ring.bisect(start - width), ring.bisect(end))
+
+            bucket = self._buckets.get(tier)
+            if bucket is not None and bucket.start < end and not self.closed:
+                records.append(bucket.snapshot(self._lastTime))
+
+        # Raw records are (ts, value, ...), tier records (ts, min, avg, max, ...)
+        stride = 1 if tier == RAW_TIER else 3
+        columns = [self.series.index(name) * stride + 1 for name in names]
+
+        times = []
+        groups = []
+        key = None
+
+        for record in records:
+            when = record[0]
+            if when + width <= start:
+                continue
+
+            groupKey = when - when % step
+
+            if groupKey != key:
+                key = groupKey
+                times.append(key)
+                groups.append([[NAN, 0.0, 0, NAN] for name in names])
+
+            group = groups[-1]
+
+            for slot, column in zip(group, columns):
+                if stride == 1:
+                    low = average = high = record[column]
+                else:
+                    low, average, high = record[column:column + 3]
+
+                if not math.isnan(average):
+                    slot[1] += average
+                    slot[2] += 1
+                if not math.isnan(low) and not low >= slot[0]:
+                    slot[0] = low
+                if not math.isnan(high) and not high <= slot[3]:
+                    slot[3] = high
+
+        def value(number):
+            return None if math.isnan(number) else round(number, 2)
+
+        result = {
+            "tier": tier,
+            "step": step,
+            "start": start,
+            "end": end,
+            "t": [int(when) for when in times],
+            "series": {}
+        }
+
+        for i, name in enumerate(names):
+            result["series"][name] = {
+                "min": [value(group[i][0]) for group in groups],
+                "avg": [value(group[i][1] / group[i][2]) if group[i][2] else None for group in groups],
+                "max": [value(group[i][3]) for group in groups]
+            }
+
+        return result
@@ -0,0 +1,37 @@
+import os
+import re
+
+PLACEHOLDER = re.compile(r"@@(\w+)@@")
+
+
+class HtmlTemplate:
+    # An html page with @@name@@ slots, split into literal/slot parts once at load time.
+    # The file is re-read only when its mtime changes.
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.mtime = None
+        self.slots = ()
+        self._parts = ()
+
+    def _load(self, mtime):
+        with open(self.filename, "r") as file:
+            text = file.read()
+
+        # re.split with a capture group alternates literal text and slot names: [lit, name, lit, name, ..., lit]
+        parts = PLACEHOLDER.split(text)
+        self._parts = tuple(parts)
+        self.slots = frozenset(parts[1::2])
+        self.mtime = mtime
+
+    def render(self, values: dict) -> str:
+        mtime = os.stat(self.filename).st_mtime_ns
+        if mtime != self.mtime:
+            self._load(mtime)
+
+        parts = list(self._parts)
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            parts[i] = values[name] if name in values else "@@" + name + "@@"
+
+        return "".join(parts)
@@ -1,13 +1,18 @@
 import time
 
 class HysteresisTimer:
-    def __init__(self, interval: float):
+    def __init__(self, interval: float, now=time.monotonic):
         self.interval = interval
-        self.last_trigger_time = time.monotonic()
+        self.now = now
+        self.last_trigger_time = now()
 
     def check(self) -> bool:
-        current_time = time.monotonic()
+        current_time = self.now()
         if current_time - self.last_trigger_time >= self.interval:
             self.last_trigger_time = current_time
             return True
         return False
+
+    def reset(self):
+        # The next check() passes right away
+        self.last_trigger_time = self.now() - self.interval
@@ -0,0 +1,112 @@
+import threading
+from collections import deque
+
+
+class LogPipeline:
+    # Decouples log() callers (the control loop, MQTT and web threads) from the actual
+    # output. Records go into a bounded ring and a writer thread hands them to the sink
+    # in batches, so a slow file system or broker never stalls the caller. When the ring
+    # is full the oldest record is dropped and counted; the sink is told how many were
+    # lost through on_overflow before the next batch.
+
+    def __init__(self, sink, capacity: int = 1024, batchSize: int = 64, flushInterval: float = 0.5,
+                 on_overflow=None):
+        self.sink = sink
+        self.capacity = capacity
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.on_overflow = on_overflow
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self._records = deque()
+        self._unreported = 0
+        self._busy = False
+        self._flushing = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="LogPipeline", daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        with self._cond:
+            if self._closed:
+                return
+
+            if len(self._records) >= self.capacity:
+                self._records.popleft()
+                self.dropped += 1
+                self._unreported += 1
+
+            self._records.append(record)
+            self.submitted += 1
+
+            # Only wake the writer once a batch is worth writing, otherwise it picks
+            # the records up after flushInterval
+            if len(self._records) >= self.batchSize:
+                self._cond.notify_all()
+
+    def pending(self) -> int:
+        return len(self._records)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        # Waits until everything submitted so far has been handed to the sink. Returns
+        # False if that did not happen within timeout (or the writer is not running).
+        with self._cond:
+            if self._thread is None:
+                return not self._records
+
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: not self._records and not self._busy, timeout=timeout)
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout: float = 5.0):
+        self.flush(timeout)
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and (not self._records or
+                                         (len(self._records) < self.batchSize and not self._flushing)):
+                    self._cond.wait(self.flushInterval)
+
+                if not self._records and self._closed:
+                    return
+
+                batch = [self._records.popleft() for i in range(min(self.batchSize, len(self._records)))]
+                unreported = self._unreported
+                self._unreported = 0
+                self._busy = True
+
+            if unreported and self.on_overflow is not None:
+                batch.insert(0, self.on_overflow(unreported))
+
+            try:
+                if batch:
+                    self.sink(batch)
+                    self.written += len(batch)
+                    self.batches += 1
+            except Exception:
+                self.errors += 1
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
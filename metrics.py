@@ -0,0 +1,254 @@
+import bisect
+import functools
+import threading
+import time
+
+# Default histogram buckets (seconds), from 1ms to 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_value(value) -> str:
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names, values, extra: str = "") -> str:
+    pairs = [name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    # Base of Counter/Gauge/Histogram. Updates never take a lock: each thread writes only
+    # to its own shard (created on its first update), and a scrape sums the shards. A
+    # scrape may miss an update that is in progress, which is fine for monitoring.
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelNames=(), labelValues=(), function=None):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.labelValues = tuple(labelValues)
+        self.function = function
+        self._children = {}
+        self._childLock = threading.Lock()
+        self._shards = {}
+
+    def labels(self, *values, **named):
+        # The child metric for one set of label values
+        if named:
+            values = tuple(named[name] for name in self.labelNames)
+        key = tuple(str(value) for value in values)
+
+        child = self._children.get(key)
+        if child is None:
+            with self._childLock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child(key)
+                    self._children[key] = child
+
+        return child
+
+    def _new_child(self, key):
+        return type(self)(self.name, self.help, self.labelNames, key)
+
+    def _shard(self):
+        shard = self._shards.get(threading.get_ident())
+        if shard is None:
+            shard = self._new_shard()
+            self._shards[threading.get_ident()] = shard
+        return shard
+
+    def _new_shard(self):
+        return [0.0]
+
+    def samples(self):
+        # (suffix, label string, value) tuples for the exposition format
+        if self.function is not None:
+            return [("", format_labels(self.labelNames, self.labelValues), self.function())]
+        return [("", format_labels(self.labelNames, self.labelValues),
+                 sum(shard[0] for shard in list(self._shards.values())))]
+
+    def collect(self):
+        metrics = list(self._children.values()) if self.labelNames and not self.labelValues else [self]
+        for metric in metrics:
+            yield from metric.samples()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1):
+        self._shard()[0] += amount
+
+    def value(self) -> float:
+        return self.samples()[0][2]
+
+
+class Gauge(Metric):
+    # Gauges are set rather than added to, so there is a single value instead of shards
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    def samples(self):
+        value = self.function() if self.function is not None else self._value
+        return [("", format_labels(self.labelNames, self.labelValues), value)]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelNames=(), labelValues=(), function=None,
+                 buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelNames, labelValues, function)
+
+    def _new_child(self, key):
+        return Histogram(self.name, self.help, self.labelNames, key, buckets=self.buckets)
+
+    def _new_shard(self):
+        # One count per bucket (the last one is +Inf), then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value: float):
+        shard = self._shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def time(self):
+        return HistogramTimer(self)
+
+    def timed(self, func):
+        # Decorator observing the duration of every call
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    def samples(self):
+        totals = [0] * (len(self.buckets) + 2)
+        for shard in list(self._shards.values()):
+            for i, value in enumerate(shard):
+                totals[i] += value
+
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), totals):
+            cumulative += count
+            result.append(("_bucket", format_labels(self.labelNames, self.labelValues, 'le="' + format_value(bound) + '"'),
+                           cumulative))
+
+        labels = format_labels(self.labelNames, self.labelValues)
+        result.append(("_sum", labels, totals[-1]))
+        result.append(("_count", labels, cumulative))
+
+        return result
+
+
+class HistogramTimer:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class MeteredLock:
+    # Wraps a Lock/RLock and records how long acquire() waited and (for the outermost
+    # acquire of a thread) how long the lock was held
+    def __init__(self, lock, waitHistogram: Histogram, holdHistogram: Histogram):
+        self.lock = lock
+        self.wait = waitHistogram
+        self.hold = holdHistogram
+        self._local = threading.local()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+
+        if acquired:
+            now = time.perf_counter()
+            depth = getattr(self._local, "depth", 0)
+            if depth == 0:
+                self.wait.observe(now - start)
+                self._local.since = now
+            self._local.depth = depth + 1
+
+        return acquired
+
+    def release(self):
+        depth = self._local.depth - 1
+        self._local.depth = depth
+
+        if depth == 0:
+            self.hold.observe(time.perf_counter() - self._local.since)
+
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelNames=(), function=None) -> Counter:
+        return self._add(Counter(self.prefix + name, help, labelNames, function=function))
+
+    def gauge(self, name: str, help: str, labelNames=(), function=None) -> Gauge:
+        return self._add(Gauge(self.prefix + name, help, labelNames, function=function))
+
+    def histogram(self, name: str, help: str, labelNames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self.prefix + name, help, labelNames, buckets=buckets))
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        lines = []
+
+        for metric in self.metrics:
+            lines.append("# HELP " + metric.name + " " + metric.help.replace("\\", "\\\\").replace("\n", "\\n"))
+            lines.append("# TYPE " + metric.name + " " + metric.type)
+
+            for suffix, labels, value in metric.collect():
+                try:
+                    lines.append(metric.name + suffix + labels + " " + format_value(value))
+                except (TypeError, ValueError):
+                    pass
+
+        return "\n".join(lines) + "\n"
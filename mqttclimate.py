@@ -0,0 +1,119 @@
+import json
+
+MODES = ("off", "heat", "cool")
+FAN_MODES = ("auto", "on")
+PRESET_HOLD = "hold"
+PRESET_NONE = "none"
+
+PAYLOAD_ONLINE = "online"
+PAYLOAD_OFFLINE = "offline"
+
+_ON = ("on", "1", "true", "yes", PRESET_HOLD)
+_OFF = ("off", "0", "false", "no", "auto", PRESET_NONE)
+
+
+def climate_state(current) -> dict:
+    # Compact state of a ThermostatState snapshot, in the terms of a Home Assistant climate entity
+    mode = "heat" if current.heat else "cool" if current.cool else "off"
+
+    if current.heatOn:
+        action = "heating"
+    elif current.coolOn:
+        action = "cooling"
+    elif current.fanOn:
+        action = "fan"
+    else:
+        action = "idle" if mode != "off" else "off"
+
+    return {
+        "temp": current.currentTemp,
+        "setpoint": current.setTemp,
+        "mode": mode,
+        "action": action,
+        "fan": "on" if current.fan else "auto",
+        "preset": PRESET_HOLD if current.hold else PRESET_NONE
+    }
+
+
+def climate_payload(current) -> str:
+    return json.dumps(climate_state(current), separators=(",", ":"))
+
+
+def parse_switch(payload: str) -> bool:
+    # on/off style command payloads, including Home Assistant's fan (auto) and preset (hold/none) modes
+    value = payload.strip().lower()
+
+    if value in _ON:
+        return True
+    if value in _OFF:
+        return False
+
+    raise ValueError("Expected on or off, got: " + repr(payload))
+
+
+def parse_mode(payload: str) -> dict:
+    # The heat/cool state changes for a mode command payload
+    mode = payload.strip().lower()
+
+    if mode not in MODES:
+        raise ValueError("Expected one of " + ", ".join(MODES) + ", got: " + repr(payload))
+
+    return {"heat": mode == "heat", "cool": mode == "cool"}
+
+
+def parse_setpoint(payload: str, minTemp: float, maxTemp: float, tempStep: float) -> float:
+    # A setpoint command payload, rounded to the temperature step and kept within range
+    temp = float(payload)
+
+    if temp != temp:
+        raise ValueError("Setpoint is not a number")
+
+    if tempStep:
+        temp = round(round(temp / tempStep) * tempStep, 2)
+
+    return min(max(temp, minTemp), maxTemp)
+
+
+def discovery_config(prefix: str, nodeID: str, name: str, topics: dict, minTemp: float, maxTemp: float,
+                     tempStep: float, units: str, version: str) -> tuple:
+    # (topic, payload) of the retained Home Assistant MQTT discovery message for the thermostat.
+    # topics holds the state, availability and setpoint/mode/fan/hold command topics.
+    config = {
+        "name": None,
+        "unique_id": nodeID + "_climate",
+        "availability_topic": topics["availability"],
+        "payload_available": PAYLOAD_ONLINE,
+        "payload_not_available": PAYLOAD_OFFLINE,
+        "current_temperature_topic": topics["state"],
+        "current_temperature_template": "{{ value_json.temp }}",
+        "temperature_command_topic": topics["setpoint"],
+        "temperature_state_topic": topics["state"],
+        "temperature_state_template": "{{ value_json.setpoint }}",
+        "mode_command_topic": topics["mode"],
+        "mode_state_topic": topics["state"],
+        "mode_state_template": "{{ value_json.mode }}",
+        "modes": list(MODES),
+        "action_topic": topics["state"],
+        "action_template": "{{ value_json.action }}",
+        "fan_mode_command_topic": topics["fan"],
+        "fan_mode_state_topic": topics["state"],
+        "fan_mode_state_template": "{{ value_json.fan }}",
+        "fan_modes": list(FAN_MODES),
+        "preset_mode_command_topic": topics["hold"],
+        "preset_mode_state_topic": topics["state"],
+        "preset_mode_value_template": "{{ value_json.preset }}",
+        "preset_modes": [PRESET_HOLD],
+        "min_temp": minTemp,
+        "max_temp": maxTemp,
+        "temp_step": tempStep,
+        "precision": 0.1,
+        "temperature_unit": units.upper(),
+        "device": {
+            "identifiers": [nodeID],
+            "name": name,
+            "model": "Raspberry Pi Thermostat",
+            "sw_version": version
+        }
+    }
+
+    return prefix + "/climate/" + nodeID + "/config", json.dumps(config, separators=(",", ":"))
@@ -0,0 +1,185 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from statestore import atomic_write
+
+KIND_STATE = "state"
+KIND_EVENT = "event"
+KIND_IMPORTANT = "important"
+
+
+class Queued:
+    # Returned instead of paho's MQTTMessageInfo for a message kept in the outbox
+    rc = 0
+
+
+QUEUED = Queued()
+
+
+class OutboxChannel:
+    # The outbox as a publish(topic, payload, qos, retain) target for one kind of message
+    def __init__(self, outbox, kind: str):
+        self.outbox = outbox
+        self.kind = kind
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False):
+        return self.outbox.publish(topic, payload, qos, retain, self.kind)
+
+
+class MqttOutbox:
+    # Outbound messages only go to the MQTT client while it is connected. While it is not,
+    # they wait here, in bounded space, by kind:
+    #   state     - only the newest message per topic is kept
+    #   event     - up to capacity messages, the oldest are dropped first
+    #   important - also written to a small spool file (oldest dropped beyond
+    #               spoolCapacity), so they survive a restart while offline
+    # After a (re)connect a background thread drains them in batches: important first,
+    # then events, then states. Messages published meanwhile queue up behind them.
+
+    def __init__(self, client, capacity: int = 256, spoolFile: str = None, spoolCapacity: int = 200,
+                 batchSize: int = 32, batchInterval: float = 0.05):
+        self.client = client
+        self.capacity = capacity
+        self.spoolFile = spoolFile
+        self.spoolCapacity = spoolCapacity
+        self.batchSize = batchSize
+        self.batchInterval = batchInterval
+        self.online = False
+        self.dropped = 0
+        self.spooled = 0
+        self.drained = 0
+        self._states = collections.OrderedDict()
+        self._events = collections.deque()
+        self._spool = collections.deque()
+        self._draining = False
+        self._lock = threading.Lock()
+
+        self.states = OutboxChannel(self, KIND_STATE)
+        self.events = OutboxChannel(self, KIND_EVENT)
+        self.important = OutboxChannel(self, KIND_IMPORTANT)
+
+        if spoolFile is not None and os.path.exists(spoolFile):
+            try:
+                with open(spoolFile, "r") as file:
+                    self._spool.extend(tuple(message) for message in json.load(file)[-spoolCapacity:])
+            except (OSError, ValueError, TypeError):
+                pass
+
+    def pending(self) -> int:
+        return len(self._states) + len(self._events) + len(self._spool)
+
+    def _save_spool(self):
+        if self.spoolFile is not None:
+            atomic_write(self.spoolFile, json.dumps(list(self._spool)))
+
+    def _enqueue(self, message: tuple, kind: str):
+        # Called with the lock held
+        if kind == KIND_STATE:
+            self._states.pop(message[0], None)
+            self._states[message[0]] = message
+        elif kind == KIND_IMPORTANT:
+            if len(self._spool) >= self.spoolCapacity:
+                self._spool.popleft()
+                self.dropped += 1
+            self._spool.append(message)
+            self.spooled += 1
+            self._save_spool()
+        else:
+            if len(self._events) >= self.capacity:
+                self._events.popleft()
+                self.dropped += 1
+            self._events.append(message)
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False, kind: str = KIND_EVENT):
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+
+        message = (topic, payload, qos, retain)
+
+        with self._lock:
+            if not self.online or self._draining:
+                self._enqueue(message, kind)
+                return QUEUED
+
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+
+        if info.rc != 0:
+            # Lost the connection in between
+            with self._lock:
+                self.online = False
+                self._enqueue(message, kind)
+            return QUEUED
+
+        return info
+
+    def connected(self):
+        # Called from the client's on_connect
+        with self._lock:
+            self.online = True
+            if self._draining or not self.pending():
+                return
+            self._draining = True
+
+        threading.Thread(target=self._drain, name="MqttOutbox", daemon=True).start()
+
+    def disconnected(self):
+        with self._lock:
+            self.online = False
+
+    def _take(self) -> list:
+        # The next batch as (kind, message) pairs, removed from the queues (lock held)
+        batch = []
+
+        while len(batch) < self.batchSize:
+            if self._spool:
+                batch.append((KIND_IMPORTANT, self._spool.popleft()))
+            elif self._events:
+                batch.append((KIND_EVENT, self._events.popleft()))
+            elif self._states:
+                batch.append((KIND_STATE, self._states.popitem(last=False)[1]))
+            else:
+                break
+
+        return batch
+
+    def _requeue(self, batch: list):
+        # Puts unsent messages back in front, in their original order (lock held)
+        for kind, message in reversed(batch):
+            if kind == KIND_IMPORTANT:
+                self._spool.appendleft(message)
+            elif kind == KIND_EVENT:
+                self._events.appendleft(message)
+            elif message[0] not in self._states:
+                self._states[message[0]] = message
+                self._states.move_to_end(message[0], last=False)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch = self._take() if self.online else []
+                spoolChanged = any(kind == KIND_IMPORTANT for kind, message in batch)
+
+                if not batch:
+                    self._draining = False
+                    return
+
+            for i, (kind, (topic, payload, qos, retain)) in enumerate(batch):
+                if self.client.publish(topic, payload, qos=qos, retain=retain).rc != 0:
+                    with self._lock:
+                        self.online = False
+                        self._requeue(batch[i:])
+                        self._draining = False
+                        if spoolChanged:
+                            self._save_spool()
+                    return
+
+                self.drained += 1
+
+            if spoolChanged:
+                with self._lock:
+                    self._save_spool()
+
+            time.sleep(self.batchInterval)
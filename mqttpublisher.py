@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+class StatePublisher:
+    # Sends a topic only when its payload differs from the last one sent, or when heartbeat
+    # seconds have passed since then (0 disables the heartbeat), so callers can publish
+    # their state on every control loop pass. State topics are retained by default, so a
+    # late subscriber gets the current value from the broker right away.
+
+    def __init__(self, client, heartbeat: float = 300.0, now=time.monotonic):
+        self.client = client
+        self.heartbeat = heartbeat
+        self.now = now
+        self.sent = 0
+        self.suppressed = 0
+        # topic -> (payload, qos, retain, time sent)
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = True, force: bool = False) -> bool:
+        # Returns True if the message was handed to the client
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+
+        now = self.now()
+
+        with self._lock:
+            last = self._last.get(topic)
+
+            if not force and last is not None and last[0] == payload and last[2] == retain \
+                    and not (self.heartbeat and now - last[3] >= self.heartbeat):
+                self.suppressed += 1
+                return False
+
+            self._last[topic] = (payload, qos, retain, now)
+            self.sent += 1
+
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+
+        if info.rc != 0:
+            # Not sent (eg. not connected): forget it, so the next publish goes out again
+            with self._lock:
+                if self._last.get(topic, (None,))[0] == payload:
+                    del self._last[topic]
+            return False
+
+        return True
+
+    def republish(self):
+        # Sends the last payload of every topic again, eg. on (re)connect: the broker may
+        # have lost its retained messages, or missed messages while disconnected
+        now = self.now()
+
+        with self._lock:
+            messages = [(topic, payload, qos, retain) for topic, (payload, qos, retain, sent) in self._last.items()]
+            for topic, payload, qos, retain in messages:
+                self._last[topic] = (payload, qos, retain, now)
+
+        for topic, payload, qos, retain in messages:
+            self.client.publish(topic, payload, qos=qos, retain=retain)
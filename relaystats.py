@@ -0,0 +1,188 @@
+import copy
+import datetime
+import threading
+import time
+
+from weeklyschedule import week_start
+
+PERIODS = ("hour", "day", "week")
+
+PERIOD_SECONDS = {"hour": 60 * 60, "day": 24 * 60 * 60, "week": 7 * 24 * 60 * 60}
+
+
+def period_start(period: str, when: float) -> float:
+    # Local time, so days and weeks start at midnight
+    start = datetime.datetime.fromtimestamp(when).replace(minute=0, second=0, microsecond=0)
+
+    if period == "day":
+        start = start.replace(hour=0)
+    elif period == "week":
+        start = week_start(start)
+
+    return start.timestamp()
+
+
+def period_end(period: str, start: float) -> float:
+    # Start of the following period; the slack covers 23/25 hour days around DST changes
+    return period_start(period, start + PERIOD_SECONDS[period] * 1.25)
+
+
+def new_counters(start: float) -> dict:
+    return {"start": start, "onTime": 0.0, "cycles": 0, "shortCycles": 0, "cycleTime": 0.0}
+
+
+class RelayStats:
+    # Runtime accounting per relay: on time, completed cycles, their total length and the
+    # cycles shorter than shortCycle seconds, for the current hour, day and week, the
+    # previous ones, and in total. update() is called with the relay state on every
+    # control loop pass; it only does work on a transition or period rollover, and then
+    # a constant amount. Counters are kept in a StateStore, so they survive restarts.
+
+    def __init__(self, relays, store, shortCycle: float = 300.0, now=time.time):
+        self.relays = list(relays)
+        self.store = store
+        self.shortCycle = shortCycle
+        self.now = now
+        self._lock = threading.Lock()
+        self._state = {}
+        self._ends = {}
+
+        when = now()
+
+        for relay in self.relays:
+            state = store.get(relay) if store.exists(relay) else {}
+            periods = state.get("periods", {})
+            self._state[relay] = {
+                # Relays are switched off on start up, a cycle cut short by a restart is lost
+                "on": False,
+                "since": when,
+                "periods": {period: periods.get(period, new_counters(period_start(period, when)))
+                            for period in PERIODS},
+                "previous": state.get("previous", {}),
+                "total": state.get("total", new_counters(when))
+            }
+            self._ends[relay] = {period: period_end(period, self._state[relay]["periods"][period]["start"])
+                                 for period in PERIODS}
+
+    def _credit(self, state: dict, counters: dict, until: float):
+        if state["on"]:
+            counters["onTime"] += max(0.0, until - max(state["since"], counters["start"]))
+
+    def _rollover(self, relay: str, when: float) -> bool:
+        state = self._state[relay]
+        ends = self._ends[relay]
+        rolled = False
+
+        for period in PERIODS:
+            if when < ends[period]:
+                continue
+
+            counters = state["periods"][period]
+            self._credit(state, counters, ends[period])
+            state["previous"][period] = counters
+
+            start = period_start(period, when)
+            state["periods"][period] = new_counters(start)
+            ends[period] = period_end(period, start)
+            rolled = True
+
+        return rolled
+
+    def _save(self, relay: str):
+        # Copies, the store compares against what it was given last time
+        state = copy.deepcopy(self._state[relay])
+        self.store.put(relay, periods=state["periods"], previous=state["previous"], total=state["total"])
+
+    def update(self, relay: str, on: bool, when: float = None) -> bool:
+        # Returns True if the relay changed state or a period rolled over
+        when = self.now() if when is None else when
+        on = bool(on)
+
+        with self._lock:
+            state = self._state[relay]
+            changed = self._rollover(relay, when)
+
+            if on != state["on"]:
+                if not on:
+                    length = when - state["since"]
+                    short = length < self.shortCycle
+
+                    for counters in list(state["periods"].values()) + [state["total"]]:
+                        self._credit(state, counters, when)
+                        counters["cycles"] += 1
+                        counters["cycleTime"] += length
+                        counters["shortCycles"] += short
+
+                state["on"] = on
+                state["since"] = when
+                changed = True
+
+            if changed:
+                self._save(relay)
+
+        return changed
+
+    def close(self, when: float = None):
+        # Credit the on time of running cycles (without counting them), eg. before restart()
+        when = self.now() if when is None else when
+
+        with self._lock:
+            for relay in self.relays:
+                state = self._state[relay]
+                self._rollover(relay, when)
+
+                if state["on"]:
+                    for counters in list(state["periods"].values()) + [state["total"]]:
+                        self._credit(state, counters, when)
+                    state["on"] = False
+                    state["since"] = when
+
+                self._save(relay)
+
+    @staticmethod
+    def _report(state: dict, counters: dict, end: float, when: float) -> dict:
+        onTime = counters["onTime"]
+        if state["on"] and when <= end:
+            onTime += max(0.0, when - max(state["since"], counters["start"]))
+
+        elapsed = max(0.0, min(when, end) - counters["start"])
+        cycles = counters["cycles"]
+
+        return {
+            "start": int(counters["start"]),
+            "onTime": round(onTime),
+            "dutyCycle": round(onTime / elapsed, 3) if elapsed > 0 else 0.0,
+            "cycles": cycles,
+            "averageCycle": round(counters["cycleTime"] / cycles) if cycles else None,
+            "shortCycles": counters["shortCycles"]
+        }
+
+    def snapshot(self, when: float = None) -> dict:
+        when = self.now() if when is None else when
+        result = {}
+
+        with self._lock:
+            for relay in self.relays:
+                state = self._state[relay]
+                if self._rollover(relay, when):
+                    self._save(relay)
+
+                report = {
+                    "on": state["on"],
+                    "since": int(state["since"]),
+                    "total": self._report(state, state["total"], when, when),
+                    "previous": {}
+                }
+
+                for period in PERIODS:
+                    report[period] = self._report(state, state["periods"][period], self._ends[relay][period], when)
+
+                    previous = state["previous"].get(period)
+                    if previous is not None:
+                        # Completed periods: on time is final, the relay state no longer matters
+                        report["previous"][period] = self._report({"on": False}, previous,
+                                                                  period_end(period, previous["start"]), when)
+
+                result[relay] = report
+
+        return result
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+#
+# Offline simulation of the thermostat control loop, for tuning without live hardware.
+#
+# The thermostat module is imported headless, with FakeRPi standing in for the GPIO relays
+# and the 1-Wire sensor, and its control tick (check_sensor_temp / change_system_settings,
+# plus the Faikin decision) is driven on a simulated clock, as fast as it runs. The room
+# temperature comes from a recorded trace, or from a simple thermal model of the room that
+# reacts to the relays or, with the Faikin enabled (or --hvac faikin), to the Faikin commands.
+# At the end, relay cycles, comfort error and the CPU time per tick are reported.
+#
+# Usage:
+#   python3 simulator.py [--hours 24] [--mode heat] [--set-temp 21.5] [--strategy pi] [--hvac faikin] [--json]
+#   python3 simulator.py --trace room.csv
+#
+# A trace is a CSV file of "seconds,temperature[,outside]" lines (from the start of the
+# trace, in the thermostat's temperature scale); lines that do not parse, like a header,
+# are skipped. Run it from the thermostat directory, so thermostat_settings.json is used.
+# Nothing the thermostat keeps on disk (state, relay stats, history, log) is touched: importing
+# the module writes nothing (its main(), which opens the log and history files, is not run)
+# and isolate() points everything that saves at a temporary directory or RAM.
+
+import argparse
+import bisect
+import datetime
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import FakeRPi.GPIO
+import FakeRPi.w1thermsensor
+
+# Never the real relays or sensor, even on a Pi
+sys.modules["RPi"] = sys.modules["FakeRPi"]
+sys.modules["RPi.GPIO"] = FakeRPi.GPIO
+sys.modules["w1thermsensor"] = FakeRPi.w1thermsensor
+
+if "--headless" not in sys.argv:
+    sys.argv.append("--headless")
+
+import thermostat
+from faikincontroller import FaikinController, create_strategy
+from historystore import HistoryStore
+from relaystats import RelayStats
+from statestore import StateStore
+
+
+class SimulatedClock:
+    # Stands in for time.time and time.monotonic; only advance() moves it
+    def __init__(self, start: float):
+        self.start = start
+        self.elapsed = 0.0
+
+    def time(self) -> float:
+        return self.start + self.elapsed
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def advance(self, seconds: float):
+        self.elapsed += seconds
+
+
+class RoomModel:
+    # First order thermal model: the room loses heat to the outside with time constant tau
+    # (hours), heating adds heatRate and cooling removes coolRate degrees per hour, scaled by
+    # level (the Faikin demand, 1.0 for the relays). The HVAC output follows with a lag
+    # (minutes), so the room overshoots like a real one.
+
+    def __init__(self, temp: float, tau: float = 8.0, heatRate: float = 6.0, coolRate: float = 6.0,
+                 lag: float = 5.0):
+        self.temp = temp
+        self.tau = tau * 3600.0
+        self.heatRate = heatRate / 3600.0
+        self.coolRate = coolRate / 3600.0
+        self.lag = lag * 60.0
+        self.output = 0.0
+
+    def step(self, seconds: float, outside: float, heatOn: bool, coolOn: bool, level: float = 1.0) -> float:
+        target = (self.heatRate if heatOn else -self.coolRate if coolOn else 0.0) * level
+        self.output += (target - self.output) * (min(1.0, seconds / self.lag) if self.lag else 1.0)
+        self.temp += (outside - self.temp) * seconds / self.tau + self.output * seconds
+
+        return self.temp
+
+
+class DailyOutside:
+    # Outside temperature swinging by amplitude around mean, coldest at 5:00
+    def __init__(self, mean: float, amplitude: float):
+        self.mean = mean
+        self.amplitude = amplitude
+
+    def __call__(self, when: float) -> float:
+        local = datetime.datetime.fromtimestamp(when)
+        hour = local.hour + local.minute / 60.0 + local.second / 3600.0
+
+        return self.mean - self.amplitude * math.cos(2.0 * math.pi * (hour - 5.0) / 24.0)
+
+
+class Trace:
+    # A recorded temperature trace, replayed open loop: the value at a time is the last
+    # one recorded at or before it
+    def __init__(self, filename: str):
+        self.times = []
+        self.temps = []
+        self.outside = []
+
+        with open(filename, encoding="utf-8") as file:
+            for line in file:
+                fields = line.strip().split(",")
+                try:
+                    values = [float(field) for field in fields[:3]]
+                except ValueError:
+                    continue
+
+                if len(values) < 2:
+                    continue
+
+                self.times.append(values[0])
+                self.temps.append(values[1])
+                self.outside.append(values[2] if len(values) > 2 else None)
+
+        if not self.times:
+            raise ValueError("No samples in trace " + filename)
+
+    @property
+    def duration(self) -> float:
+        return self.times[-1] - self.times[0]
+
+    def at(self, seconds: float) -> tuple:
+        i = max(0, bisect.bisect_right(self.times, self.times[0] + seconds) - 1)
+
+        return self.temps[i], self.outside[i]
+
+
+class FaikinUnit:
+    # What the Faikin controlled unit is doing: the last control command it got (a None
+    # command keeps the setting)
+    def __init__(self):
+        self.command = None
+
+    def update(self, command):
+        if command is not None:
+            self.command = command
+
+    def output(self) -> tuple:
+        # (heating, cooling, level) for RoomModel.step
+        command = self.command
+        if command is None or not command["power"]:
+            return False, False, 0.0
+
+        return command["mode"] == "H", command["mode"] == "C", command["demand"] / 100.0
+
+
+def raw_sensor_temp(temp: float) -> float:
+    # What the sensor has to read (in degrees C, as FakeRPi keeps it) for the thermostat to
+    # see temp after calibration
+    raw = thermostat.freezingMeasured + (temp - thermostat.freezingPoint) * thermostat.measuredRange / \
+        thermostat.referenceRange
+
+    return raw if thermostat.tempScale == "metric" else (raw - 32.0) * 5.0 / 9.0
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def isolate(clock: SimulatedClock, workDir: str):
+    # Puts everything on the simulated clock, with no logging or MQTT, the state and relay
+    # stats saved in workDir and the history in RAM. Returns the (fake) sensor the thermostat reads.
+    thermostat.log = thermostat.log_dummy
+    thermostat.mqttEnabled = False
+    thermostat.state = StateStore(os.path.join(workDir, "thermostat_state.json"))
+    thermostat.relayStats = RelayStats(("heat", "cool", "fan"), StateStore(os.path.join(workDir, "relay_stats.json")),
+                                       shortCycle=thermostat.shortCycleTime, now=clock.time)
+    thermostat.historyStore = HistoryStore(thermostat.HISTORY_SERIES, now=clock.time)
+
+    sensor = FakeRPi.w1thermsensor.W1ThermSensor()
+    thermostat.tempSampler.sensor = sensor
+    thermostat.init_gpio()
+
+    return sensor
+
+
+def use_strategy(clock: SimulatedClock, strategy: str = None) -> str:
+    # A fresh Faikin controller on the simulated clock, with the given (default: configured) strategy
+    strategy = strategy or thermostat.faikinStrategy
+    options = thermostat.faikinStrategyOptions if strategy == thermostat.faikinStrategy else {}
+    thermostat.faikinController = FaikinController(create_strategy(strategy, **options),
+                                                   minChangeInterval=thermostat.faikinMinChangeInterval,
+                                                   now=clock.monotonic)
+
+    return strategy
+
+
+def simulate(args) -> dict:
+    clock = SimulatedClock(datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+    workDir = tempfile.mkdtemp(prefix="thermostat-sim-")
+    sensor = isolate(clock, workDir)
+    strategy = use_strategy(clock, args.strategy)
+
+    current = thermostat.thermostatModel.current
+    setTemp = current.setTemp if args.set_temp is None else args.set_temp
+    thermostat.update_state(setTemp=setTemp, heat=args.mode == "heat", cool=args.mode == "cool", fan=False)
+
+    trace = Trace(args.trace) if args.trace else None
+    duration = trace.duration if trace is not None else args.hours * 3600.0
+    tick = args.tick or thermostat.tempCheckInterval
+    outside = DailyOutside(args.outside, args.outside_swing)
+    room = RoomModel(setTemp if args.start_temp is None else args.start_temp, tau=args.tau,
+                     heatRate=args.heat_rate, coolRate=args.cool_rate, lag=args.lag)
+    hvac = args.hvac or ("faikin" if thermostat.faikinEnabled else "relays")
+    unit = FaikinUnit()
+
+    tickTimes = []
+    absError = 0.0
+    sqError = 0.0
+    maxError = 0.0
+    ticks = 0
+    started = time.perf_counter()
+
+    while clock.elapsed <= duration:
+        current = thermostat.thermostatModel.current
+
+        if trace is not None:
+            roomTemp, outsideTemp = trace.at(clock.elapsed)
+            if outsideTemp is None:
+                outsideTemp = outside(clock.time())
+        else:
+            outsideTemp = outside(clock.time())
+            if not ticks:
+                roomTemp = room.temp
+            elif hvac == "faikin":
+                roomTemp = room.step(tick, outsideTemp, *unit.output())
+            else:
+                roomTemp = room.step(tick, outsideTemp, current.heatOn, current.coolOn)
+
+        sensor.set_temperature(raw_sensor_temp(roomTemp))
+        thermostat.update_state(outsideTemp=round(outsideTemp, 1))
+
+        cpuStart = time.thread_time()
+        thermostat.tempSampler.sample()
+        thermostat.check_sensor_temp(tick)
+        current = thermostat.thermostatModel.current
+        command = thermostat.faikin_command(current, thermostat.get_state_json(current))
+        tickTimes.append(time.thread_time() - cpuStart)
+
+        error = roomTemp - setTemp
+        absError += abs(error)
+        sqError += error * error
+        maxError = max(maxError, abs(error))
+        ticks += 1
+
+        unit.update(command)
+
+        clock.advance(tick)
+
+    wall = time.perf_counter() - started
+    stats = thermostat.relayStats.snapshot()
+    shutil.rmtree(workDir, ignore_errors=True)
+
+    return {
+        "simulated": {"hours": round(duration / 3600.0, 2), "ticks": ticks, "tick": tick,
+                      "source": args.trace or "model", "hvac": hvac, "mode": args.mode, "setTemp": setTemp},
+        "speed": round(duration / wall) if wall else None,
+        "relays": {relay: {"cycles": report["total"]["cycles"],
+                           "shortCycles": report["total"]["shortCycles"],
+                           "onHours": round(report["total"]["onTime"] / 3600.0, 2)}
+                   for relay, report in stats.items()},
+        "comfort": {"meanAbsError": round(absError / ticks, 3) if ticks else 0.0,
+                    "rmsError": round(math.sqrt(sqError / ticks), 3) if ticks else 0.0,
+                    "maxError": round(maxError, 3)},
+        "faikin": {"strategy": strategy, "settingChanges": thermostat.faikinController.changes},
+        "tickCpuMicros": {"mean": round(sum(tickTimes) / len(tickTimes) * 1e6, 1) if tickTimes else 0.0,
+                          "p50": round(percentile(tickTimes, 0.5) * 1e6, 1),
+                          "p95": round(percentile(tickTimes, 0.95) * 1e6, 1),
+                          "max": round(max(tickTimes, default=0.0) * 1e6, 1)}
+    }
+
+
+def print_report(result: dict):
+    simulated = result["simulated"]
+    print("Simulated %.2f hours (%d ticks of %ss, %s, %s, %s to %s) at %sx real time" % (
+        simulated["hours"], simulated["ticks"], simulated["tick"], simulated["source"], simulated["hvac"],
+        simulated["mode"], simulated["setTemp"], result["speed"]))
+
+    for relay, counts in result["relays"].items():
+        print("  %-5s %4d cycles, %4d short, %6.2f h on" % (relay, counts["cycles"], counts["shortCycles"],
+                                                          counts["onHours"]))
+
+    comfort = result["comfort"]
+    print("  comfort error: mean %.3f, rms %.3f, max %.3f" % (comfort["meanAbsError"], comfort["rmsError"],
+                                                             comfort["maxError"]))
+    faikin = result["faikin"]
+    print("  faikin (%s): %d fan/demand changes" % (faikin["strategy"], faikin["settingChanges"]))
+    cpu = result["tickCpuMicros"]
+    print("  tick CPU (us): mean %.1f, p50 %.1f, p95 %.1f, max %.1f" % (cpu["mean"], cpu["p50"], cpu["p95"],
+                                                                       cpu["max"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline thermostat control loop simulation")
+    parser.add_argument("--headless", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--trace", help="CSV trace of seconds,temperature[,outside] to replay")
+    parser.add_argument("--hours", type=float, default=24.0, help="simulated time without a trace (default 24)")
+    parser.add_argument("--tick", type=float, help="seconds between control ticks (default tempCheckInterval)")
+    parser.add_argument("--mode", choices=("heat", "cool", "off"), default="heat")
+    parser.add_argument("--set-temp", type=float, help="set temperature (default: the saved one)")
+    parser.add_argument("--start-temp", type=float, help="room temperature at the start (default: set temperature)")
+    parser.add_argument("--outside", type=float, default=5.0, help="mean outside temperature (default 5)")
+    parser.add_argument("--outside-swing", type=float, default=5.0, help="day/night outside swing (default 5)")
+    parser.add_argument("--tau", type=float, default=8.0, help="room heat loss time constant, hours (default 8)")
+    parser.add_argument("--heat-rate", type=float, default=6.0, help="heating, degrees per hour (default 6)")
+    parser.add_argument("--cool-rate", type=float, default=6.0, help="cooling, degrees per hour (default 6)")
+    parser.add_argument("--lag", type=float, default=5.0, help="HVAC response lag, minutes (default 5)")
+    parser.add_argument("--strategy", help="Faikin control strategy (default: faikin.strategy)")
+    parser.add_argument("--hvac", choices=("relays", "faikin"),
+                        help="what heats/cools the model room (default: faikin if enabled, else relays)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    result = simulate(args)
+
+    if args.json:
+        print(json.dumps(result, indent=4))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
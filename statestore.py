@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import threading
+
+
+def atomic_write(filename: str, text: str):
+    # Write to a temp file in the same directory and rename it over the target,
+    # so a power cut leaves either the old or the new file, never a truncated one
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmpName = tempfile.mkstemp(prefix="." + os.path.basename(filename) + ".", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmpName, filename)
+    except BaseException:
+        try:
+            os.unlink(tmpName)
+        except OSError:
+            pass
+        raise
+
+    try:
+        dirFd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
+    except OSError:
+        pass
+
+
+class StateStore:
+    # Drop-in for the subset of kivy's JsonStore used for thermostat_state.json
+    # (exists/get/put), but put() only marks changed fields dirty and the file
+    # is rewritten once per debounce window instead of on every call.
+
+    def __init__(self, filename: str, debounce: float = 5.0):
+        self.filename = filename
+        self.debounce = debounce
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._writeLock = threading.Lock()
+        self._dirty = set()
+        self._timer = None
+        self._data = {}
+
+        try:
+            with open(filename, "r") as file:
+                self._data = json.load(file)
+        except (OSError, ValueError):
+            self._data = {}
+
+    def exists(self, key: str) -> bool:
+        return key in self._data
+
+    def get(self, key: str) -> dict:
+        return dict(self._data[key])
+
+    def is_dirty(self) -> bool:
+        return bool(self._dirty)
+
+    def put(self, key: str, **values) -> bool:
+        with self._lock:
+            current = self._data.setdefault(key, {})
+            changed = [field for field, value in values.items() if field not in current or current[field] != value]
+            if not changed:
+                return False
+
+            current.update(values)
+            self._dirty.update((key, field) for field in changed)
+
+            if self._timer is None:
+                self._timer = threading.Timer(self.debounce, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        return True
+
+    def flush(self):
+        # The fsync happens outside _lock, so put() on the control loop never waits on the disk
+        with self._writeLock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+                if not self._dirty:
+                    return
+
+                text = json.dumps(self._data, indent=4)
+                pending = self._dirty
+                self._dirty = set()
+
+            try:
+                atomic_write(self.filename, text)
+            except OSError:
+                with self._lock:
+                    self._dirty.update(pending)
+                raise
+
+            self.writes += 1
@@ -0,0 +1,72 @@
+import json
+import threading
+import uuid
+
+
+class VersionedJson:
+    # Holds a JSON document pre-serialized to bytes. The version (and so the ETag) only
+    # changes when the content does, so pollers can be answered with 304 Not Modified.
+
+    def __init__(self, tag: str = None):
+        self.tag = tag if tag is not None else uuid.uuid4().hex[:8]
+        self.data = None
+        # (version, etag, payload) is swapped as a single tuple, readers never see a torn update
+        self.current = (0, '"' + self.tag + '-0"', b"null")
+
+    def update(self, data) -> bool:
+        if data == self.data:
+            return False
+
+        version = self.current[0] + 1
+        payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        self.data = data
+        self.current = (version, '"' + self.tag + "-" + str(version) + '"', payload)
+
+        return True
+
+
+class StatusCache:
+    # The full status document plus one document per top level section. Updates may come
+    # from several threads, so writers are serialized; readers never take the lock.
+
+    def __init__(self):
+        self.tag = uuid.uuid4().hex[:8]
+        self.documents = {None: VersionedJson(self.tag)}
+        self._lock = threading.Lock()
+
+    def get(self, section=None):
+        return self.documents.get(section)
+
+    def update(self, status: dict) -> dict:
+        # Returns the sections that changed (empty if nothing did)
+        changed = {}
+
+        with self._lock:
+            if status == self.documents[None].data:
+                return changed
+
+            for section, data in status.items():
+                document = self.documents.get(section)
+                if document is None:
+                    document = VersionedJson(self.tag + "-" + section)
+                    self.documents[section] = document
+                if document.update(data):
+                    changed[section] = data
+
+            self.documents[None].update(status)
+
+        return changed
+
+
+def etag_matches(ifNoneMatch: str, etag: str) -> bool:
+    if not ifNoneMatch:
+        return False
+
+    for candidate in ifNoneMatch.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+
+    return False
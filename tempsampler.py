@@ -0,0 +1,52 @@
+import threading
+import time
+from collections import namedtuple
+
+# Immutable snapshot of the latest sensor sample. Readers grab the reference,
+# the sampling thread replaces it - no lock is needed on either side.
+TempReading = namedtuple("TempReading", ["raw", "corrected", "timestamp"])
+
+
+class TempSampler:
+    def __init__(self, sensor, units, interval: float, calibrate=None, on_error=None, latency=None):
+        self.sensor = sensor
+        self.units = units
+        self.interval = interval
+        self.calibrate = calibrate if calibrate is not None else (lambda raw: raw)
+        self.on_error = on_error
+        # Optional histogram (anything with observe(seconds)) for the sensor read time
+        self.latency = latency
+        self.errors = 0
+        self.latest = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.sensor is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="TempSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def sample(self) -> TempReading:
+        start = time.perf_counter()
+        try:
+            raw = self.sensor.get_temperature(self.units)
+        finally:
+            if self.latency is not None:
+                self.latency.observe(time.perf_counter() - start)
+        reading = TempReading(raw, self.calibrate(raw), time.monotonic())
+        self.latest = reading
+        return reading
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                self.errors += 1
+                if self.on_error is not None:
+                    self.on_error(e)
+            self._stop.wait(self.interval)
@@ -0,0 +1,33 @@
+from eventstream import EventBroadcaster
+
+
+def test_acquire_limits_subscribers():
+    events = EventBroadcaster(maxSubscribers=2)
+
+    assert events.acquire()
+    assert events.acquire()
+    assert not events.acquire()
+
+    events.release()
+    assert events.acquire()
+    assert events.subscribers == 2
+
+
+def test_no_subscribers_once_closed():
+    events = EventBroadcaster()
+    events.close()
+
+    assert not events.acquire()
+
+
+def test_subscriber_behind_the_backlog_resynchronises():
+    events = EventBroadcaster(backlog=2)
+    lastId = events.position()
+
+    events.publish("status", {"a": 1})
+    stream = events.subscribe(lastId)
+    assert next(stream).endswith(b'data: {"a":1}\n\n')
+
+    for i in range(3):
+        events.publish("status", {"a": i})
+    assert next(stream) is None
@@ -0,0 +1,61 @@
+from faikincontroller import DEFAULT_SETTING, ControlInputs, FaikinController, create_strategy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def heating(temp: float, target: float = 21.0) -> ControlInputs:
+    return ControlInputs(currentTemp=temp, targetTemp=target, roundedTemp=round(temp * 2) / 2, outsideTemp=5.0,
+                         mode="H", power=True)
+
+
+def setting(command):
+    return None if command is None else (command["fan"], command["demand"])
+
+
+def test_setting_held_back_is_applied_after_the_interval():
+    clock = FakeClock()
+    controller = FaikinController(create_strategy("step"), minChangeInterval=10, now=clock)
+
+    assert setting(controller.update(heating(21.0))) == DEFAULT_SETTING
+    clock.now = 2
+    assert setting(controller.update(heating(20.2))) == ("4", 95)
+
+    # Back at the target within the interval: the change waits
+    clock.now = 4
+    assert setting(controller.update(heating(21.0))) == ("4", 95)
+    clock.now = 8
+    assert controller.update(heating(21.0)) is None
+
+    # ... and is made once the interval is over, without the temperature moving again
+    clock.now = 12
+    assert setting(controller.update(heating(21.0))) == DEFAULT_SETTING
+    clock.now = 14
+    assert controller.update(heating(21.0)) is None
+    assert controller.changes == 3
+
+
+def test_target_change_skips_the_interval():
+    clock = FakeClock()
+    controller = FaikinController(create_strategy("step"), minChangeInterval=10, now=clock)
+
+    controller.update(heating(21.0))
+    clock.now = 2
+    assert setting(controller.update(heating(21.0, target=23.5))) == ("5", 100)
+
+
+def test_off_then_full_command_again():
+    clock = FakeClock()
+    controller = FaikinController(create_strategy("step"), now=clock)
+    controller.update(heating(21.0))
+
+    assert controller.off(heating(21.0))["power"] is False
+
+    clock.now = 3
+    command = controller.update(heating(21.0))
+    assert command["power"] is True and setting(command) == DEFAULT_SETTING
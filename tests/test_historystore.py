@@ -0,0 +1,98 @@
+import math
+import struct
+
+import pytest
+
+from historystore import HistoryStore, RecordRing, parse_duration
+
+# An hour boundary (UTC), in the valid clock range
+T0 = 1800000000.0
+
+PAIR = struct.Struct("<dd")
+
+
+def test_ring_wraps_around_oldest_first():
+    ring = RecordRing(PAIR, 4)
+    for i in range(6):
+        ring.append((float(i), i * 10.0))
+
+    assert len(ring) == 4
+    assert [record[0] for record in ring.records()] == [2.0, 3.0, 4.0, 5.0]
+    assert ring.oldest() == 2.0
+    assert ring.bisect(3.5) == 2
+    # Across the end of the buffer
+    assert ring.slice(1, 4) == [(3.0, 30.0), (4.0, 40.0), (5.0, 50.0)]
+
+
+def test_ring_truncate_drops_newest():
+    ring = RecordRing(PAIR, 4)
+    for i in range(6):
+        ring.append((float(i), 0.0))
+
+    ring.truncate(4.0)
+    ring.append((9.0, 0.0))
+
+    assert [record[0] for record in ring.records()] == [2.0, 3.0, 9.0]
+
+
+def test_tier_rollup_is_time_weighted():
+    store = HistoryStore(["a"], tiers=(("1m", 60, 10),))
+    store.record({"a": 10}, T0)
+    store.record({"a": 20}, T0 + 15)
+    store.record({"a": None}, T0 + 30)
+    store.record({"a": 0}, T0 + 60)
+
+    # 10 for 15s, 20 for 15s, nothing for 30s
+    assert list(store.tiers["1m"].records()) == [(T0, 10.0, 15.0, 20.0)]
+
+
+def test_reopen_keeps_records(tmp_path):
+    store = HistoryStore(["a"], str(tmp_path), tiers=(("1m", 60, 10),))
+    for i in range(5):
+        store.record({"a": i}, T0 + i * 60)
+    store.close()
+
+    store = HistoryStore(["a"], str(tmp_path), tiers=(("1m", 60, 10),))
+    assert [record[0] for record in store.tiers["1m"].records()] == [T0 + i * 60 for i in range(4)]
+
+    # Recording carries on after the saved buckets only
+    store.record({"a": 9}, T0 + 3 * 60)
+    assert store.samples == 0
+    store.record({"a": 9}, T0 + 5 * 60)
+    assert store.samples == 1
+
+
+def test_clock_stepping_far_back_truncates(tmp_path):
+    seen = []
+    store = HistoryStore(["a"], str(tmp_path), tiers=(("1m", 60, 100),),
+                         on_discontinuity=lambda lastTime, when: seen.append((lastTime, when)))
+    for i in range(10):
+        store.record({"a": i}, T0 + i * 60)
+
+    store.record({"a": 1}, T0 + 2 * 60 + 1)
+
+    assert seen == [(T0 + 9 * 60, T0 + 2 * 60 + 1)]
+    assert [record[0] for record in store.tiers["1m"].records()] == [T0, T0 + 60]
+    assert store.samples == 11
+
+
+def test_query_skips_missing_min_max():
+    store = HistoryStore(["a"])
+    for i, value in enumerate((5, None, 7)):
+        store.record({"a": value}, T0 + i)
+
+    result = store.query(T0 - 10, T0 + 10, points=1, tier="raw")["series"]["a"]
+
+    assert (result["min"], result["avg"], result["max"]) == ([5.0], [6.0], [7.0])
+
+
+@pytest.mark.parametrize("text", ["inf", "1e400", "nan", "0", "-5m"])
+def test_parse_duration_rejects(text):
+    with pytest.raises(ValueError):
+        parse_duration(text)
+
+
+def test_parse_duration_units():
+    assert parse_duration("90") == 90.0
+    assert parse_duration("15m") == 900.0
+    assert math.isclose(parse_duration("1.5h"), 5400.0)
@@ -0,0 +1,87 @@
+import json
+import time
+
+from mqttoutbox import QUEUED, MqttOutbox
+
+
+class Info:
+    def __init__(self, rc: int):
+        self.rc = rc
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+        self.rc = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if self.rc == 0:
+            self.sent.append((topic, payload))
+        return Info(self.rc)
+
+
+def wait_drained(outbox, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while outbox.pending() and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def test_events_overflow_drops_oldest():
+    outbox = MqttOutbox(FakeClient(), capacity=3)
+    for i in range(5):
+        assert outbox.events.publish("log", str(i)) is QUEUED
+
+    assert outbox.pending() == 3
+    assert outbox.dropped == 2
+    assert [message[1] for message in outbox._events] == ["2", "3", "4"]
+
+
+def test_states_keep_newest_per_topic():
+    outbox = MqttOutbox(FakeClient())
+    outbox.states.publish("temp", "20")
+    outbox.states.publish("set", "21")
+    outbox.states.publish("temp", "22")
+
+    assert outbox.pending() == 2
+    assert outbox.dropped == 0
+
+
+def test_spool_is_capped_and_survives_restart(tmp_path):
+    spool = str(tmp_path / "spool.json")
+    outbox = MqttOutbox(FakeClient(), spoolFile=spool, spoolCapacity=2)
+    for i in range(3):
+        outbox.important.publish("relay", str(i))
+
+    assert outbox.dropped == 1
+    assert [message[1] for message in json.load(open(spool))] == ["1", "2"]
+
+    client = FakeClient()
+    outbox = MqttOutbox(client, spoolFile=spool, spoolCapacity=2, batchInterval=0)
+    outbox.connected()
+    wait_drained(outbox)
+
+    assert client.sent == [("relay", "1"), ("relay", "2")]
+
+
+def test_drain_sends_important_then_events_then_states():
+    client = FakeClient()
+    outbox = MqttOutbox(client, batchSize=2, batchInterval=0)
+    outbox.states.publish("temp", "20")
+    outbox.events.publish("log", "a")
+    outbox.important.publish("relay", "1")
+
+    outbox.connected()
+    wait_drained(outbox)
+
+    assert client.sent == [("relay", "1"), ("log", "a"), ("temp", "20")]
+
+
+def test_failed_publish_goes_back_to_the_outbox():
+    client = FakeClient()
+    outbox = MqttOutbox(client)
+    outbox.connected()
+
+    client.rc = 4
+    assert outbox.events.publish("log", "a") is QUEUED
+    assert not outbox.online
+    assert outbox.pending() == 1
@@ -0,0 +1,56 @@
+from relaystats import RelayStats
+
+# Half past an hour, so the cycles below stay within one hour in any time zone
+T0 = 1800000000.0 + 30 * 60
+
+
+class DictStore:
+    # The part of StateStore that RelayStats uses
+    def __init__(self):
+        self.data = {}
+
+    def exists(self, key):
+        return key in self.data
+
+    def get(self, key):
+        return self.data[key]
+
+    def put(self, key, **values):
+        self.data[key] = values
+
+
+def test_short_cycles_are_counted():
+    stats = RelayStats(["heat"], DictStore(), shortCycle=300, now=lambda: T0)
+
+    stats.update("heat", True, T0)
+    stats.update("heat", False, T0 + 100)
+    stats.update("heat", True, T0 + 200)
+    stats.update("heat", False, T0 + 800)
+
+    for period in ("hour", "total"):
+        report = stats.snapshot(T0 + 900)["heat"][period]
+        assert report["cycles"] == 2
+        assert report["shortCycles"] == 1
+        assert report["onTime"] == 700
+        assert report["averageCycle"] == 350
+
+
+def test_cycle_of_exactly_short_cycle_is_not_short():
+    stats = RelayStats(["heat"], DictStore(), shortCycle=300, now=lambda: T0)
+
+    stats.update("heat", True, T0)
+    stats.update("heat", False, T0 + 300)
+
+    assert stats.snapshot(T0 + 400)["heat"]["total"]["shortCycles"] == 0
+
+
+def test_counters_survive_a_restart():
+    store = DictStore()
+    stats = RelayStats(["heat"], store, shortCycle=300, now=lambda: T0)
+    stats.update("heat", True, T0)
+    stats.update("heat", False, T0 + 60)
+
+    stats = RelayStats(["heat"], store, shortCycle=300, now=lambda: T0 + 120)
+    report = stats.snapshot(T0 + 120)["heat"]["total"]
+
+    assert (report["cycles"], report["shortCycles"], report["onTime"]) == (1, 1, 60)
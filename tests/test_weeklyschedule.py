@@ -0,0 +1,92 @@
+import datetime
+import threading
+import time
+
+from weeklyschedule import ScheduleRunner, WeeklyTimeline
+
+DAILY = {day: [["08:00", 21], ["20:00", 18]] for day in
+         ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")}
+
+
+class FakeClock:
+    def __init__(self, when: datetime.datetime):
+        self.when = when
+
+    def __call__(self):
+        return self.when
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def start_runner(clock):
+    applied = []
+    runner = ScheduleRunner(applied.append, lambda: False, maxSleep=0.01, now=clock)
+    runner.set_timeline(WeeklyTimeline(DAILY))
+    thread = threading.Thread(target=runner.run, daemon=True)
+    thread.start()
+    return runner, thread, applied
+
+
+def test_runner_applies_due_transition():
+    clock = FakeClock(datetime.datetime(2026, 1, 5, 19, 59))
+    runner, thread, applied = start_runner(clock)
+
+    try:
+        assert wait_for(lambda: runner.next_transition() is not None)
+        clock.when = datetime.datetime(2026, 1, 5, 20, 0, 1)
+        assert wait_for(lambda: applied == [18])
+    finally:
+        runner.stop()
+        thread.join(1.0)
+
+
+def test_runner_notices_clock_stepping_backwards():
+    # Booted with the clock years ahead, then NTP sets it back
+    clock = FakeClock(datetime.datetime(2030, 1, 7, 10, 0))
+    runner, thread, applied = start_runner(clock)
+
+    try:
+        assert wait_for(lambda: runner.next_transition() is not None)
+        assert runner.next_transition()[0].year == 2030
+
+        clock.when = datetime.datetime(2026, 1, 5, 19, 59)
+        assert wait_for(lambda: runner.next_transition()[0] == datetime.datetime(2026, 1, 5, 20, 0))
+
+        clock.when = datetime.datetime(2026, 1, 5, 20, 0, 1)
+        assert wait_for(lambda: applied == [18])
+    finally:
+        runner.stop()
+        thread.join(1.0)
+
+
+# Sunday night setback into monday morning, over the week boundary
+WEEKEND = {"sunday": [["22:00", 17]], "monday": [["06:00", 21]]}
+
+
+def test_next_after_wraps_into_next_week():
+    timeline = WeeklyTimeline(WEEKEND)
+
+    assert timeline.next_after(datetime.datetime(2026, 1, 4, 23, 0)) == (datetime.datetime(2026, 1, 5, 6, 0), 21)
+    assert timeline.next_after(datetime.datetime(2026, 1, 5, 6, 0)) == (datetime.datetime(2026, 1, 11, 22, 0), 17)
+
+
+def test_active_at_wraps_into_previous_week():
+    timeline = WeeklyTimeline(WEEKEND)
+
+    assert timeline.active_at(datetime.datetime(2026, 1, 5, 3, 0)) == 17
+    assert timeline.active_at(datetime.datetime(2026, 1, 5, 6, 0)) == 21
+    assert timeline.active_at(datetime.datetime(2026, 1, 4, 21, 59)) == 21
+
+
+def test_empty_timeline():
+    timeline = WeeklyTimeline()
+
+    assert timeline.next_after(datetime.datetime(2026, 1, 4)) is None
+    assert timeline.active_at(datetime.datetime(2026, 1, 4)) is None
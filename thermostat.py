@@ -33,6 +33,7 @@
 
 import datetime
 import json
+import math
 import os
 import os.path
 import gettext
@@ -42,13 +43,31 @@ import sys
 import threading
 import time
 import traceback
-import urllib.request
 import uuid
 
-from hysteresistimer import HysteresisTimer
-
-import kivy
-from kivy.core.window import Window
+from faikincontroller import FaikinController, ControlInputs, create_strategy
+from tempsampler import TempSampler
+from statestore import StateStore, atomic_write
+from htmltemplate import HtmlTemplate
+from statuscache import StatusCache, etag_matches
+from eventstream import EventBroadcaster
+from weatherservice import WeatherService, WeatherFeed
+from weeklyschedule import WeeklyTimeline, ScheduleRunner
+from logpipeline import LogPipeline
+from historystore import HistoryStore, parse_duration
+from relaystats import RelayStats
+from metrics import MetricsRegistry, MeteredLock
+from lockprofiler import LockProfiler, ProfiledLock
+from thermostatstate import ThermostatState, StateModel
+from mqttpublisher import StatePublisher
+from mqttoutbox import MqttOutbox
+from mqttclimate import climate_payload, discovery_config, parse_mode, parse_setpoint, parse_switch, \
+    PAYLOAD_ONLINE, PAYLOAD_OFFLINE
+
+# Headless mode (--headless) runs the control loop, scheduler, web server and MQTT without a
+# display: Kivy is never imported, widgets are plain attribute holders and a HeadlessClock
+# runs the callbacks on the main thread.
+headless = "--headless" in sys.argv
 
 ##############################################################################
 #                                                                            #
@@ -56,18 +75,30 @@ from kivy.core.window import Window
 #                                                                            #
 ##############################################################################
 
-kivy.require('2.1.0')  # replace with your current kivy version !
+if headless:
+    from headless import HeadlessClock, HeadlessWidget, JsonSettings
 
-from kivy.app import App
-from kivy.uix.togglebutton import ToggleButton
-from kivy.uix.label import Label
-from kivy.uix.floatlayout import FloatLayout
-from kivy.uix.image import Image
-from kivy.uix.slider import Slider
-from kivy.clock import Clock
-from kivy.graphics import Color, Rectangle
-from kivy.storage.jsonstore import JsonStore
-from kivy.uix.screenmanager import ScreenManager, Screen, NoTransition
+    Clock = HeadlessClock()
+    JsonStore = JsonSettings
+    ToggleButton = Label = Image = Slider = HeadlessWidget
+    # Base classes of the (unused) UI classes below
+    App = Screen = object
+else:
+    import kivy
+    from kivy.core.window import Window
+
+    kivy.require('2.1.0')  # replace with your current kivy version !
+
+    from kivy.app import App
+    from kivy.uix.togglebutton import ToggleButton
+    from kivy.uix.label import Label
+    from kivy.uix.floatlayout import FloatLayout
+    from kivy.uix.image import Image
+    from kivy.uix.slider import Slider
+    from kivy.clock import Clock
+    from kivy.graphics import Color, Rectangle
+    from kivy.storage.jsonstore import JsonStore
+    from kivy.uix.screenmanager import ScreenManager, Screen, NoTransition
 
 ##############################################################################
 #                                                                            #
@@ -76,7 +107,6 @@ from kivy.uix.screenmanager import ScreenManager, Screen, NoTransition
 ##############################################################################
 
 import cherrypy
-import schedule
 import subprocess
 import locale
 
@@ -112,7 +142,6 @@ except (ImportError, OSError, RuntimeError, Exception) as e:
 
 try:
     import paho.mqtt.client as mqtt
-    import paho.mqtt.publish as publish
 
     mqttAvailable = True
 except ImportError:
@@ -195,24 +224,44 @@ THERMOSTAT_VERSION = "2.2.1"
 
 debug = False
 useTestSchedule = False
-prevTemp = None
-prevTargetTemp = None
-fan_hysteresis_timer = HysteresisTimer(interval=10)
-
-Window.show_cursor = False
 
-# Threading Locks
-thermostatLock = threading.RLock()
-weatherLock = threading.Lock()
-scheduleLock = threading.RLock()
+if not headless:
+    Window.show_cursor = False
+
+# Process metrics, served in Prometheus text format at /metrics
+metrics = MetricsRegistry("thermostat_")
+
+sensorReadSeconds = metrics.histogram("sensor_read_seconds", "Temperature sensor read time",
+                                      buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0))
+controlTickSeconds = metrics.histogram("control_tick_seconds", "Duration of a check_sensor_temp control tick")
+lockWaitSeconds = metrics.histogram("lock_wait_seconds", "Time spent waiting to acquire thermostatLock")
+lockHoldSeconds = metrics.histogram("lock_hold_seconds", "Time thermostatLock was held")
+webRequestSeconds = metrics.histogram("web_request_seconds", "Web request time per route", ("route",))
+mqttConnects = metrics.counter("mqtt_connects_total", "MQTT broker connections and reconnections")
+mqttDisconnects = metrics.counter("mqtt_disconnects_total", "Unexpected MQTT broker disconnections")
+weatherFetchSeconds = metrics.histogram("weather_fetch_seconds", "Weather feed fetch time", ("feed",))
+weatherFetchFailures = metrics.counter("weather_fetch_failures_total", "Failed weather feed fetches", ("feed",))
+
+# Threading Locks, wrapped for the (opt-in) per call site contention profiler
+lockProfiler = LockProfiler()
+
+thermostatLock = ProfiledLock("thermostatLock", MeteredLock(threading.RLock(), lockWaitSeconds, lockHoldSeconds),
+                              lockProfiler)
+weatherLock = ProfiledLock("weatherLock", threading.Lock(), lockProfiler)
+scheduleLock = ProfiledLock("scheduleLock", threading.RLock(), lockProfiler)
+# Only serializes writers of the thermostat state model, readers never take it
+stateLock = ProfiledLock("stateLock", threading.Lock(), lockProfiler)
+# Serializes status publishing (snapshot, cache update and events) across the UI, web and MQTT threads
+statusLock = ProfiledLock("statusLock", threading.Lock(), lockProfiler)
 
 # Thermostat persistent settings
 settings = JsonStore("thermostat_settings.json")
-state = JsonStore("thermostat_state.json")
 
-# Internationalization (i18n)
+lockProfiler.enabled = bool(0 if not (settings.exists("profiling")) else settings.get("profiling").get("locks", 0))
+state = StateStore("thermostat_state.json", debounce=5.0)
+
+# Internationalization (i18n), the locale is set by main()
 t_locale = 'de_DE.utf8' if not (settings.exists("i18n")) else settings.get("i18n")["locale"]
-locale.setlocale(locale.LC_ALL, t_locale)
 gettext.install('thermostat', localedir='locales', names='gettext')
 
 # domesticwater
@@ -225,13 +274,24 @@ domestic_last_message_time = 0
 # Faikin (Daikin AC) setup:
 faikinEnabled = 0 if not (settings.exists("faikin")) else settings.get("faikin")["enabled"]
 faikinName = 'GuestAC' if not (settings.exists("faikin")) else settings.get("faikin")["name"]
-outside_temp = 0.0
+# Control strategy: "step" (fixed fan/demand steps), "pi" or "weather" (outside temperature curve),
+# tuned by an optional section of the same name, eg. "pi": {"kp": 15.0, "ki": 1.0}
+faikinStrategy = "step" if not (settings.exists("faikin")) else settings.get("faikin").get("strategy", "step")
+faikinStrategyOptions = {} if not (settings.exists("faikin")) else settings.get("faikin").get(faikinStrategy, {})
+faikinMinChangeInterval = 10 if not (settings.exists("faikin")) else settings.get("faikin").get("minChangeInterval", 10)
+faikinController = FaikinController(create_strategy(faikinStrategy, **faikinStrategyOptions),
+                                    minChangeInterval=faikinMinChangeInterval)
+metrics.counter("faikin_setting_changes_total", "Fan/demand changes sent to the Faikin",
+                function=lambda: faikinController.changes)
 # MQTT settings/setup
 
 def on_disconnect(client, userdata, rc, properties=None):
+    mqttOutbox.disconnected()
+
     if rc != 0:
+        mqttDisconnects.inc()
         print(f"Unexpected MQTT Broker disconnection! {rc}")
-        log(LOG_LEVEL_INFO, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT, f"Unexpected MQTT Broker disconnection: {rc}")
+        log(LOG_LEVEL_INFO, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT, "Unexpected MQTT Broker disconnection: %s", rc)
 
 def mqtt_on_connect(client, userdata, flags, rc, properties=None):
     global mqttReconnect
@@ -239,13 +299,26 @@ def mqtt_on_connect(client, userdata, flags, rc, properties=None):
     print("MQTT Connected with result code: " + str(rc))
 
     if rc == 0:
+        mqttConnects.inc()
+
         if mqttReconnect:
             log(LOG_LEVEL_STATE, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT,
-                "Reconnected to: " + mqttServer + ":" + str(mqttPort))
+                "Reconnected to: %s:%s", mqttServer, mqttPort)
         else:
             mqttReconnect = True
             log(LOG_LEVEL_STATE, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT,
-                "Connected to: " + mqttServer + ":" + str(mqttPort))
+                "Connected to: %s:%s", mqttServer, mqttPort)
+
+            # Records logged so far were queued until now
+            if loggingChannel == 'mqtt':
+                logPipeline.start()
+
+        # Send what queued up while offline, then the current state: the broker may have lost
+        # its retained messages
+        mqttOutbox.connected()
+        mqttPublisher.republish()
+        mqttPublisher.publish(mqttPub_availability, PAYLOAD_ONLINE)
+        publish_discovery()
 
         mqtt_subscriptions = [
             (mqttSub_restart, 0),  # Subscribe to restart commands
@@ -260,13 +333,17 @@ def mqtt_on_connect(client, userdata, flags, rc, properties=None):
             mqtt_subscriptions.append((mqttSub_faikin, 0))
 
         mqtt_subscriptions.append((mqttSub_state, 0))
+        mqtt_subscriptions.append((mqttSub_locks, 0))
+
+        for topic in (mqttSub_setpoint, mqttSub_mode, mqttSub_fan, mqttSub_hold):
+            mqtt_subscriptions.append((topic, 0))
         src = client.subscribe(mqtt_subscriptions)
 
         if src[0] == 0:
             log(LOG_LEVEL_INFO, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT,
-                "Subscribe Succeeded: " + mqttServer + ":" + str(mqttPort))
+                "Subscribe Succeeded: %s:%s", mqttServer, mqttPort)
         else:
-            log(LOG_LEVEL_ERROR, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT, "Subscribe FAILED, result code: " + src[0])
+            log(LOG_LEVEL_ERROR, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT, "Subscribe FAILED, result code: %s", src[0])
 
 
 if mqttAvailable:
@@ -276,15 +353,34 @@ if mqttAvailable:
     mqttServer = '127.0.0.1' if not (settings.exists("mqtt")) else settings.get("mqtt")["server"]
     mqttPort = 1883 if not (settings.exists("mqtt")) else settings.get("mqtt")["port"]
     mqttPubPrefix = "thermostat" if not (settings.exists("mqtt")) else settings.get("mqtt")["pubPrefix"]
+    # State topics are only published on change, and at least every heartbeat seconds (0: only on change)
+    mqttHeartbeat = 300 if not (settings.exists("mqtt")) else settings.get("mqtt").get("heartbeat", 300)
+    # Messages kept while the broker is unreachable (relay transitions are spooled to disk separately)
+    mqttQueueSize = 256 if not (settings.exists("mqtt")) else settings.get("mqtt").get("queueSize", 256)
+    # Home Assistant MQTT discovery (the thermostat shows up as a climate entity)
+    mqttDiscovery = 1 if not (settings.exists("mqtt")) else settings.get("mqtt").get("discovery", 1)
+    mqttDiscoveryPrefix = "homeassistant" if not (settings.exists("mqtt")) else settings.get("mqtt").get("discoveryPrefix", "homeassistant")
 
     mqttSub_version = str(mqttPubPrefix + "/" + mqttClientID + "/command/version")
     mqttSub_restart = str(mqttPubPrefix + "/" + mqttClientID + "/command/restart")
     mqttSub_loglevel = str(mqttPubPrefix + "/" + mqttClientID + "/command/loglevel")
     mqttSub_state = str(mqttPubPrefix + "/" + mqttClientID + "/command/state")
+    mqttSub_locks = str(mqttPubPrefix + "/" + mqttClientID + "/command/locks")
+    mqttSub_setpoint = str(mqttPubPrefix + "/" + mqttClientID + "/command/setpoint")
+    mqttSub_mode = str(mqttPubPrefix + "/" + mqttClientID + "/command/mode")
+    mqttSub_fan = str(mqttPubPrefix + "/" + mqttClientID + "/command/fan")
+    mqttSub_hold = str(mqttPubPrefix + "/" + mqttClientID + "/command/hold")
     mqttSub_faikin = str("Faikin/" + faikinName)
 
     mqttPub_state = str(mqttPubPrefix + "/" + mqttClientID + "/state/status")
     mqttPub_fanstate = str(mqttPubPrefix + "/" + mqttClientID + "/state/fan")
+    mqttPub_runtime = str(mqttPubPrefix + "/" + mqttClientID + "/state/runtime")
+    mqttPub_locks = str(mqttPubPrefix + "/" + mqttClientID + "/state/locks")
+    mqttPub_climate = str(mqttPubPrefix + "/" + mqttClientID + "/state/climate")
+    mqttPub_availability = str(mqttPubPrefix + "/" + mqttClientID + "/state/availability")
+
+    # Relay transition log messages not yet sent to the broker
+    MQTT_SPOOL_FILE_NAME = "mqtt_spool.json"
 
 else:
     mqttEnabled = False
@@ -313,64 +409,106 @@ LOG_LEVELS_STR = {v: k for k, v in LOG_LEVELS.items()}
 logFile = None
 
 
-def log_dummy(level, child_device, msg_subtype, msg, msg_type=MSG_TYPE_SET, timestamp=True, single=False):
-    pass
+def format_log_time(when):
+    return datetime.datetime.fromtimestamp(when).strftime("%Y-%m-%dT%H:%M:%S%z ")
+
+def format_log_msg(msg, args):
+    if not args:
+        return msg
+
+    try:
+        return msg % args
+    except (TypeError, ValueError):
+        return msg + " " + repr(args)
 
-def log_mqtt(level, child_device, msg_subtype, msg, msg_type=MSG_TYPE_SET, timestamp=True, single=False):
-    if level >= logLevel:
-        ts = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z ") if LOG_ALWAYS_TIMESTAMP or timestamp else ""
+# Log records are (time, level, child_device, msg_subtype, msg, args, msg_type, timestamp) tuples,
+# formatted and written out in batches by the log pipeline's writer thread
+
+def write_log_mqtt(records):
+    for when, level, child_device, msg_subtype, msg, args, msg_type, timestamp in records:
+        ts = format_log_time(when) if LOG_ALWAYS_TIMESTAMP or timestamp else ""
         topic = mqttPubPrefix + "/sensor/log/" + LOG_LEVELS_STR[
             level] + "/" + mqttClientID + "/" + child_device + "/" + msg_type + "/" + msg_subtype
-        payload = ts + msg
-
-        if single:
-            publish.single(topic, payload, hostname=mqttServer, port=mqttPort, client_id=mqttClientID)
+        # Relay transitions are kept (on disk) while offline, other log records may be dropped
+        if level == LOG_LEVEL_STATE and msg_subtype == MSG_SUBTYPE_BINARY_STATUS and \
+                child_device in (CHILD_DEVICE_HEAT, CHILD_DEVICE_COOL, CHILD_DEVICE_FAN):
+            mqttOutbox.important.publish(topic, ts + format_log_msg(msg, args))
         else:
-            mqttc.publish(topic, payload)
+            mqttOutbox.events.publish(topic, ts + format_log_msg(msg, args))
 
-def log_file(level, child_device, msg_subtype, msg, msg_type=MSG_TYPE_SET, timestamp=True, single=False):
-    if level >= logLevel:
-        ts = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z ")
-        logFile.write(
-            ts + LOG_LEVELS_STR[level] + "/" + child_device + "/" + msg_type + "/" + msg_subtype + ": " + msg + "\n")
+def write_log_file(records):
+    logFile.write("".join(
+        format_log_time(when) + LOG_LEVELS_STR[level] + "/" + child_device + "/" + msg_type + "/" + msg_subtype + ": " +
+        format_log_msg(msg, args) + "\n"
+        for when, level, child_device, msg_subtype, msg, args, msg_type, timestamp in records))
+    logFile.flush()
 
-def log_print(level, child_device, msg_subtype, msg, msg_type=MSG_TYPE_SET, timestamp=True, single=False):
-    if level >= logLevel:
-        ts = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z ") if LOG_ALWAYS_TIMESTAMP or timestamp else ""
-        print(ts + LOG_LEVELS_STR[level] + "/" + child_device + "/" + msg_type + "/" + msg_subtype + ": " + msg)
+def write_log_print(records):
+    print("\n".join(
+        (format_log_time(when) if LOG_ALWAYS_TIMESTAMP or timestamp else "") +
+        LOG_LEVELS_STR[level] + "/" + child_device + "/" + msg_type + "/" + msg_subtype + ": " + format_log_msg(msg, args)
+        for when, level, child_device, msg_subtype, msg, args, msg_type, timestamp in records))
 
+def log_overflow(dropped):
+    return (time.time(), LOG_LEVEL_ERROR, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/log",
+            "%d log messages dropped", (dropped,), MSG_TYPE_SET, True)
+
+
+def log_enabled(level, child_device):
+    # Callers with expensive set up (loops, computed values) check this before logging
+    return logPipeline is not None and level >= childLogLevels.get(child_device, logLevel)
+
+def log_dummy(level, child_device, msg_subtype, msg, *args, msg_type=MSG_TYPE_SET, timestamp=True, single=False):
+    pass
+
+def log_queued(level, child_device, msg_subtype, msg, *args, msg_type=MSG_TYPE_SET, timestamp=True, single=False):
+    # msg is either a %-style template formatted with args by the writer thread, or a
+    # callable returning the message, called only if the level is enabled.
+    # single is kept for compatibility: all channels now go through the pipeline's own
+    # connection/file, callers that need the message out flush the pipeline
+    if level >= childLogLevels.get(child_device, logLevel):
+        if callable(msg):
+            msg = msg()
+        logPipeline.submit((time.time(), level, child_device, msg_subtype, msg, args, msg_type, timestamp))
 
-loggingChannel = "none" if not (settings.exists("logging")) else settings.get("logging")["channel"]
-loggingLevel = "state" if not (settings.exists("logging")) else settings.get("logging")["level"]
 
 loggingChannel = "none" if not (settings.exists("logging")) else settings.get("logging")["channel"]
 loggingLevel = "state" if not (settings.exists("logging")) else settings.get("logging")["level"]
+# Per child device overrides, eg. {"faikin": "debug"}
+loggingChildLevels = {} if not (settings.exists("logging")) else settings.get("logging").get("childLevels", {})
 
-if loggingChannel == 'none':
-    log = log_dummy
-elif loggingChannel == 'mqtt' and mqttEnabled:
-    log = log_mqtt
+logPipeline = None
+
+# Records queue up until start_logging() (or, for MQTT, the connection to the broker) starts
+# the pipeline, so importing this module writes nothing
+if loggingChannel == 'mqtt' and mqttEnabled:
+    logPipeline = LogPipeline(write_log_mqtt, on_overflow=log_overflow)
 elif loggingChannel == 'file':
-    log = log_file
-    logFile = open(LOG_FILE_NAME, "a")
+    logPipeline = LogPipeline(write_log_file, on_overflow=log_overflow)
 elif loggingChannel == 'print':
-    log = log_print
+    logPipeline = LogPipeline(write_log_print, on_overflow=log_overflow)
+
+if logPipeline is None:
+    log = log_dummy  # 'none' and default case
 else:
-    log = log_dummy  # Default case
+    log = log_queued
 
-logLevel = LOG_LEVELS.get(loggingLevel, LOG_LEVEL_NONE)
+    metrics.gauge("log_queue_depth", "Log records waiting to be written", function=logPipeline.pending)
+    metrics.counter("log_dropped_total", "Log records dropped because the queue was full",
+                    function=lambda: logPipeline.dropped)
 
-# Send presentations for Node
+logLevel = LOG_LEVELS.get(loggingLevel, LOG_LEVEL_NONE)
+childLogLevels = {child: LOG_LEVELS.get(level, LOG_LEVEL_NONE) for child, level in loggingChildLevels.items()}
 
-log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_NAME, "Thermostat Starting Up...", msg_type=MSG_TYPE_PRESENTATION)
-log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_VERSION, THERMOSTAT_VERSION, msg_type=MSG_TYPE_PRESENTATION)
+def start_logging():
+    # Called by main(): opens the log file and writes out what was logged so far
+    global logFile
 
-# send presentations for all other child "sensors"
+    if loggingChannel == 'file':
+        logFile = open(LOG_FILE_NAME, "a")
 
-for i in range(len(CHILD_DEVICES)):
-    child = CHILD_DEVICES[i]
-    if child != CHILD_DEVICE_NODE:
-        log(LOG_LEVEL_STATE, child, child, "", msg_type=MSG_TYPE_PRESENTATION)
+    if logPipeline is not None and loggingChannel != 'mqtt':
+        logPipeline.start()
 
 # Various temperature settings:
 tempScale = settings.get("scale")["tempScale"]
@@ -384,50 +522,48 @@ windUnits = " km/h" if tempScale == "metric" else " mph"
 
 TEMP_TOLERANCE = 0.1 if tempScale == "metric" else 0.18
 
-currentTemp = 22.0 if tempScale == "metric" else 72.0
-domesticwater = "n/a"
 minFlowTemp = 65.0
 currentFlowTemp = 0.0
 
 priorCorrected = -100.0
-setTemp = 22.0 if not (state.exists("state")) else state.get("state")["setTemp"]
+
+# The thermostat state (temperatures, modes and relay outputs) is held in immutable snapshots.
+# update_state() is the only way to change it; everything else reads thermostatModel.current
+# once and works from that, without taking thermostatLock. The widgets are views of the model.
+thermostatModel = StateModel(ThermostatState(
+    setTemp=22.0 if not (state.exists("state")) else state.get("state")["setTemp"],
+    currentTemp=22.0 if tempScale == "metric" else 72.0
+), stateLock)
+
+# Clock trigger bringing the widgets in line with the model, created with the widgets
+stateViewTrigger = None
+
+def update_state(**changes):
+    # The single writer path of the thermostat state, safe to call from any thread. Returns
+    # the names of the fields that changed.
+    changed = thermostatModel.update(**changes)
+
+    if changed and stateViewTrigger is not None:
+        stateViewTrigger()
+
+    return changed
 
 tempHysteresis = 0.5 if not (settings.exists("thermostat")) else settings.get("thermostat")["tempHysteresis"]
 
 tempCheckInterval = 3 if not (settings.exists("thermostat")) else settings.get("thermostat")["tempCheckInterval"]
 
+# A sensor reading older than this (seconds) is not acted on: the heat and cool relays are switched off
+maxReadingAge = 60 if not (settings.exists("thermostat")) else settings.get("thermostat").get("maxReadingAge", 60)
+sensorStale = False
+
+# Relay cycles shorter than this (seconds) are counted as short cycles in the runtime stats
+shortCycleTime = 300 if not (settings.exists("thermostat")) else settings.get("thermostat").get("shortCycleTime", 300)
+
 minUIEnabled = 0 if not (settings.exists("thermostat")) else settings.get("thermostat")["minUIEnabled"]
 minUITimeout = 3 if not (settings.exists("thermostat")) else settings.get("thermostat")["minUITimeout"]
 minUITimer = None
 blackScreenTimer = None
 
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/tempScale", str(tempScale),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/scaleUnits", str(scaleUnits),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/precipUnits", str(precipUnits),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/precipFactor", str(precipFactor),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/sensorUnits", str(sensorUnits),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/windFactor", str(windFactor),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/windUnits", str(windUnits),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/currentTemp", str(currentTemp),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/setTemp", str(setTemp),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/tempHysteresis", str(tempHysteresis),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/tempCheckInterval",
-    str(tempCheckInterval), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/minUIEnabled", str(minUIEnabled),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/minUITimeout", str(minUITimeout),
-    timestamp=False)
-
 # Temperature calibration settings:
 
 elevation = 0 if not (settings.exists("thermostat")) else settings.get("calibration")["elevation"]
@@ -439,42 +575,39 @@ boilingMeasured = settings.get("calibration")["boilingMeasured"]
 freezingMeasured = settings.get("calibration")["freezingMeasured"]
 measuredRange = boilingMeasured - freezingMeasured
 
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/elevation", str(elevation),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/boilingPoint", str(boilingPoint),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/freezingPoint", str(freezingPoint),
-    timestamp=False)
-log(LOG_LEVEL_DEBUG, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/referenceRange",
-    str(referenceRange), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/boilingMeasured",
-    str(boilingMeasured), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/freezingMeasured",
-    str(freezingMeasured), timestamp=False)
-log(LOG_LEVEL_DEBUG, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/measuredRange", str(measuredRange),
-    timestamp=False)
-
 # UI Slider settings:
 
 minTemp = 15.0 if not (settings.exists("thermostat")) else settings.get("thermostat")["minTemp"]
 maxTemp = 30.0 if not (settings.exists("thermostat")) else settings.get("thermostat")["maxTemp"]
 tempStep = 0.5 if not (settings.exists("thermostat")) else settings.get("thermostat")["tempStep"]
 
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/UISlider/minTemp", str(minTemp), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/UISlider/maxTemp", str(maxTemp), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/UISlider/tempStep", str(tempStep),
-    timestamp=False)
-
 try:
     tempSensor = W1ThermSensor()
 except W1ThermSensor:
     tempSensor = None
 
+
+def calibrate_temp(rawTemp):
+    return (((rawTemp - freezingMeasured) * referenceRange) / measuredRange) + freezingPoint
+
+
+def sensor_read_failed(e):
+    log(LOG_LEVEL_ERROR, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEXT, "Sensor read FAILED: %s", e)
+
+
+# The 1-Wire conversion takes ~750ms, so the sensor is sampled on its own thread and
+# check_sensor_temp only picks up the latest calibrated reading
+tempSampler = TempSampler(tempSensor, sensorUnits, tempCheckInterval, calibrate=calibrate_temp,
+                          on_error=sensor_read_failed, latency=sensorReadSeconds)
+
+metrics.counter("sensor_read_errors_total", "Failed temperature sensor reads", function=lambda: tempSampler.errors)
+
 # PIR (Motion Sensor) setup:
 pirEnabled = 0 if not (settings.exists("pir")) else settings.get("pir")["pirEnabled"]
 pirPin = 5 if not (settings.exists("pir")) else settings.get("pir")["pirPin"]
 
-pirCheckInterval = 0.5 if not (settings.exists("pir")) else settings.get("pir")["pirCheckInterval"]
+# Debounce time (ms) for the PIR edge interrupts
+pirBounceTime = 200 if not (settings.exists("pir")) else settings.get("pir").get("pirBounceTime", 200)
 
 pirIgnoreFromStr = "00:00" if not (settings.exists("pir")) else settings.get("pir")["pirIgnoreFrom"]
 pirIgnoreToStr = "00:00" if not (settings.exists("pir")) else settings.get("pir")["pirIgnoreTo"]
@@ -482,40 +615,38 @@ pirIgnoreToStr = "00:00" if not (settings.exists("pir")) else settings.get("pir"
 pirIgnoreFrom = datetime.time(int(pirIgnoreFromStr.split(":")[0]), int(pirIgnoreFromStr.split(":")[1]))
 pirIgnoreTo = datetime.time(int(pirIgnoreToStr.split(":")[0]), int(pirIgnoreToStr.split(":")[1]))
 
-log(LOG_LEVEL_INFO, CHILD_DEVICE_PIR, MSG_SUBTYPE_ARMED, str(pirEnabled), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/pir/checkInterval", str(pirCheckInterval),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/pir/ignoreFrom", str(pirIgnoreFromStr),
-    timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/pir/ignoreTo", str(pirIgnoreToStr),
-    timestamp=False)
-
 # GPIO Pin setup and utility routines:
 
 coolPin = 18 if not (settings.exists("thermostat")) else settings.get("thermostat")["coolPin"]
 heatPin = 23 if not (settings.exists("thermostat")) else settings.get("thermostat")["heatPin"]
 fanPin = 25 if not (settings.exists("thermostat")) else settings.get("thermostat")["fanPin"]
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(coolPin, GPIO.OUT)
-GPIO.output(coolPin, GPIO.HIGH)
-GPIO.setup(heatPin, GPIO.OUT)
-GPIO.output(heatPin, GPIO.HIGH)
-GPIO.setup(fanPin, GPIO.OUT)
-GPIO.output(fanPin, GPIO.HIGH)
+def relay_outputs():
+    # Heat and cool relays are active low, the fan output is active high
+    return {
+        "heatOn": not GPIO.input(heatPin),
+        "coolOn": not GPIO.input(coolPin),
+        "fanOn": bool(GPIO.input(fanPin))
+    }
+
+def init_gpio():
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(coolPin, GPIO.OUT)
+    GPIO.output(coolPin, GPIO.HIGH)
+    GPIO.setup(heatPin, GPIO.OUT)
+    GPIO.output(heatPin, GPIO.HIGH)
+    GPIO.setup(fanPin, GPIO.OUT)
+    GPIO.output(fanPin, GPIO.HIGH)
 
-if pirEnabled:
-    GPIO.setup(pirPin, GPIO.IN)
+    if pirEnabled:
+        GPIO.setup(pirPin, GPIO.IN)
+
+    update_state(**relay_outputs())
 
 CHILD_DEVICE_HEAT = "heat"
 CHILD_DEVICE_COOL = "cool"
 CHILD_DEVICE_FAN = "fan"
 
-log(LOG_LEVEL_INFO, CHILD_DEVICE_COOL, MSG_SUBTYPE_BINARY_STATUS, str(coolPin), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_HEAT, MSG_SUBTYPE_BINARY_STATUS, str(heatPin), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_FAN, MSG_SUBTYPE_BINARY_STATUS, str(fanPin), timestamp=False)
-log(LOG_LEVEL_INFO, CHILD_DEVICE_PIR, MSG_SUBTYPE_TRIPPED, str(pirPin), timestamp=False)
-
 ##############################################################################
 #                                                                            #
 #       UI Controls/Widgets                                                  #
@@ -531,22 +662,39 @@ controlColours = {
     _("Hold"): (0.0, 1.0, 0.0, 0.4)
 }
 
-def setControlState(control, state):
-    with thermostatLock:
-        try:
-            control.state = state
-            if state == "normal":
-                control.background_color = controlColours["normal"]
-            else:
-                control.background_color = controlColours[control.text.replace("[b]", "").replace("[/b]", "")]
+# State model field of each control, by its (translated) label
+controlFields = {
+    _("Cool"): "cool",
+    _("Heat"): "heat",
+    _("Fan"): "fan",
+    _("Hold"): "hold"
+}
 
-            controlLabel = control.text.replace("[b]", "").replace("[/b]", "").lower()
-            log(LOG_LEVEL_STATE, controlLabel + CHILD_DEVICE_SUFFIX_UICONTROL, MSG_SUBTYPE_BINARY_STATUS,
-                "0" if state == "normal" else "1")
+def control_label(control):
+    return control.text.replace("[b]", "").replace("[/b]", "")
 
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
+def log_control_state(control, state):
+    log(LOG_LEVEL_STATE, control_label(control).lower() + CHILD_DEVICE_SUFFIX_UICONTROL, MSG_SUBTYPE_BINARY_STATUS,
+        "0" if state == "normal" else "1")
+
+def show_control_state(control, state):
+    # Only the widget, the model is not touched
+    control.state = state
+    if state == "normal":
+        control.background_color = controlColours["normal"]
+    else:
+        control.background_color = controlColours[control_label(control)]
+
+def setControlState(control, state):
+    # Kivy thread only (touch UI and start up)
+    try:
+        show_control_state(control, state)
+        update_state(**{controlFields[control_label(control)]: state != "normal"})
+        log_control_state(control, state)
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
 
 coolControl = ToggleButton(text="[b]" + _("Cool") + "[/b]",
                            markup=True,
@@ -576,42 +724,38 @@ holdControl = ToggleButton(text="[b]" + _("Hold") + "[/b]",
 
 setControlState(holdControl, "normal" if not (state.exists("state")) else state.get("state")["holdControl"])
 
-def get_status_info():
-    with thermostatLock:
-        sched = "None"
-
-        if holdControl.state == "down":
-            sched = _("Hold")
-        elif useTestSchedule:
-            sched = "Test"
-        elif heatControl.state == "down":
-            sched = _("Heat")
-        elif coolControl.state == "down":
-            sched = _("Cool")
-
-        status_info = {
-            'heat': f"[color=00ff00][b]" + _("On") + "[/b][/color]" if not GPIO.input(heatPin) else f"" + _("Off"),
-            'cool': f"[color=00ff00][b]" + _("On") + "[/b][/color]" if not GPIO.input(coolPin) else f"" + _("Off"),
-            'fan': f"[color=00ff00][b]" + _("On") + "[/b][/color]" if GPIO.input(fanPin) else f"" + _("Auto"),
-            'sched': sched
-        }
-
-        status_info_json = json.dumps(status_info)
-
-        return status_info_json
+def get_status(current=None):
+    current = thermostatModel.current if current is None else current
+    sched = "None"
+
+    if current.hold:
+        sched = _("Hold")
+    elif useTestSchedule:
+        sched = "Test"
+    elif current.heat:
+        sched = _("Heat")
+    elif current.cool:
+        sched = _("Cool")
+
+    return {
+        'heat': f"[color=00ff00][b]" + _("On") + "[/b][/color]" if current.heatOn else f"" + _("Off"),
+        'cool': f"[color=00ff00][b]" + _("On") + "[/b][/color]" if current.coolOn else f"" + _("Off"),
+        'fan': f"[color=00ff00][b]" + _("On") + "[/b][/color]" if current.fanOn else f"" + _("Auto"),
+        'sched': sched
+    }
 
 versionLabel = Label(text="Thermostat v" + str(THERMOSTAT_VERSION), size_hint=(None, None), font_size='10sp', markup=True, text_size=(150, 20))
-currentLabel = Label(text="[b]" + str(currentTemp) + scaleUnits + "[/b]", size_hint=(None, None), font_size='100sp', markup=True, text_size=(300, 200))
+currentLabel = Label(text="[b]" + str(thermostatModel.current.currentTemp) + scaleUnits + "[/b]", size_hint=(None, None), font_size='100sp', markup=True, text_size=(300, 200))
 currentWaterLabel = Label(text="[b]" + _("Domestic water") + "[/b]:", size_hint=(None, None), font_size='25sp', markup=True, text_size=(200, 100))
-currentWaterValueLabel = Label(text=str(domesticwater) + scaleUnits, size_hint=(None, None), font_size='25sp', markup=True, text_size=(100, 100))
+currentWaterValueLabel = Label(text=str(thermostatModel.current.domesticWater) + scaleUnits, size_hint=(None, None), font_size='25sp', markup=True, text_size=(100, 100))
 
 altCurLabel = Label(text=currentLabel.text, size_hint=(None, None), font_size='100sp', markup=True, text_size=(300, 200), color=(0.5, 0.5, 0.5, 0.2))
 altWaterLabel = Label(text=currentWaterLabel.text, size_hint=(None, None), font_size='50sp', markup=True, text_size=(500, 200), color=(0.5, 0.5, 0.5, 0.2))
 altWaterValueLabel = Label(text=currentWaterValueLabel.text, size_hint=(None, None), font_size='50sp', markup=True, text_size=(500, 200), color=(0.5, 0.5, 0.5, 0.2))
 
-setLabel = Label(text="  Set\n[b]" + str(setTemp) + scaleUnits + "[/b]", size_hint=(None, None), font_size='25sp', markup=True, text_size=(100, 100))
+setLabel = Label(text="  Set\n[b]" + str(thermostatModel.current.setTemp) + scaleUnits + "[/b]", size_hint=(None, None), font_size='25sp', markup=True, text_size=(100, 100))
 
-status_info = json.loads(get_status_info())
+status_info = get_status()
 
 statusHeatLabel = Label(text=_("Heat") + ":", size_hint=(None, None), font_size='20sp', markup=True, text_size=(90, 20), halign='left')
 statusCoolLabel = Label(text=_("Cool") + ":", size_hint=(None, None), font_size='20sp', markup=True, text_size=(90, 20), halign='left')
@@ -630,10 +774,39 @@ timeStr = time.strftime("%H:%M")
 timeLabel = Label(text="[b]" + (timeStr if timeStr[0:1] != "0" else timeStr[1:]) + "[/b]", size_hint=(None, None), font_size='40sp', markup=True, text_size=(180, 75))
 altTimeLabel = Label(text=timeLabel.text, size_hint=(None, None), font_size='40sp', markup=True, text_size=(180, 75), color=(0.4, 0.4, 0.4, 0.2))
 
-tempSlider = Slider(orientation='vertical', min=minTemp, max=maxTemp, step=tempStep, value=setTemp, size_hint=(None, None))
+tempSlider = Slider(orientation='vertical', min=minTemp, max=maxTemp, step=tempStep,
+                    value=thermostatModel.current.setTemp, size_hint=(None, None))
 
 screenMgr = None
 
+def refresh_state_view(dt=None):
+    # Renders the current model into the widgets, on the Kivy thread
+    current = thermostatModel.current
+
+    setLabel.text = "  Set\n[b]" + str(current.setTemp) + scaleUnits + "[/b]"
+    if tempSlider.value != current.setTemp:
+        tempSlider.value = current.setTemp
+
+    currentLabel.text = "[b]" + str(current.currentTemp) + scaleUnits + "[/b]"
+    altCurLabel.text = currentLabel.text
+
+    water = str(current.domesticWater) + ("" if current.domesticWater == "n/a" else scaleUnits)
+    currentWaterValueLabel.text = "[b]" + water + "[/b]"
+    altWaterValueLabel.text = currentWaterValueLabel.text
+
+    for control in (heatControl, coolControl, fanControl, holdControl):
+        controlState = "down" if getattr(current, controlFields[control_label(control)]) else "normal"
+        if control.state != controlState:
+            show_control_state(control, controlState)
+
+    status_info = get_status(current)
+    statusHeatValueLabel.text = status_info['heat']
+    statusCoolValueLabel.text = status_info['cool']
+    statusFanValueLabel.text = status_info['fan']
+    statusSchedValueLabel.text = status_info['sched']
+
+stateViewTrigger = Clock.create_trigger(refresh_state_view)
+
 
 ##############################################################################
 #                                                                            #
@@ -642,32 +815,34 @@ screenMgr = None
 ##############################################################################
 
 def get_faikin_status(message):
-    global outside_temp
     payload = message.payload.decode('utf-8')
     data = json.loads(payload)
     # Den Wert von "outside" auslesen
     outside_temp = data['outside']
 
+    if isinstance(outside_temp, list):
+        outside_temp = sum(outside_temp) / len(outside_temp) if outside_temp else 0.0
+
+    update_state(outsideTemp=outside_temp)
+    record_history()
+
     print(f"Empfangene Nachricht: {payload}")
 
-def get_state_json():
-    global outside_temp  # Um prevTemp innerhalb der Funktion verwenden und aktualisieren zu können
+def get_state_json(current=None):
+    current = thermostatModel.current if current is None else current
 
     autop = True
-    summer_temp = 14 if not (settings.exists("faikin")) else settings.get("faikin")["summer_temp"]
-
-    if isinstance(outside_temp, list):
-        outside_temp = sum(outside_temp) / len(outside_temp)
+    summer_temp = 14 if not (settings.exists("faikin")) else settings.get("faikin").get("summer_temp", 14)
 
-    if summer_temp < outside_temp:
+    if summer_temp < current.outsideTemp:
         heat_state = False
         autop = False
     else:
-        heat_state = heatControl.state == "down"
+        heat_state = current.heat
 
-    if heatControl.state == "down":
+    if current.heat:
         mode = "H"
-    elif coolControl.state == "down":
+    elif current.cool:
         mode = "C"
         if not heat_state:
             autop = True
@@ -675,12 +850,12 @@ def get_state_json():
         mode = "A"
         autop = False
 
-    targettemp = tempSlider.value
-    roundedtemp = round(currentTemp * 2) / 2
+    targettemp = current.setTemp
+    roundedtemp = round(current.currentTemp * 2) / 2
     targetdiff = targettemp - roundedtemp
 
     data = {
-        "env": currentTemp,
+        "env": current.currentTemp,
         "rounded": roundedtemp,
         "diff": targetdiff,
         "heat": heat_state,
@@ -690,92 +865,42 @@ def get_state_json():
     }
     return data
 
-def publish_faikin_mqtt_message():
-    global prevTemp, prevTargetTemp
+def faikin_inputs(current, state_data):
+    return ControlInputs(
+        currentTemp=state_data["env"],
+        targetTemp=state_data["autot"],
+        roundedTemp=state_data["rounded"],
+        outsideTemp=current.outsideTemp,
+        mode=state_data["mode"],
+        power=state_data["autop"]
+    )
+
+def faikin_command(current, state_data):
+    # The control command for a snapshot and its Faikin state (None: keep the setting)
+    return faikinController.update(faikin_inputs(current, state_data))
+
+def publish_faikin_mqtt_message(stopped=False):
+    # stopped: there is no current temperature to control on, the Faikin is switched off
     try:
-        state_data = get_state_json()
+        current = thermostatModel.current
+        state_data = get_state_json(current)
         payload = json.dumps(state_data)
-        mqttc.publish(mqttPub_state, payload)
+        mqttPublisher.publish(mqttPub_state, payload)
 
         if faikinEnabled:
-            targettemp = state_data["autot"]
-            mode = state_data["mode"]
-            power = state_data["autop"]
-            rounded_temp = state_data["rounded"]
-
-            tolerance = 0.2  # Erlaubte Temperaturschwankung
-            fan_hysteresis = 0.5  # Verhindert zu schnelle Lüfteränderungen
-
-            # Falls prevTemp oder currentTemp None ist, Initialisierung
-            if prevTemp is None:
-                prevTemp = currentTemp  # Erster Wert setzen, um Fehler zu vermeiden
-
-            if currentTemp is None:
-                return  # Ohne gültige aktuelle Temperatur kann keine Regelung stattfinden
-
-            delta_temp = currentTemp - prevTemp  # Differenz berechnen
-
-            # **Wichtig**: Zieltemperatur-Änderung hat immer Vorrang!
-            if prevTargetTemp is None or prevTargetTemp != targettemp:
-                prevTargetTemp = targettemp  # Neue Zieltemperatur speichern
-                fan_hysteresis_timer.last_trigger_time = 0  # Timer zurücksetzen, um sofort zu reagieren
-            # Kleine Temperaturschwankungen → Keine Regeländerung
-            elif abs(delta_temp) < tolerance:
-                mqtt_topic = f"command/{faikinName}/control"
-                mqttc.publish(mqtt_topic, payload)
-                return  # **MQTT-Message bleibt gleich, aber keine Steuerungsänderung!**
-
-            # **Regelung bei zu großer Abweichung**
-            if (mode == "H" and tempSlider.value + 4.0 < rounded_temp) or (mode == "C" and tempSlider.value - 4.0 > rounded_temp):
-                power = False
-
-            powerful = False  # Standardmäßig aus
-            fan = "3"  # Automatischer Modus als Standard
-            demand = 70
-
-            if mode == "H":  # Heizmodus
-                temp_diff = currentTemp - targettemp
-                if abs(temp_diff) <= tolerance:
-                    fan = "3"
-                    demand = 70
-                elif temp_diff > fan_hysteresis:
-                    fan = "1" if abs(temp_diff) > 3 else "2"
-                    demand = 30 if abs(temp_diff) > 3 else 50
-                elif temp_diff < -fan_hysteresis:
-                    fan = "5" if abs(temp_diff) > 2 else "4"
-                    demand = 100 if abs(temp_diff) > 2 else 95
-
-            elif mode == "C":  # Kühlmodus
-                temp_diff = targettemp - currentTemp
-                if abs(temp_diff) <= tolerance:
-                    fan = "3"
-                    demand = 70
-                elif temp_diff > fan_hysteresis:
-                    fan = "4" if abs(temp_diff) > 2 else "5"
-                    demand = 95 if abs(temp_diff) > 2 else 100
-                elif temp_diff < -fan_hysteresis:
-                    fan = "1" if abs(temp_diff) > 2 else "2"
-                    demand = 30 if abs(temp_diff) > 2 else 50
-
-            data = {
-                "env": currentTemp,
-                "temp": targettemp,
-                "powerful": powerful,
-                "power": power,
-                "mode": mode,
-                "fan": fan,
-                "demand": demand,
-            }
-            mqtt_topic = f"command/{faikinName}/control"
-            mqttc.publish(mqtt_topic, json.dumps(data))
+            if stopped:
+                command = faikinController.off(faikin_inputs(current, state_data))
+            else:
+                command = faikin_command(current, state_data)
 
-            # **Jetzt erst prevTemp aktualisieren!**
-            prevTemp = currentTemp
+            # Setting kept: the Faikin still gets the current temperatures
+            mqtt_topic = f"command/{faikinName}/control"
+            mqttPublisher.publish(mqtt_topic, payload if command is None else json.dumps(command), retain=False)
 
     except Exception as e:
         error_message = str(e)
         error_trace = traceback.format_exc()  # Erhalte den vollständigen Traceback
-        log(LOG_LEVEL_ERROR, CHILD_DEVICE_FAIKIN, MSG_SUBTYPE_FAIKIN + "/" + faikinName, error_message + "\n" + error_trace, timestamp=False)
+        log(LOG_LEVEL_ERROR, CHILD_DEVICE_FAIKIN, MSG_SUBTYPE_FAIKIN + "/" + faikinName, "%s\n%s", error_message, error_trace, timestamp=False)
 
 
 ##############################################################################
@@ -797,6 +922,10 @@ weatherRefreshInterval = settings.get("weather")["weatherRefreshInterval"] * 60
 forecastRefreshInterval = settings.get("weather")["forecastRefreshInterval"] * 60
 weatherExceptionInterval = settings.get("weather")["weatherExceptionInterval"] * 60
 
+WEATHER_CACHE_FILE_NAME = "weather_cache.json"
+
+weatherStatus = None
+
 weatherSummaryLabel = Label(text="", size_hint=(None, None), font_size='20sp', markup=True, text_size=(200, 20))
 weatherImg = Image(source="web/images/na.png", size_hint=(None, None))
 weatherTempLabel = Label(text=_("Temp") + ":", size_hint=(None, None), font_size='20sp', markup=True, text_size=(240, 20), valign="top", halign='left')
@@ -836,19 +965,18 @@ forecastTomoCloudsValueLabel = Label(text="N/A", size_hint=(None, None), font_si
 forecastTomoRainLabel = Label(text="", size_hint=(None, None), font_size='15sp', markup=True, text_size=(100, 16), valign="top", halign='left')
 forecastTomoRainValueLabel = Label(text="", size_hint=(None, None), font_size='15sp', markup=True, text_size=(160, 16), valign="top", halign='left')
 
-def get_weather(url):
-    return json.loads(urllib.request.urlopen(url, None, weatherURLTimeout).read())
-
 def get_cardinal_direction(heading):
     directions = ["N", "NE", "E", "SE", "S", "SW", "W", "NW", "N"]
     return directions[int(round(((heading % 360) / 45)))]
 
-def display_current_weather(dt):
-    with weatherLock:
-        interval = weatherRefreshInterval
+# Called on the UI thread with the parsed current weather, or None if the fetch failed
+def display_current_weather(weather):
+    global weatherStatus
 
+    with weatherLock:
         try:
-            weather = get_weather(weatherURLCurrent)
+            if weather is None:
+                raise ValueError("no current weather data")
 
             weatherImg.source = "web/images/" + weather["weather"][0]["icon"] + ".png"
 
@@ -860,23 +988,35 @@ def display_current_weather(dt):
             weatherCloudsValueLabel.text = str(weather["clouds"]["all"]) + "%"
             weatherSunValueLabel.text = time.strftime("%H:%M", time.localtime(weather["sys"]["sunrise"])) + ", " + time.strftime("%H:%M", time.localtime(weather["sys"]["sunset"])) + ""
 
-            log(LOG_LEVEL_INFO, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, json.dumps(weather))
+            weatherStatus = {
+                "summary": weather["weather"][0]["description"],
+                "icon": weather["weather"][0]["icon"],
+                "temp": weather["main"]["temp"],
+                "humidity": weather["main"]["humidity"],
+                "wind": round(weather["wind"]["speed"] * windFactor, 1),
+                "windDirection": get_cardinal_direction(weather["wind"]["deg"]),
+                "clouds": weather["clouds"]["all"],
+                "sunrise": weather["sys"]["sunrise"],
+                "sunset": weather["sys"]["sunset"]
+            }
+
+            log(LOG_LEVEL_INFO, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, lambda: json.dumps(weather))
 
         except Exception as e:
-            interval = weatherExceptionInterval
+            weatherStatus = None
 
             weatherImg.source = "web/images/na.png"
             weatherSummaryLabel.text = "N/A"
             weatherTempValueLabel.text = "N/A"
             weatherHumidityValueLabel.text = "N/A"
-            weatherWindValueLabel.pos.text = "N/A"
-            weatherCloudsValueLabel.pos.text = "N/A"
-            weatherSunValueLabel.pos.text = "N/A"
+            weatherWindValueLabel.text = "N/A"
+            weatherCloudsValueLabel.text = "N/A"
+            weatherSunValueLabel.text = "N/A"
 
             log(LOG_LEVEL_ERROR, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, "Update FAILED!")
-            log(LOG_LEVEL_ERROR, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, "Exception {e}")
+            log(LOG_LEVEL_ERROR, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, "Exception %s", e)
 
-        Clock.schedule_once(display_current_weather, interval)
+        publish_status()
 
 
 def get_precip_amount(raw):
@@ -887,12 +1027,12 @@ def get_precip_amount(raw):
     else:
         return str(precip)
 
-def display_forecast_weather(dt):
+# Called on the UI thread with the parsed forecast, or None if the fetch failed
+def display_forecast_weather(forecast):
     with weatherLock:
-        interval = forecastRefreshInterval
-
         try:
-            forecast = get_weather(weatherURLForecast)
+            if forecast is None:
+                raise ValueError("no forecast data")
 
             today = forecast["list"][0]
             tomo = forecast["list"][1]
@@ -937,12 +1077,10 @@ def display_forecast_weather(dt):
 
             forecastTomoRainValueLabel.text = rainValueText
 
-            log(LOG_LEVEL_INFO, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, json.dumps(today["weather"][0]))
-            log(LOG_LEVEL_INFO, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, json.dumps(tomo["weather"][0]))
+            log(LOG_LEVEL_INFO, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, lambda: json.dumps(today["weather"][0]))
+            log(LOG_LEVEL_INFO, CHILD_DEVICE_WEATHER_CURR, MSG_SUBTYPE_TEXT, lambda: json.dumps(tomo["weather"][0]))
 
         except Exception as e:
-            interval = weatherExceptionInterval
-
             forecastTodayImg.source = "web/images/na.png"
             forecastTodaySummaryLabel.text = ""
             forecastTodayRainLabel.text = ""
@@ -963,9 +1101,40 @@ def display_forecast_weather(dt):
             forecastTomoRainLabel.text = ""
             forecastTomoRainValueLabel.text = ""
             log(LOG_LEVEL_ERROR, CHILD_DEVICE_WEATHER_FCAST_TODAY, MSG_SUBTYPE_TEXT, "Update FAILED!")
-            log(LOG_LEVEL_ERROR, CHILD_DEVICE_WEATHER_FCAST_TODAY, MSG_SUBTYPE_TEXT, "Exception {e}")
+            log(LOG_LEVEL_ERROR, CHILD_DEVICE_WEATHER_FCAST_TODAY, MSG_SUBTYPE_TEXT, "Exception %s", e)
 
-        Clock.schedule_once(display_forecast_weather, interval)
+
+# The weather is fetched on a background thread, results are handed to the UI thread
+
+weatherDisplays = {
+    "current": display_current_weather,
+    "forecast": display_forecast_weather
+}
+
+def weather_updated(name, data):
+    Clock.schedule_once(lambda dt: weatherDisplays[name](data))
+
+def weather_failed(name, e):
+    weatherFetchFailures.labels(name).inc()
+    log(LOG_LEVEL_ERROR, CHILD_DEVICE_WEATHER_CURR if name == "current" else CHILD_DEVICE_WEATHER_FCAST_TODAY,
+        MSG_SUBTYPE_TEXT, "Fetch FAILED: %s", e)
+    Clock.schedule_once(lambda dt: weatherDisplays[name](None))
+
+weatherService = WeatherService(
+    [WeatherFeed("current", weatherURLCurrent, weatherRefreshInterval),
+     WeatherFeed("forecast", weatherURLForecast, forecastRefreshInterval)],
+    weatherURLTimeout,
+    weather_updated,
+    on_error=weather_failed,
+    cacheFile=WEATHER_CACHE_FILE_NAME,
+    minBackoff=30,
+    maxBackoff=weatherExceptionInterval,
+    latency=weatherFetchSeconds
+)
+
+metrics.counter("weather_fetches_total", "Weather feed requests answered", function=lambda: weatherService.fetches)
+metrics.counter("weather_not_modified_total", "Weather feed requests answered with 304 Not Modified",
+                function=lambda: weatherService.notModified)
 
 ##############################################################################
 #                                                                            #
@@ -973,17 +1142,141 @@ def display_forecast_weather(dt):
 #                                                                            #
 ##############################################################################
 
+# Status document served by /api/status. It is rebuilt whenever something may have changed,
+# but only re-serialized (and given a new ETag) when the content actually differs.
+
+statusCache = StatusCache()
+
+# Changed status sections are pushed to web browsers over /api/events (Server-Sent Events)
+statusEvents = EventBroadcaster(backlog=32, maxSubscribers=8)
+
+# Fixed size history of temperatures, setpoint and relay states (1m/15m/1h tiers in history/),
+# sampled on every control loop pass and whenever outside or domestic water temperatures come in
+HISTORY_DIR_NAME = "history"
+HISTORY_SERIES = ("temp", "setTemp", "outside", "water", "heat", "cool", "fan")
+
+# Opened by main(), so importing this module does not create the history directory
+historyStore = None
+
+def history_discontinuity(lastTime, when):
+    log(LOG_LEVEL_ERROR, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/history",
+        "Clock stepped back from %s to %s, history after it dropped", format_log_time(lastTime).strip(),
+        format_log_time(when).strip())
+
+def open_history():
+    global historyStore
+
+    historyStore = HistoryStore(HISTORY_SERIES, HISTORY_DIR_NAME, on_discontinuity=history_discontinuity)
+
+# Upper bound on the buckets returned by /api/history
+HISTORY_MAX_POINTS = 2000
+
+# Relay on time, cycle and short cycle counts per hour/day/week, served by /api/runtime and
+# published to MQTT whenever a relay switches
+RELAY_STATS_FILE_NAME = "relay_stats.json"
+
+relayStats = RelayStats(("heat", "cool", "fan"), StateStore(RELAY_STATS_FILE_NAME, debounce=60.0),
+                        shortCycle=shortCycleTime)
+
+def update_relay_stats():
+    current = thermostatModel.current
+    changed = relayStats.update("heat", current.heatOn)
+    changed = relayStats.update("cool", current.coolOn) or changed
+    changed = relayStats.update("fan", current.fanOn) or changed
+
+    if changed and mqttEnabled:
+        mqttPublisher.publish(mqttPub_runtime, json.dumps(relayStats.snapshot(), separators=(",", ":")))
+
+def close_relay_stats():
+    relayStats.close()
+    relayStats.store.flush()
+
+def record_history():
+    current = thermostatModel.current
+
+    historyStore.record({
+        "temp": current.currentTemp,
+        "setTemp": current.setTemp,
+        "outside": current.outsideTemp if faikinEnabled else None,
+        "water": current.domesticWater if domestic_water_enabled else None,
+        "heat": current.heatOn,
+        "cool": current.coolOn,
+        "fan": current.fanOn
+    })
+
+def get_schedule_mode(current=None):
+    current = thermostatModel.current if current is None else current
+
+    if current.hold:
+        return "hold"
+    elif useTestSchedule:
+        return "test"
+    elif current.heat:
+        return "heat"
+    elif current.cool:
+        return "cool"
+
+    return "none"
+
+def get_api_status():
+    current = thermostatModel.current
+
+    return {
+        "temperature": {
+            "current": current.currentTemp,
+            "set": current.setTemp,
+            "units": scaleUnits
+        },
+        "relays": {
+            "heat": current.heatOn,
+            "cool": current.coolOn,
+            "fan": current.fanOn
+        },
+        "mode": {
+            "heat": current.heat,
+            "cool": current.cool,
+            "fan": current.fan,
+            "hold": current.hold,
+            "schedule": get_schedule_mode(current)
+        },
+        "domesticwater": {
+            "enabled": bool(domestic_water_enabled),
+            "temp": None if current.domesticWater == "n/a" else current.domesticWater
+        },
+        "outside": {
+            "temp": current.outsideTemp
+        },
+        "weather": weatherStatus
+    }
+
+def publish_status():
+    # The snapshot is taken, cached and published in one piece, so a caller on another thread
+    # cannot commit an older status after a newer one, or send its changes out of order
+    with statusLock:
+        changed = statusCache.update(get_api_status())
+
+        if changed:
+            statusEvents.publish("status", changed)
+            publish_climate_state()
+
+    return changed
+
 # Main furnace/AC system control function:
 
 def change_system_settings():
     with thermostatLock:
         global currentFlowTemp, minFlowTemp
 
+        # One consistent snapshot for the whole pass
+        current = thermostatModel.current
+        setTemp = current.setTemp
+        currentTemp = current.currentTemp
+
         hpin_start = str(GPIO.input(heatPin))
         cpin_start = str(GPIO.input(coolPin))
         fpin_start = str(GPIO.input(fanPin))
 
-        if heatControl.state == "down":
+        if current.heat:
             GPIO.output(coolPin, GPIO.HIGH)
 
             if setTemp >= currentTemp + tempHysteresis:
@@ -991,28 +1284,28 @@ def change_system_settings():
                 GPIO.output(fanPin, GPIO.LOW)
             elif setTemp <= currentTemp:
                 GPIO.output(heatPin, GPIO.HIGH)
-                if fanControl.state != "down" and GPIO.input(coolPin):
+                if not current.fan and GPIO.input(coolPin):
                     GPIO.output(fanPin, GPIO.HIGH)
         else:
             GPIO.output(heatPin, GPIO.HIGH)
 
-            if coolControl.state == "down":
+            if current.cool:
                 if setTemp <= currentTemp - tempHysteresis:
                     GPIO.output(coolPin, GPIO.LOW)
                     GPIO.output(fanPin, GPIO.LOW)
                 elif setTemp >= currentTemp:
                     GPIO.output(coolPin, GPIO.HIGH)
-                    if fanControl.state != "down" and GPIO.input(heatPin):
+                    if not current.fan and GPIO.input(heatPin):
                         GPIO.output(fanPin, GPIO.LOW)
             else:
                 GPIO.output(coolPin, GPIO.HIGH)
-                if fanControl.state != "down" and GPIO.input(heatPin):
+                if not current.fan and GPIO.input(heatPin):
                     GPIO.output(fanPin, GPIO.HIGH)
 
-        log(LOG_LEVEL_STATE, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEMPERATURE, "minFlow: " + str(minFlowTemp))
-        log(LOG_LEVEL_STATE, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEMPERATURE, "currentFlow: " + str(currentFlowTemp))
+        log(LOG_LEVEL_STATE, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEMPERATURE, "minFlow: %s", minFlowTemp)
+        log(LOG_LEVEL_STATE, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEMPERATURE, "currentFlow: %s", currentFlowTemp)
 
-        if fanControl.state == "down":
+        if current.fan:
             GPIO.output(fanPin, GPIO.HIGH)
             setMqttFanCommand("on")
             log(LOG_LEVEL_STATE, CHILD_DEVICE_FAN, MSG_SUBTYPE_TEXT, "1 pump on")
@@ -1023,64 +1316,103 @@ def change_system_settings():
                 GPIO.output(fanPin, GPIO.LOW)
                 log(LOG_LEVEL_STATE, CHILD_DEVICE_FAN, MSG_SUBTYPE_TEXT, "3 GPIO.LOW")
 
-        # save the thermostat state in case of restart
-        state.put("state", setTemp=setTemp, heatControl=heatControl.state, coolControl=coolControl.state,
-                  fanControl=fanControl.state, holdControl=holdControl.state)
+        # save the thermostat state in case of restart (only written when something changed)
+        state.put("state", setTemp=setTemp,
+                  heatControl="down" if current.heat else "normal",
+                  coolControl="down" if current.cool else "normal",
+                  fanControl="down" if current.fan else "normal",
+                  holdControl="down" if current.hold else "normal")
 
-        status_info = json.loads(get_status_info())
-        statusHeatValueLabel.text = status_info['heat']
-        statusCoolValueLabel.text = status_info['cool']
-        statusFanValueLabel.text = status_info['fan']
-        statusSchedValueLabel.text = status_info['sched']
+        update_state(**relay_outputs())
 
-        if hpin_start != str(GPIO.input(heatPin)):
-            log(LOG_LEVEL_STATE, CHILD_DEVICE_HEAT, MSG_SUBTYPE_BINARY_STATUS, "1" if GPIO.input(heatPin) else "0")
-        if cpin_start != str(GPIO.input(coolPin)):
-            log(LOG_LEVEL_STATE, CHILD_DEVICE_COOL, MSG_SUBTYPE_BINARY_STATUS, "1" if GPIO.input(coolPin) else "0")
-        if fpin_start != str(GPIO.input(fanPin)):
-            log(LOG_LEVEL_STATE, CHILD_DEVICE_FAN, MSG_SUBTYPE_BINARY_STATUS, "1" if GPIO.input(fanPin) else "0")
+        log_relay_transitions(hpin_start, cpin_start, fpin_start)
+
+        update_relay_stats()
+        record_history()
+        publish_status()
 
         if mqttEnabled:
             publish_faikin_mqtt_message()
 
+def log_relay_transitions(hpin_start, cpin_start, fpin_start):
+    if hpin_start != str(GPIO.input(heatPin)):
+        log(LOG_LEVEL_STATE, CHILD_DEVICE_HEAT, MSG_SUBTYPE_BINARY_STATUS, "1" if GPIO.input(heatPin) else "0")
+    if cpin_start != str(GPIO.input(coolPin)):
+        log(LOG_LEVEL_STATE, CHILD_DEVICE_COOL, MSG_SUBTYPE_BINARY_STATUS, "1" if GPIO.input(coolPin) else "0")
+    if fpin_start != str(GPIO.input(fanPin)):
+        log(LOG_LEVEL_STATE, CHILD_DEVICE_FAN, MSG_SUBTYPE_BINARY_STATUS, "1" if GPIO.input(fanPin) else "0")
+
+def stop_system():
+    # No current temperature to control on (eg. the sensor failed): heat and cool off, the
+    # fan only runs if it was switched on by hand, and the Faikin is switched off
+    with thermostatLock:
+        current = thermostatModel.current
+
+        hpin_start = str(GPIO.input(heatPin))
+        cpin_start = str(GPIO.input(coolPin))
+        fpin_start = str(GPIO.input(fanPin))
+
+        GPIO.output(heatPin, GPIO.HIGH)
+        GPIO.output(coolPin, GPIO.HIGH)
+        GPIO.output(fanPin, GPIO.HIGH if current.fan else GPIO.LOW)
+
+        update_state(**relay_outputs())
+        log_relay_transitions(hpin_start, cpin_start, fpin_start)
+
+        update_relay_stats()
+        record_history()
+        publish_status()
+
+        if mqttEnabled:
+            publish_faikin_mqtt_message(stopped=True)
+
 # This callback will be bound to the touch screen UI buttons:
 
 def control_callback(control):
-    with thermostatLock:
-        setControlState(control, control.state)  # make sure we change the background colour!
+    setControlState(control, control.state)  # make sure we change the background colour!
 
-        if control is coolControl:
-            if control.state == "down":
-                setControlState(heatControl, "normal")
-            reloadSchedule()
+    if control is coolControl:
+        if control.state == "down":
+            setControlState(heatControl, "normal")
+        reloadSchedule()
 
-        if control is heatControl:
-            if control.state == "down":
-                setControlState(coolControl, "normal")
-            reloadSchedule()
+    if control is heatControl:
+        if control.state == "down":
+            setControlState(coolControl, "normal")
+        reloadSchedule()
+
+    if control is holdControl:
+        scheduleRunner.wake()
 
 
 # Check the current sensor temperature
 
+@controlTickSeconds.timed
 def check_sensor_temp(dt):
-    with thermostatLock:
-        global currentTemp, priorCorrected
-        global tempSensor
+    global priorCorrected, sensorStale
 
-        if tempSensor is not None:
-            rawTemp = tempSensor.get_temperature(sensorUnits)
-            correctedTemp = (((rawTemp - freezingMeasured) * referenceRange) / measuredRange) + freezingPoint
-            currentTemp = round(correctedTemp, 1)
-            log(LOG_LEVEL_DEBUG, CHILD_DEVICE_TEMP, MSG_SUBTYPE_CUSTOM + "/raw", str(rawTemp))
-            log(LOG_LEVEL_DEBUG, CHILD_DEVICE_TEMP, MSG_SUBTYPE_CUSTOM + "/corrected", str(correctedTemp))
+    reading = tempSampler.latest
+    stale = reading is None or time.monotonic() - reading.timestamp > maxReadingAge
+
+    if stale != sensorStale:
+        sensorStale = stale
+        if stale:
+            log(LOG_LEVEL_ERROR, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEXT,
+                "No sensor reading for over %ss, heat/cool switched off", maxReadingAge)
+        else:
+            log(LOG_LEVEL_INFO, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEXT, "Sensor readings back")
 
-            if abs(priorCorrected - correctedTemp) >= TEMP_TOLERANCE:
-                log(LOG_LEVEL_STATE, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEMPERATURE, str(currentTemp))
-                priorCorrected = correctedTemp
+    if not stale:
+        currentTemp = round(reading.corrected, 1)
+        update_state(currentTemp=currentTemp)
+        log(LOG_LEVEL_DEBUG, CHILD_DEVICE_TEMP, MSG_SUBTYPE_CUSTOM + "/raw", "%s", reading.raw)
+        log(LOG_LEVEL_DEBUG, CHILD_DEVICE_TEMP, MSG_SUBTYPE_CUSTOM + "/corrected", "%s", reading.corrected)
 
-        currentLabel.text = "[b]" + str(currentTemp) + scaleUnits + "[/b]"
-        altCurLabel.text = currentLabel.text
+        if abs(priorCorrected - reading.corrected) >= TEMP_TOLERANCE:
+            log(LOG_LEVEL_STATE, CHILD_DEVICE_TEMP, MSG_SUBTYPE_TEMPERATURE, "%s", currentTemp)
+            priorCorrected = reading.corrected
 
+    with thermostatLock:
         dateLabel.text = "[b]" + time.strftime("%a %d. %b %Y") + "[/b]"
 
         timeStr = time.strftime("%H:%M")
@@ -1088,54 +1420,59 @@ def check_sensor_temp(dt):
         timeLabel.text = ("[b]" + (timeStr if timeStr[0:1] != "0" else timeStr[1:]) + "[/b]").lower()
         altTimeLabel.text = timeLabel.text
 
-        change_system_settings()
+        if stale:
+            stop_system()
+        else:
+            change_system_settings()
 
 # This is called when the desired temp slider is updated:
 def update_set_temp(slider, value):
-    with thermostatLock:
-        global setTemp
-        priorTemp = setTemp
-        setTemp = round(slider.value, 1)
-        setLabel.text = "  Set\n[b]" + str(setTemp) + scaleUnits + "[/b]"
-        if priorTemp != setTemp:
-            log(LOG_LEVEL_STATE, CHILD_DEVICE_UICONTROL_SLIDER, MSG_SUBTYPE_TEMPERATURE, str(setTemp))
+    setTemp = round(slider.value, 1)
+    if update_state(setTemp=setTemp):
+        log(LOG_LEVEL_STATE, CHILD_DEVICE_UICONTROL_SLIDER, MSG_SUBTYPE_TEMPERATURE, "%s", setTemp)
 
 
-# Check the PIR motion sensor status
-def check_pir(pin):
-    global minUITimer
+# PIR motion sensor edge handling. The callbacks run on the GPIO event thread, the actual
+# work is handed to the Kivy main thread.
 
-    with thermostatLock:
-        if GPIO.input(pirPin):
-            log(LOG_LEVEL_INFO, CHILD_DEVICE_PIR, MSG_SUBTYPE_TRIPPED, "1")
+def pir_edge(pin):
+    if GPIO.input(pin):
+        Clock.schedule_once(pir_motion)
+    else:
+        log(LOG_LEVEL_DEBUG, CHILD_DEVICE_PIR, MSG_SUBTYPE_TRIPPED, "0")
 
-            if minUITimer is not None:
-                Clock.unschedule(show_minimal_ui)
+def pir_ignored(now):
+    if pirIgnoreFrom > pirIgnoreTo:
+        return now >= pirIgnoreFrom or now < pirIgnoreTo
 
-            minUITimer = Clock.schedule_once(show_minimal_ui, minUITimeout)
+    return pirIgnoreFrom <= now < pirIgnoreTo
 
-            ignore = False
-            now = datetime.datetime.now().time()
+def pir_motion(dt):
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_PIR, MSG_SUBTYPE_TRIPPED, "1")
 
-            if pirIgnoreFrom > pirIgnoreTo:
-                if now >= pirIgnoreFrom or now < pirIgnoreTo:
-                    ignore = True
-            else:
-                if pirIgnoreFrom <= now < pirIgnoreTo:
-                    ignore = True
+    with thermostatLock:
+        rearm_minimal_ui()
 
-            if screenMgr.current == "minimalUI" and not (ignore):
-                screenMgr.current = "thermostatUI"
-                log(LOG_LEVEL_DEBUG, CHILD_DEVICE_SCREEN, MSG_SUBTYPE_TEXT, "Full")
-
-        else:
-            log(LOG_LEVEL_DEBUG, CHILD_DEVICE_PIR, MSG_SUBTYPE_TRIPPED, "0")
+        if screenMgr.current == "minimalUI" and not pir_ignored(datetime.datetime.now().time()):
+            screenMgr.current = "thermostatUI"
+            log(LOG_LEVEL_DEBUG, CHILD_DEVICE_SCREEN, MSG_SUBTYPE_TEXT, "Full")
 
 
 # Minimal UI Display functions and classes
 
+def rearm_minimal_ui():
+    # Restart the minimal UI timeout (a single Clock trigger, created in ThermostatApp.build)
+    if minUITimer is not None:
+        minUITimer.cancel()
+        minUITimer()
+
 def show_minimal_ui(dt):
     with thermostatLock:
+        # No further edge comes while the PIR output stays high, so keep the full UI up
+        if pirEnabled and GPIO.input(pirPin):
+            rearm_minimal_ui()
+            return
+
         screenMgr.current = "minimalUI"
         log(LOG_LEVEL_DEBUG, CHILD_DEVICE_SCREEN, MSG_SUBTYPE_TEXT, "Minimal")
 
@@ -1146,14 +1483,10 @@ class MinimalScreen(Screen):
             return True
 
     def on_touch_up(self, touch):
-        global minUITimer
-
         if touch.grab_current is self:
             touch.ungrab(self)
             with thermostatLock:
-                if minUITimer is not None:
-                    Clock.unschedule(show_minimal_ui)
-                minUITimer = Clock.schedule_once(show_minimal_ui, minUITimeout)
+                rearm_minimal_ui()
                 self.manager.current = "thermostatUI"
                 # screen_on()
                 log(LOG_LEVEL_DEBUG, CHILD_DEVICE_SCREEN, MSG_SUBTYPE_TEXT, "Full")
@@ -1176,19 +1509,89 @@ def get_ip_address():
     except socket.error:
         ip = "127.0.0.1"
         log(LOG_LEVEL_ERROR, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/ip",
-            "FAILED to get ip address, returning " + ip, timestamp=False)
+            "FAILED to get ip address, returning %s", ip, timestamp=False)
 
     return ip
 
 
+def log_startup():
+    # Presentations and the settings in effect, logged once by main() rather than at import
+    log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_NAME, "Thermostat Starting Up...", msg_type=MSG_TYPE_PRESENTATION)
+    log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_VERSION, THERMOSTAT_VERSION, msg_type=MSG_TYPE_PRESENTATION)
+
+    # send presentations for all other child "sensors"
+    for child in CHILD_DEVICES:
+        if child != CHILD_DEVICE_NODE:
+            log(LOG_LEVEL_STATE, child, child, "", msg_type=MSG_TYPE_PRESENTATION)
+
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/tempScale", "%s", tempScale,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/scaleUnits", "%s", scaleUnits,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/precipUnits", "%s", precipUnits,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/precipFactor", "%s", precipFactor,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/sensorUnits", "%s", sensorUnits,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/windFactor", "%s", windFactor,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/windUnits", "%s", windUnits,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/currentTemp", "%s",
+        thermostatModel.current.currentTemp, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/setTemp", "%s",
+        thermostatModel.current.setTemp, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/tempHysteresis", "%s", tempHysteresis,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/tempCheckInterval",
+        "%s", tempCheckInterval, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/minUIEnabled", "%s", minUIEnabled,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/temperature/minUITimeout", "%s", minUITimeout,
+        timestamp=False)
+
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/elevation", "%s", elevation,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/boilingPoint", "%s", boilingPoint,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/freezingPoint", "%s", freezingPoint,
+        timestamp=False)
+    log(LOG_LEVEL_DEBUG, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/referenceRange",
+        "%s", referenceRange, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/boilingMeasured",
+        "%s", boilingMeasured, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/freezingMeasured",
+        "%s", freezingMeasured, timestamp=False)
+    log(LOG_LEVEL_DEBUG, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/calibration/measuredRange", "%s", measuredRange,
+        timestamp=False)
+
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/UISlider/minTemp", "%s", minTemp, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/UISlider/maxTemp", "%s", maxTemp, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/UISlider/tempStep", "%s", tempStep,
+        timestamp=False)
+
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_PIR, MSG_SUBTYPE_ARMED, "%s", pirEnabled, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/pir/bounceTime", "%s", pirBounceTime,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/pir/ignoreFrom", "%s", pirIgnoreFromStr,
+        timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/settings/pir/ignoreTo", "%s", pirIgnoreToStr,
+        timestamp=False)
+
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_COOL, MSG_SUBTYPE_BINARY_STATUS, "%s", coolPin, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_HEAT, MSG_SUBTYPE_BINARY_STATUS, "%s", heatPin, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_FAN, MSG_SUBTYPE_BINARY_STATUS, "%s", fanPin, timestamp=False)
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_PIR, MSG_SUBTYPE_TRIPPED, "%s", pirPin, timestamp=False)
+
 def getVersion(message):
     payload = message.payload.decode('utf-8')
 
     # Zeigen Sie den Inhalt der Nachricht und das Empfangsdatum und die Uhrzeit an
-    log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/getVersion", "Empfangene Nachricht: {payload}",
+    log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/getVersion", "Empfangene Nachricht: %s", payload,
         single=True)
     log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/getVersion",
-        "Empfangszeitpunkt: {message.timestamp}", single=True)
+        "Empfangszeitpunkt: %s", message.timestamp, single=True)
     print(f"Empfangene Nachricht: {payload}")
     print(f"Empfangszeitpunkt: {message.timestamp}")
     log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_VERSION, THERMOSTAT_VERSION)
@@ -1197,10 +1600,15 @@ def restart(message):
     payload = message.payload.decode('utf-8')
 
     log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/restart", "Thermostat restarting...", single=True)
+    state.flush()
+    close_relay_stats()
+    historyStore.close()
     GPIO.cleanup()
 
+    if logPipeline is not None:
+        logPipeline.close()
+
     if logFile is not None:
-        logFile.flush()
         os.fsync(logFile.fileno())
         logFile.close()
 
@@ -1210,20 +1618,59 @@ def restart(message):
     os.execl(sys.executable, 'python', __file__, *sys.argv[1:])  # This does not return!!!
 
 def setLogLevel(msg):
-    global logLevel
-
-    if LOG_LEVELS.get(msg.payload):
-        log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/loglevel",
-            "LogLevel set to: " + str(msg.payload))
-
-        logLevel = LOG_LEVELS.get(msg.payload, logLevel)
-    else:
-        log(LOG_LEVEL_ERROR, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/loglevel",
-            "Invalid LogLevel: " + str(msg.payload))
+    # Payload is a level ("debug"), or child=level pairs ("faikin=debug, mqtt=error"),
+    # child=default removes the override for that child device
+    global logLevel, childLogLevels
+
+    payload = msg.payload.decode("utf-8") if isinstance(msg.payload, bytes) else str(msg.payload)
+    newLevel = logLevel
+    newChildLevels = dict(childLogLevels)
+
+    for item in payload.split(","):
+        child, sep, level = item.strip().rpartition("=")
+        child = child.strip()
+        level = level.strip().lower()
+
+        if sep and level == "default":
+            newChildLevels.pop(child, None)
+        elif level in LOG_LEVELS and (child or not sep):
+            if sep:
+                newChildLevels[child] = LOG_LEVELS[level]
+            else:
+                newLevel = LOG_LEVELS[level]
+        else:
+            log(LOG_LEVEL_ERROR, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/loglevel", "Invalid LogLevel: %s", payload)
+            return
+
+    # Swap in whole, log() reads these without locking
+    logLevel = newLevel
+    childLogLevels = newChildLevels
+
+    log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/loglevel", "LogLevel set to: %s %s",
+        LOG_LEVELS_STR.get(logLevel, "none"),
+        " ".join(child + "=" + LOG_LEVELS_STR.get(level, "none") for child, level in childLogLevels.items()))
+
+def lockProfilerCommand(message):
+    # Payload: on, off, reset or report (default); the report is published to state/locks
+    command = message.payload.decode("utf-8").strip().lower() if message.payload else "report"
+
+    if command == "on":
+        lockProfiler.enabled = True
+    elif command == "off":
+        lockProfiler.enabled = False
+    elif command == "reset":
+        lockProfiler.reset()
+    elif command not in ("", "report"):
+        log(LOG_LEVEL_ERROR, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/locks", "Invalid command: %s", command)
+        return
+
+    log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/locks", "Lock profiling %s (%s)",
+        "on" if lockProfiler.enabled else "off", command or "report")
+    mqttPublisher.publish(mqttPub_locks, json.dumps(lockProfiler.report(), separators=(",", ":")), retain=False,
+                          force=True)
 
 def set_domestic_water(message):
-    global domestic_key_value_pair, domesticwater
-    global currentWaterValueLabel, altWaterValueLabel, domestic_last_message_time
+    global domestic_last_message_time
     try:
         payload = message.payload
         if isinstance(payload, bytes):
@@ -1231,10 +1678,9 @@ def set_domestic_water(message):
 
         data = json.loads(payload)
         domestic_water_value = data.get(domestic_key_value_pair)
-        if domestic_water_value is not None and domesticwater != domestic_water_value:
-            domesticwater = domestic_water_value
-            currentWaterValueLabel.text = "[b]" + str(domesticwater) + scaleUnits + "[/b]"
-            altWaterValueLabel.text = "[b]" + str(domesticwater) + scaleUnits + "[/b]"
+        if domestic_water_value is not None and update_state(domesticWater=domestic_water_value):
+            record_history()
+            publish_status()
 
         domestic_last_message_time = time.time()
         Clock.schedule_once(check_domestic_water_timeout, domestic_timeout_duration)
@@ -1243,43 +1689,114 @@ def set_domestic_water(message):
         status_msg = "Invalid JSON format in command payload"
 
 def check_domestic_water_timeout(dt):
-    global domestic_last_message_time, domesticwater
-    global currentWaterValueLabel, altWaterValueLabel
-
     current_time = time.time()
     if current_time - domestic_last_message_time > domestic_timeout_duration:
-        domesticwater = "n/a"
-        currentWaterValueLabel.text = "[b]" + str(domesticwater) + "[/b]"
-        altWaterValueLabel.text = "[b]" + str(domesticwater) + "[/b]"
+        update_state(domesticWater="n/a")
+        record_history()
+        publish_status()
+
+# Remote control over MQTT: the changes the web form makes, one command topic per control
+
+def mqtt_control_command(message, command):
+    payload = message.payload.decode("utf-8", "replace")
+
+    try:
+        if command == "setpoint":
+            changes = {"setTemp": parse_setpoint(payload, minTemp, maxTemp, tempStep)}
+        elif command == "mode":
+            changes = parse_mode(payload)
+        else:
+            changes = {command: parse_switch(payload)}
+    except ValueError as e:
+        log(LOG_LEVEL_ERROR, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT, "Invalid %s command: %s", command, e)
+        return
+
+    log(LOG_LEVEL_INFO, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEXT, "Set %s received: %s", command, payload)
+
+    changed = update_state(**changes)
+    current = thermostatModel.current
+
+    if "setTemp" in changed:
+        log(LOG_LEVEL_STATE, CHILD_DEVICE_MQTT, MSG_SUBTYPE_TEMPERATURE, "%s", current.setTemp)
+
+    for control in (heatControl, coolControl, fanControl, holdControl):
+        field = controlFields[control_label(control)]
+        if field in changed:
+            log_control_state(control, "down" if getattr(current, field) else "normal")
+
+    if "heat" in changed or "cool" in changed:
+        reloadSchedule()
+
+    if "hold" in changed:
+        scheduleRunner.wake()
+
+    # Also when nothing changed: a client that assumed the command took effect gets corrected
+    if not publish_status():
+        publish_climate_state(force=True)
+
+def publish_climate_state(force=False):
+    if mqttEnabled:
+        mqttPublisher.publish(mqttPub_climate, climate_payload(thermostatModel.current), force=force)
+
+def publish_discovery():
+    if mqttDiscovery:
+        topic, payload = discovery_config(mqttDiscoveryPrefix, mqttClientID, "Thermostat " + mqttClientID, {
+            "state": mqttPub_climate,
+            "availability": mqttPub_availability,
+            "setpoint": mqttSub_setpoint,
+            "mode": mqttSub_mode,
+            "fan": mqttSub_fan,
+            "hold": mqttSub_hold
+        }, minTemp, maxTemp, tempStep, scaleUnits, THERMOSTAT_VERSION)
+        mqttPublisher.publish(topic, payload, qos=1)
 
 def setMqttFanCommand(state):
     if mqttEnabled:
-        mqttc.publish(mqttPub_fanstate, state)
+        mqttPublisher.publish(mqttPub_fanstate, state)
 
 if mqttEnabled:
     mqttc = mqtt.Client(client_id = mqttClientID, protocol=mqtt.MQTTv5)
     mqttc.on_connect = mqtt_on_connect
     mqttc.on_disconnect = on_disconnect
+    # The broker tells subscribers (eg. Home Assistant) when the connection is lost
+    mqttc.will_set(mqttPub_availability, PAYLOAD_OFFLINE, retain=True)
 
     mqttc.message_callback_add(mqttSub_restart, lambda client, userdata, message: restart(message) )
     mqttc.message_callback_add(mqttSub_loglevel, lambda client, userdata, message: setLogLevel(message))
     mqttc.message_callback_add(mqttSub_version, lambda client, userdata, message: getVersion(message))
-    mqttc.message_callback_add(mqttSub_state, lambda client, userdata, message: get_status_info())
+    mqttc.message_callback_add(mqttSub_state, lambda client, userdata, message: publish_climate_state(force=True))
+    mqttc.message_callback_add(mqttSub_locks, lambda client, userdata, message: lockProfilerCommand(message))
+    mqttc.message_callback_add(mqttSub_setpoint, lambda client, userdata, message: mqtt_control_command(message, "setpoint"))
+    mqttc.message_callback_add(mqttSub_mode, lambda client, userdata, message: mqtt_control_command(message, "mode"))
+    mqttc.message_callback_add(mqttSub_fan, lambda client, userdata, message: mqtt_control_command(message, "fan"))
+    mqttc.message_callback_add(mqttSub_hold, lambda client, userdata, message: mqtt_control_command(message, "hold"))
     if domestic_water_enabled:
         mqttc.message_callback_add(domestic_water_topic, lambda client, userdata, message: set_domestic_water(message))
 
     if faikinEnabled:
         mqttc.message_callback_add(mqttSub_faikin, lambda client, userdata, message: get_faikin_status(message))
 
-    # Make sure we can reach the mqtt server by pinging it
-    pingCount = 0
-    pingCmd = "ping -c 1 " + mqttServer
-
-    while os.system(pingCmd) != 0 and pingCount <= 100:
-        ++pingCount
-        time.sleep(1)
-
-    mqttc.connect(mqttServer, mqttPort)
+    # Outbound messages wait in bounded space while the broker is unreachable, instead of piling
+    # up in paho's queue
+    mqttc.max_queued_messages_set(mqttQueueSize)
+    mqttOutbox = MqttOutbox(mqttc, capacity=mqttQueueSize, spoolFile=MQTT_SPOOL_FILE_NAME)
+    mqttPublisher = StatePublisher(mqttOutbox.states, heartbeat=mqttHeartbeat)
+
+    # paho keeps unacknowledged/unsent messages in _out_messages; there is no public accessor
+    metrics.gauge("mqtt_queue_depth", "MQTT messages waiting to be sent or acknowledged",
+                  function=lambda: len(getattr(mqttc, "_out_messages", ())))
+    metrics.counter("mqtt_publish_suppressed_total", "Unchanged state messages not sent again",
+                    function=lambda: mqttPublisher.suppressed)
+    metrics.gauge("mqtt_outbox_pending", "MQTT messages held while the broker is unreachable",
+                  function=mqttOutbox.pending)
+    metrics.counter("mqtt_outbox_dropped_total", "MQTT messages dropped because the outbox was full",
+                    function=lambda: mqttOutbox.dropped)
+
+def connect_mqtt():
+    # Does not block: the network loop thread makes the first connection and reconnects
+    # whenever it is lost, waiting 1s, 2s, 4s, ... up to 2 minutes between attempts
+    mqttc.reconnect_delay_set(min_delay=1, max_delay=120)
+    mqttc.connect_async(mqttServer, mqttPort)
     mqttc.loop_start()
 
 
@@ -1291,7 +1808,7 @@ if mqttEnabled:
 
 class ThermostatApp(App):
     def build(self):
-        global screenMgr
+        global screenMgr, minUITimer
 
         # Set up the thermostat UI layout:
         thermostatUI = FloatLayout(size=(800, 480))
@@ -1494,21 +2011,25 @@ class ThermostatApp(App):
 
             layout = screenMgr
 
-            minUITimer = Clock.schedule_once(show_minimal_ui, minUITimeout)
+            minUITimer = Clock.create_trigger(show_minimal_ui, minUITimeout)
+            minUITimer()
 
             if pirEnabled:
-                Clock.schedule_interval(check_pir, pirCheckInterval)
+                GPIO.add_event_detect(pirPin, GPIO.BOTH, callback=pir_edge, bouncetime=pirBounceTime)
 
-        # Start checking the temperature
-        Clock.schedule_interval(check_sensor_temp, tempCheckInterval)
-
-        # Show the current weather & forecast
-        Clock.schedule_once(display_current_weather, 5)
-        Clock.schedule_once(display_forecast_weather, 10)
+        start_control()
 
         return layout
 
 
+def start_control():
+    # Start checking the temperature
+    Clock.schedule_interval(check_sensor_temp, tempCheckInterval)
+
+    # Show the current weather & forecast
+    weatherService.start()
+
+
 ##############################################################################
 #                                                                            #
 #       Scheduler Implementation                                             #
@@ -1516,24 +2037,17 @@ class ThermostatApp(App):
 ##############################################################################
 
 def startScheduler():
+    reloadSchedule()
     log(LOG_LEVEL_INFO, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_TEXT, "Started")
-    while True:
-        if holdControl.state == "normal":
-            with scheduleLock:
-                log(LOG_LEVEL_DEBUG, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_TEXT, "Running pending")
-                schedule.run_pending()
-
-        time.sleep(10)
+    scheduleRunner.run()
 
 
 def setScheduledTemp(temp):
-    with thermostatLock:
-        global setTemp
-        if holdControl.state == "normal":
-            setTemp = round(temp, 1)
-            setLabel.text = "  Set\n[b]" + str(setTemp) + scaleUnits + "[/b]"
-            tempSlider.value = setTemp
-            log(LOG_LEVEL_STATE, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_TEMPERATURE, str(setTemp))
+    # Runs on the scheduler thread, the widgets follow through the model
+    if not thermostatModel.current.hold:
+        setTemp = round(temp, 1)
+        update_state(setTemp=setTemp)
+        log(LOG_LEVEL_STATE, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_TEMPERATURE, "%s", setTemp)
 
 
 def getTestSchedule():
@@ -1555,34 +2069,83 @@ def getTestSchedule():
     return testSched
 
 
-def reloadSchedule():
+# The scheduler thread sleeps until the next transition of the active schedule, and is woken
+# early when the schedule is reloaded or the hold state changes
+scheduleRunner = ScheduleRunner(setScheduledTemp, lambda: thermostatModel.current.hold)
+
+# Parsed heat & cool schedules are kept in memory. A mode change just switches the active
+# timeline, and a changed schedule only re-parses the days that differ.
+SCHEDULE_FILE_NAME = "thermostat_schedule.json"
+
+scheduleTimelines = {
+    "heat": WeeklyTimeline(),
+    "cool": WeeklyTimeline()
+}
+scheduleMTime = None
+testTimeline = None
+
+
+def applySchedule(thermoSched):
+    for mode in scheduleTimelines:
+        timeline, changed = scheduleTimelines[mode].with_days(thermoSched.get(mode, {}))
+        scheduleTimelines[mode] = timeline
+
+        if not log_enabled(LOG_LEVEL_DEBUG, CHILD_DEVICE_SCHEDULER):
+            continue
+
+        for day in changed:
+            for entry in timeline.days[day]:
+                log(LOG_LEVEL_DEBUG, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_TEXT,
+                    "Set %s %s, at: %s = %s%s", mode, day, entry[0], entry[1], scaleUnits)
+
+
+def loadSchedule():
+    global scheduleMTime
+
+    mtime = os.stat(SCHEDULE_FILE_NAME).st_mtime_ns
+
+    if mtime != scheduleMTime:
+        with open(SCHEDULE_FILE_NAME, "r") as file:
+            applySchedule(json.load(file))
+
+        scheduleMTime = mtime
+
+
+def saveSchedule(thermoSched):
+    global scheduleMTime
+
     with scheduleLock:
-        schedule.clear()
+        atomic_write(SCHEDULE_FILE_NAME, json.dumps(thermoSched, indent=4))
+        applySchedule(thermoSched)
+        scheduleMTime = os.stat(SCHEDULE_FILE_NAME).st_mtime_ns
 
-        activeSched = None
 
-        with thermostatLock:
-            thermoSched = JsonStore("thermostat_schedule.json")
+def reloadSchedule():
+    global testTimeline
+
+    with scheduleLock:
+        loadSchedule()
 
-            if holdControl.state != "down":
-                if heatControl.state == "down":
-                    activeSched = thermoSched["heat"]
-                    log(LOG_LEVEL_INFO, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_CUSTOM + "/load", "heat")
-                elif coolControl.state == "down":
-                    activeSched = thermoSched["cool"]
-                    log(LOG_LEVEL_INFO, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_CUSTOM + "/load", "cool")
+        activeTimeline = None
+        current = thermostatModel.current
 
-                if useTestSchedule:
-                    activeSched = getTestSchedule()
-                    log(LOG_LEVEL_INFO, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_CUSTOM + "/load", "test")
-                    print("Using Test Schedule!!!")
+        if not current.hold:
+            if current.heat:
+                activeTimeline = scheduleTimelines["heat"]
+                log(LOG_LEVEL_INFO, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_CUSTOM + "/load", "heat")
+            elif current.cool:
+                activeTimeline = scheduleTimelines["cool"]
+                log(LOG_LEVEL_INFO, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_CUSTOM + "/load", "cool")
 
-        if activeSched is not None:
-            for day, entries in activeSched.items():
-                for i, entry in enumerate(entries):
-                    getattr(schedule.every(), day).at(entry[0]).do(setScheduledTemp, entry[1])
-                    log(LOG_LEVEL_DEBUG, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_TEXT,
-                        "Set " + day + ", at: " + entry[0] + " = " + str(entry[1]) + scaleUnits)
+            if useTestSchedule:
+                if testTimeline is None:
+                    testTimeline = WeeklyTimeline(getTestSchedule())
+                activeTimeline = testTimeline
+                log(LOG_LEVEL_INFO, CHILD_DEVICE_SCHEDULER, MSG_SUBTYPE_CUSTOM + "/load", "test")
+                print("Using Test Schedule!!!")
+
+        if activeTimeline is not scheduleRunner.timeline:
+            scheduleRunner.set_timeline(activeTimeline)
 
 
 ##############################################################################
@@ -1591,170 +2154,249 @@ def reloadSchedule():
 #                                                                            #
 ##############################################################################
 
-class WebInterface(object):
+def markup_to_html(text):
+    return text.replace("[b]", "<b>").replace("[/b]", "</b>").replace("\n", "<br>").replace(" ", "&nbsp;").replace(
+        "[color=00ff00]", '<font color="green">').replace("[/color]", '</font>')
+
+
+def highlight_html(value, highlight):
+    return ('<font color="red"><b>' + value + '</b></font>') if highlight else value
+
+
+# Templates are split into literal/slot parts once and only re-read when the file changes on disk
+webTemplates = {
+    "index": HtmlTemplate("web/html/thermostat.html"),
+    "set": HtmlTemplate("web/html/thermostat_set.html"),
+    "schedule": HtmlTemplate("web/html/thermostat_schedule.html"),
+    "saved": HtmlTemplate("web/html/thermostat_saved.html")
+}
+
+# Values that never change while running, so they are only built once
+webStaticValues = {
+    "version": str(THERMOSTAT_VERSION),
+    "temperaturlabel": str(_("Temperature")),
+    "minTemp": str(minTemp),
+    "maxTemp": str(maxTemp),
+    "tempStep": str(tempStep),
+    "heatlabel": _("Heat"),
+    "coollabel": _("Cool"),
+    "fanlabel": _("Fan"),
+    "schedlabel": _("Sched"),
+    "holdlabel": _("Hold"),
+    "applysettings": _("Apply settings"),
+    "editschedule": _("Edit schedule"),
+    "onlabel": _("On"),
+    "offlabel": _("Off"),
+    "autolabel": _("Auto"),
+    "scaleunits": scaleUnits
+}
+
+
+def get_web_values(**values):
+    # Snapshot of the current thermostat state for page rendering. These are single reads of
+    # globals/widget attributes, so pages are rendered without taking thermostatLock.
+    snapshot = dict(webStaticValues)
+    snapshot["dt"] = (dateLabel.text.replace("[b]", "<b>").replace("[/b]", "</b>") + ", " +
+                      timeLabel.text.replace("[b]", "<b>").replace("[/b]", "</b>"))
+    snapshot.update(values)
+
+    return snapshot
+
+
+class ApiInterface(object):
 
     @cherrypy.expose
-    def index(self):
-        log(LOG_LEVEL_INFO, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEXT,
-            "Served thermostat.html to: " + cherrypy.request.remote.ip)
-        file = open("web/html/thermostat.html", "r")
-
-        html = file.read()
-
-        file.close()
-
-        with thermostatLock:
-            html = html.replace("@@version@@", str(THERMOSTAT_VERSION))
-            html = html.replace("@@temp@@", str(setTemp))
-            html = html.replace("@@temperaturlabel@@", str(_("Temperature")))
-            html = html.replace("@@current@@", str(currentTemp) + scaleUnits)
-            html = html.replace("@@domesticwaterlabel@@", str(currentWaterLabel.text).replace("[b]", "<b>").replace("[/b]", "</b>").replace("\n", "<br>").replace(" ","&nbsp;"))
-            html = html.replace("@@domesticwater@@", str(domesticwater) + scaleUnits)
-            html = html.replace("@@minTemp@@", str(minTemp))
-            html = html.replace("@@maxTemp@@", str(maxTemp))
-            html = html.replace("@@tempStep@@", str(tempStep))
-
-            status_info = json.loads(get_status_info())
-
-            html = html.replace("@@heatlabel@@", _("Heat"))
-            html = html.replace("@@coollabel@@", _("Cool"))
-            html = html.replace("@@fanlabel@@", _("Fan"))
-            html = html.replace("@@schedlabel@@", _("Sched"))
-            html = html.replace("@@holdlabel@@", _("Hold"))
-            html = html.replace("@@applysettings@@", _("Apply settings"))
-            html = html.replace("@@editschedule@@", _("Edit schedule"))
-
-            html = html.replace("@@heat@@", str(status_info['heat']).replace("[b]", "<b>").replace("[/b]", "</b>").replace("\n", "<br>").replace(" ","&nbsp;").replace("[color=00ff00]", '<font color="green">').replace("[/color]", '</font>'))
-            html = html.replace("@@cool@@", str(status_info['cool']).replace("[b]", "<b>").replace("[/b]", "</b>").replace("\n", "<br>").replace(" ","&nbsp;").replace("[color=00ff00]", '<font color="green">').replace("[/color]", '</font>'))
-            html = html.replace("@@fan@@", str(status_info['fan']).replace("[b]", "<b>").replace("[/b]", "</b>").replace("\n", "<br>").replace(" ","&nbsp;").replace("[color=00ff00]", '<font color="green">').replace("[/color]", '</font>'))
-            html = html.replace("@@sched@@", str(status_info['sched']).replace("[b]", "<b>").replace("[/b]", "</b>").replace("\n", "<br>").replace(" ","&nbsp;").replace("[color=00ff00]", '<font color="green">').replace("[/color]", '</font>'))
-
-            html = html.replace("@@dt@@", dateLabel.text.replace("[b]", "<b>").replace("[/b]",
-                                                                                       "</b>") + ", " + timeLabel.text.replace(
-                "[b]", "<b>").replace("[/b]", "</b>"))
-            html = html.replace("@@heatChecked@@", "checked" if heatControl.state == "down" else "")
-            html = html.replace("@@coolChecked@@", "checked" if coolControl.state == "down" else "")
-            html = html.replace("@@fanChecked@@", "checked" if fanControl.state == "down" else "")
-            html = html.replace("@@holdChecked@@", "checked" if holdControl.state == "down" else "")
-
-        return html
+    def status(self, section=None):
+        document = statusCache.get(section)
+
+        if document is None:
+            raise cherrypy.HTTPError(404, "Unknown status section: " + str(section))
+
+        version, etag, payload = document.current
+
+        cherrypy.response.headers["ETag"] = etag
+        cherrypy.response.headers["Cache-Control"] = "no-cache"
+
+        if etag_matches(cherrypy.request.headers.get("If-None-Match"), etag):
+            cherrypy.response.status = 304
+            return b""
+
+        cherrypy.response.headers["Content-Type"] = "application/json"
+
+        return payload
 
     @cherrypy.expose
-    def set(self, temp, heat="off", cool="off", fan="off", hold="off"):
-        global setTemp
-        global setLabel
-        global heatControl
-        global coolControl
-        global fanControl
+    def events(self):
+        if not statusEvents.acquire():
+            raise cherrypy.HTTPError(503, "Too many event subscribers")
+
+        # Returned when the request ends, also when the body is never iterated (HEAD, a client
+        # gone before the first chunk)
+        cherrypy.request.hooks.attach('on_end_request', statusEvents.release)
 
         log(LOG_LEVEL_INFO, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEXT,
-            "Set thermostat received from: " + cherrypy.request.remote.ip)
+            "Event stream opened by: %s", cherrypy.request.remote.ip)
 
-        tempChanged = setTemp != float(temp)
+        cherrypy.response.headers["Content-Type"] = "text/event-stream"
+        cherrypy.response.headers["Cache-Control"] = "no-cache"
+        cherrypy.response.headers["X-Accel-Buffering"] = "no"
 
-        with thermostatLock:
-            setTemp = float(temp)
-            setLabel.text = "  Set\n[b]" + str(setTemp) + "c[/b]"
-            tempSlider.value = setTemp
+        def stream():
+            # Start with the full document, then only the sections that change
+            lastId = statusEvents.position()
+            yield b"retry: 5000\n" + EventBroadcaster.format("status", statusCache.get().current[2])
 
-            if tempChanged:
-                log(LOG_LEVEL_STATE, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEMPERATURE, str(setTemp))
+            for message in statusEvents.subscribe(lastId):
+                if message is None:
+                    message = EventBroadcaster.format("status", statusCache.get().current[2])
+                yield message
 
-            if heat == "on":
-                setControlState(heatControl, "down")
-            else:
-                setControlState(heatControl, "normal")
+        return stream()
 
-            if cool == "on":
-                setControlState(coolControl, "down")
-            else:
-                setControlState(coolControl, "normal")
+    events._cp_config = {'response.stream': True}
 
-            if fan == "on":
-                setControlState(fanControl, "down")
-            else:
-                setControlState(fanControl, "normal")
+    @cherrypy.expose
+    def history(self, range="24h", end=None, series=None, points="300", tier=None):
+        # Columnar min/avg/max buckets for charts, eg. /api/history?range=7d&series=temp,setTemp&points=500
+        try:
+            end = time.time() if end is None else float(end)
+            if not math.isfinite(end):
+                raise ValueError("Expected a finite end time, got: " + repr(end))
 
-            if hold == "on":
-                setControlState(holdControl, "down")
-            else:
-                setControlState(holdControl, "normal")
+            start = end - parse_duration(range)
+            points = max(1, min(HISTORY_MAX_POINTS, int(points)))
+            names = None if not series else [name.strip() for name in series.split(",")]
+
+            if start >= end:
+                raise ValueError("Empty range: " + str(range))
+
+            result = historyStore.query(start, end, names, points, tier)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
 
-            reloadSchedule()
+        cherrypy.response.headers["Content-Type"] = "application/json"
+        cherrypy.response.headers["Cache-Control"] = "no-cache"
 
-        file = open("web/html/thermostat_set.html", "r")
+        return json.dumps(result, separators=(",", ":")).encode("utf-8")
 
-        html = file.read()
+    @cherrypy.expose
+    def locks(self, limit="20"):
+        try:
+            limit = max(1, int(limit))
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+
+        cherrypy.response.headers["Content-Type"] = "application/json"
+        cherrypy.response.headers["Cache-Control"] = "no-cache"
 
-        file.close()
+        return json.dumps(lockProfiler.report(limit), separators=(",", ":")).encode("utf-8")
+
+    @cherrypy.expose
+    def runtime(self):
+        cherrypy.response.headers["Content-Type"] = "application/json"
+        cherrypy.response.headers["Cache-Control"] = "no-cache"
 
-        with thermostatLock:
-            html = html.replace("@@version@@", str(THERMOSTAT_VERSION))
-            html = html.replace("@@dt@@", dateLabel.text.replace("[b]", "<b>").replace("[/b]", "</b>") + ", " + timeLabel.text.replace("[b]", "<b>").replace("[/b]", "</b>"))
-            html = html.replace("@@temp@@", ('<font color="red"><b>' if tempChanged else "") + str(setTemp) + (
-                '</b></font>' if tempChanged else ""))
-            html = html.replace("@@heat@@", ('<font color="red"><b>' if heat == "on" else "") + heat + (
-                '</b></font>' if heat == "on" else ""))
-            html = html.replace("@@cool@@", ('<font color="red"><b>' if cool == "on" else "") + cool + (
-                '</b></font>' if cool == "on" else ""))
-            html = html.replace("@@fan@@", ('<font color="red"><b>' if fan == "on" else "") + fan + (
-                '</b></font>' if fan == "on" else ""))
-            html = html.replace("@@hold@@", ('<font color="red"><b>' if hold == "on" else "") + hold + (
-                '</b></font>' if hold == "on" else ""))
+        return json.dumps(relayStats.snapshot(), separators=(",", ":")).encode("utf-8")
 
-        return html
+
+class WebInterface(object):
+
+    api = ApiInterface()
 
     @cherrypy.expose
-    def schedule(self):
+    def metrics(self):
+        cherrypy.response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        cherrypy.response.headers["Cache-Control"] = "no-cache"
+
+        return metrics.render().encode("utf-8")
+
+    @cherrypy.expose
+    def index(self):
         log(LOG_LEVEL_INFO, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEXT,
-            "Served thermostat_schedule.html to: " + cherrypy.request.remote.ip)
-        file = open("web/html/thermostat_schedule.html", "r")
+            "Served thermostat.html to: %s", cherrypy.request.remote.ip)
+
+        current = thermostatModel.current
+        status_info = get_status(current)
+
+        return webTemplates["index"].render(get_web_values(
+            temp=str(current.setTemp),
+            current=str(current.currentTemp) + scaleUnits,
+            domesticwaterlabel=markup_to_html(str(currentWaterLabel.text)),
+            domesticwater=str(current.domesticWater) + scaleUnits,
+            heat=markup_to_html(str(status_info['heat'])),
+            cool=markup_to_html(str(status_info['cool'])),
+            fan=markup_to_html(str(status_info['fan'])),
+            sched=markup_to_html(str(status_info['sched'])),
+            heatChecked="checked" if current.heat else "",
+            coolChecked="checked" if current.cool else "",
+            fanChecked="checked" if current.fan else "",
+            holdChecked="checked" if current.hold else ""
+        ))
 
-        html = file.read()
+    @cherrypy.expose
+    def set(self, temp, heat="off", cool="off", fan="off", hold="off"):
+        log(LOG_LEVEL_INFO, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEXT,
+            "Set thermostat received from: %s", cherrypy.request.remote.ip)
 
-        file.close()
+        # Only the model is changed here, the widgets follow on the Kivy thread
+        setTemp = float(temp)
+        changed = update_state(setTemp=setTemp, heat=heat == "on", cool=cool == "on", fan=fan == "on",
+                               hold=hold == "on")
+        tempChanged = "setTemp" in changed
 
-        with thermostatLock:
-            html = html.replace("@@version@@", str(THERMOSTAT_VERSION))
-            html = html.replace("@@minTemp@@", str(minTemp))
-            html = html.replace("@@maxTemp@@", str(maxTemp))
-            html = html.replace("@@tempStep@@", str(tempStep))
+        if tempChanged:
+            log(LOG_LEVEL_STATE, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEMPERATURE, "%s", setTemp)
 
-            html = html.replace("@@dt@@", dateLabel.text.replace("[b]", "<b>").replace("[/b]",
-                                                                                       "</b>") + ", " + timeLabel.text.replace(
-                "[b]", "<b>").replace("[/b]", "</b>"))
+        for control, value in ((heatControl, heat), (coolControl, cool), (fanControl, fan), (holdControl, hold)):
+            log_control_state(control, "down" if value == "on" else "normal")
+
+        reloadSchedule()
+        publish_status()
 
-        return html
+        return webTemplates["set"].render(get_web_values(
+            temp=highlight_html(str(setTemp), tempChanged),
+            heat=highlight_html(heat, heat == "on"),
+            cool=highlight_html(cool, cool == "on"),
+            fan=highlight_html(fan, fan == "on"),
+            hold=highlight_html(hold, hold == "on")
+        ))
+
+    @cherrypy.expose
+    def schedule(self):
+        log(LOG_LEVEL_INFO, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEXT,
+            "Served thermostat_schedule.html to: %s", cherrypy.request.remote.ip)
+
+        return webTemplates["schedule"].render(get_web_values())
 
     @cherrypy.expose
     @cherrypy.tools.json_in()
     def save(self):
         log(LOG_LEVEL_STATE, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEXT,
-            "Set schedule received from: " + cherrypy.request.remote.ip)
-        schedule = cherrypy.request.json
-
-        with scheduleLock:
-            file = open("thermostat_schedule.json", "w")
+            "Set schedule received from: %s", cherrypy.request.remote.ip)
+        saveSchedule(cherrypy.request.json)
+        reloadSchedule()
 
-            file.write(json.dumps(schedule, indent=4))
+        return webTemplates["saved"].render(get_web_values())
 
-            file.close()
 
-        reloadSchedule()
+# Per route request timing, enabled for the whole site in startWebServer
 
-        file = open("web/html/thermostat_saved.html", "r")
+def start_request_timer():
+    cherrypy.request.metricsStart = time.perf_counter()
+    cherrypy.request.hooks.attach('on_end_request', observe_request_time)
 
-        html = file.read()
+def observe_request_time():
+    # Event streams stay open for as long as the browser does, their duration says nothing
+    if cherrypy.response.stream:
+        return
 
-        file.close()
+    # The encode tool wraps the page handler; static files are served by tools, with no handler left
+    handler = getattr(cherrypy.request.handler, "oldhandler", cherrypy.request.handler)
+    route = "static" if handler is None else getattr(getattr(handler, "callable", None), "__qualname__", "other")
 
-        with thermostatLock:
-            html = html.replace("@@version@@", str(THERMOSTAT_VERSION))
-            html = html.replace("@@dt@@", dateLabel.text.replace("[b]", "<b>").replace("[/b]",
-                                                                                       "</b>") + ", " + timeLabel.text.replace(
-                "[b]", "<b>").replace("[/b]", "</b>"))
+    webRequestSeconds.labels(route).observe(time.perf_counter() - cherrypy.request.metricsStart)
 
-        return html
+cherrypy.tools.metrics = cherrypy.Tool('on_start_resource', start_request_timer)
 
 
 def startWebServer():
@@ -1764,10 +2406,11 @@ def startWebServer():
     cherrypy.server.socket_port = 80 if not (settings.exists("web")) else settings.get("web")["port"]
 
     log(LOG_LEVEL_STATE, CHILD_DEVICE_WEBSERVER, MSG_SUBTYPE_TEXT,
-        "Starting on " + cherrypy.server.socket_host + ":" + str(cherrypy.server.socket_port))
+        "Starting on %s:%s", cherrypy.server.socket_host, cherrypy.server.socket_port)
 
     conf = {
         '/': {
+            'tools.metrics.on': True,
             'tools.staticdir.root': os.path.abspath(os.getcwd()),
             'tools.staticfile.root': os.path.abspath(os.getcwd())
         },
@@ -1785,7 +2428,7 @@ def startWebServer():
         },
         '/schedule.json': {
             'tools.staticfile.on': True,
-            'tools.staticfile.filename': './thermostat_schedule.json'
+            'tools.staticfile.filename': './' + SCHEDULE_FILE_NAME
         },
         '/favicon.ico': {
             'tools.staticfile.on': True,
@@ -1797,10 +2440,14 @@ def startWebServer():
     cherrypy.config.update(
         {'log.screen': debug,
          'log.access_file': "",
-         'log.error_file': ""
+         'log.error_file': "",
+         # every open /api/events stream holds a worker thread
+         'server.thread_pool': 10 + statusEvents.maxSubscribers
          }
     )
 
+    cherrypy.engine.subscribe('stop', statusEvents.close)
+
     cherrypy.quickstart(WebInterface(), '/', conf)
 
 
@@ -1811,29 +2458,63 @@ def startWebServer():
 ##############################################################################
 
 def main():
-    # Start Web Server
+    # Importing this module only reads the settings and builds the (not yet shown) widgets,
+    # nothing is written to disk.
+    # Start up happens here, in phases:
+
+    # 1. Relays into a known (off) state, before anything can switch them, then the locale
+    #    and the files written from here on
+    init_gpio()
+    locale.setlocale(locale.LC_ALL, t_locale)
+    start_logging()
+    open_history()
+    log_startup()
+
+    # 2. Background services. None of these block: each finishes starting (and retrying, for
+    #    MQTT) on its own thread while the UI comes up
+    tempSampler.start()
+
+    if mqttEnabled:
+        connect_mqtt()
+
     webThread = threading.Thread(target=startWebServer)
     webThread.daemon = True
     webThread.start()
 
-    # Start Scheduler
-    reloadSchedule()
     schedThread = threading.Thread(target=startScheduler)
     schedThread.daemon = True
     schedThread.start()
 
-    # Start Thermostat UI/App
-    ThermostatApp().run()
+    publish_status()
+
+    # 3. The UI (or the headless main loop), which starts the control loop
+    if headless:
+        log(LOG_LEVEL_INFO, CHILD_DEVICE_NODE, MSG_SUBTYPE_TEXT, "Running headless")
+        start_control()
+        Clock.run()
+    else:
+        # Start Thermostat UI/App
+        ThermostatApp().run()
 
 if __name__ == '__main__':
     try:
         main()
     finally:
         log(LOG_LEVEL_STATE, CHILD_DEVICE_NODE, MSG_SUBTYPE_CUSTOM + "/shutdown", "Thermostat Shutting Down...")
+        tempSampler.stop()
+        scheduleRunner.stop()
+        weatherService.stop()
+        state.flush()
+        close_relay_stats()
         GPIO.cleanup()
 
+        if historyStore is not None:
+            historyStore.close()
+
+        if logPipeline is not None:
+            logPipeline.close()
+
         if logFile is not None:
-            logFile.flush()
             os.fsync(logFile.fileno())
             logFile.close()
 
@@ -0,0 +1,88 @@
+import threading
+
+
+class ThermostatState:
+    # Immutable snapshot of the thermostat state: set/current temperature, domestic water
+    # and outside temperature, the heat/cool/fan/hold modes and the relay outputs. A new
+    # snapshot is built for every change, so a reader holding one always sees a consistent
+    # set of values without taking any lock.
+
+    __slots__ = ("setTemp", "currentTemp", "domesticWater", "outsideTemp",
+                 "heat", "cool", "fan", "hold",
+                 "heatOn", "coolOn", "fanOn",
+                 "version")
+
+    DEFAULTS = {
+        "setTemp": 22.0,
+        "currentTemp": 22.0,
+        "domesticWater": "n/a",
+        "outsideTemp": 0.0,
+        "heat": False,
+        "cool": False,
+        "fan": False,
+        "hold": False,
+        "heatOn": False,
+        "coolOn": False,
+        "fanOn": False,
+        "version": 0
+    }
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.pop(name, self.DEFAULTS[name]))
+
+        if values:
+            raise TypeError("Unknown state fields: " + ", ".join(sorted(values)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ThermostatState is immutable, use replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("ThermostatState is immutable")
+
+    def replace(self, **changes):
+        # A copy with the given fields changed and the version bumped, or self if nothing changes
+        values = {name: getattr(self, name) for name in self.__slots__}
+
+        if all(name in values and values[name] == value for name, value in changes.items()):
+            return self
+
+        values.update(changes)
+        values["version"] = self.version + 1
+
+        return ThermostatState(**values)
+
+    def changes(self, other) -> tuple:
+        # Names of the fields that differ from other (not counting the version)
+        return tuple(name for name in self.__slots__
+                     if name != "version" and getattr(self, name) != getattr(other, name))
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "ThermostatState(" + ", ".join(name + "=" + repr(getattr(self, name)) for name in self.__slots__) + ")"
+
+
+class StateModel:
+    # Holds the current ThermostatState. update() is the single writer path: writers are
+    # serialized on a small lock only while the next snapshot is built and the reference
+    # swapped. Readers just take current, they never block (or are blocked by) the
+    # control loop.
+
+    def __init__(self, initial: ThermostatState, lock=None):
+        self.current = initial
+        self._lock = lock if lock is not None else threading.Lock()
+
+    def update(self, **changes) -> tuple:
+        # Returns the names of the fields that changed (empty if none did)
+        with self._lock:
+            previous = self.current
+            state = previous.replace(**changes)
+
+            if state is previous:
+                return ()
+
+            self.current = state
+
+        return state.changes(previous)
@@ -0,0 +1,220 @@
+import gzip
+import hashlib
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+
+from statestore import atomic_write
+
+
+class WeatherFeed:
+    def __init__(self, name: str, url: str, interval: float):
+        self.name = name
+        self.url = url
+        self.interval = interval
+        self.key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        self.nextFetch = 0.0
+        self.failures = 0
+
+
+class WeatherService:
+    # Fetches the weather feeds on a background thread over one keep-alive connection.
+    # Responses are revalidated with ETag/Last-Modified, Cache-Control max-age is honoured,
+    # and the last good response of each feed is kept on disk, so a restart does not need
+    # to refetch straight away. Failed fetches are retried with exponential backoff.
+
+    def __init__(self, feeds, timeout: float, on_update, on_error=None, cacheFile: str = None,
+                 minBackoff: float = 30.0, maxBackoff: float = 300.0, latency=None):
+        self.feeds = feeds
+        self.timeout = timeout
+        self.on_update = on_update
+        self.on_error = on_error
+        self.cacheFile = cacheFile
+        self.minBackoff = minBackoff
+        self.maxBackoff = max(minBackoff, maxBackoff)
+        # Optional histogram labelled by feed name (labels(name).observe(seconds)) for fetch times
+        self.latency = latency
+        self.fetches = 0
+        self.notModified = 0
+        self.cache = {}
+        self._connections = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._load_cache()
+        self._thread = threading.Thread(target=self._run, name="WeatherService", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def refresh(self):
+        # Fetch all feeds now, regardless of their schedule
+        for feed in self.feeds:
+            feed.nextFetch = 0.0
+        self._wake.set()
+
+    def _load_cache(self):
+        if self.cacheFile is None:
+            return
+
+        try:
+            with open(self.cacheFile, "r") as file:
+                self.cache = json.load(file)
+        except (OSError, ValueError):
+            self.cache = {}
+
+        for feed in self.feeds:
+            entry = self.cache.get(feed.name)
+            if entry is None or entry.get("key") != feed.key:
+                continue
+
+            # Hand out what we have right away; only refetch once it is due
+            feed.nextFetch = max(entry["fetched"] + feed.interval, entry.get("expires", 0))
+            if entry.get("data") is not None:
+                self.on_update(feed.name, entry["data"])
+
+    def _save_cache(self):
+        if self.cacheFile is None:
+            return
+
+        try:
+            atomic_write(self.cacheFile, json.dumps(self.cache))
+        except OSError:
+            pass
+
+    def _connection(self, scheme: str, host: str):
+        connection = self._connections.get((scheme, host))
+
+        if connection is None:
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(host, timeout=self.timeout)
+            self._connections[(scheme, host)] = connection
+
+        return connection
+
+    def _close(self, scheme: str, host: str):
+        connection = self._connections.pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def _request(self, url: str, headers: dict):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+
+        # A kept-alive connection may have been closed by the server in the meantime,
+        # so retry once on a fresh connection
+        for attempt in range(2):
+            connection = self._connection(parts.scheme, parts.netloc)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self._close(parts.scheme, parts.netloc)
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                self._close(parts.scheme, parts.netloc)
+                raise
+
+            if response.will_close:
+                self._close(parts.scheme, parts.netloc)
+
+            if response.getheader("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+
+            return response, body
+
+    @staticmethod
+    def _max_age(cacheControl: str) -> float:
+        for directive in (cacheControl or "").split(","):
+            name, _, value = directive.strip().partition("=")
+            if name.lower() == "max-age":
+                try:
+                    return float(value)
+                except ValueError:
+                    return 0.0
+        return 0.0
+
+    def fetch(self, feed: WeatherFeed):
+        entry = self.cache.get(feed.name)
+        if entry is not None and entry.get("key") != feed.key:
+            entry = None
+
+        headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("lastModified"):
+                headers["If-Modified-Since"] = entry["lastModified"]
+
+        start = time.perf_counter()
+        try:
+            response, body = self._request(feed.url, headers)
+        finally:
+            if self.latency is not None:
+                self.latency.labels(feed.name).observe(time.perf_counter() - start)
+        self.fetches += 1
+        now = time.time()
+
+        if response.status == 304 and entry is not None:
+            self.notModified += 1
+            data = entry["data"]
+        elif response.status == 200:
+            data = json.loads(body)
+            entry = {
+                "key": feed.key,
+                "etag": response.getheader("ETag"),
+                "lastModified": response.getheader("Last-Modified"),
+                "data": data
+            }
+            self.cache[feed.name] = entry
+        else:
+            raise http.client.HTTPException("HTTP " + str(response.status) + " " + str(response.reason))
+
+        entry["fetched"] = now
+        entry["expires"] = now + self._max_age(response.getheader("Cache-Control"))
+        self._save_cache()
+
+        feed.failures = 0
+        feed.nextFetch = max(now + feed.interval, entry["expires"])
+
+        return data
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.time()
+
+            for feed in self.feeds:
+                if feed.nextFetch > now or self._stop.is_set():
+                    continue
+
+                try:
+                    data = self.fetch(feed)
+                except Exception as e:
+                    feed.failures += 1
+                    feed.nextFetch = time.time() + min(self.maxBackoff, self.minBackoff * 2 ** (feed.failures - 1))
+                    if self.on_error is not None:
+                        self.on_error(feed.name, e)
+                    continue
+
+                self.on_update(feed.name, data)
+
+            nextFetch = min(feed.nextFetch for feed in self.feeds) if self.feeds else now + 3600
+            self._wake.wait(max(1.0, nextFetch - time.time()))
+            self._wake.clear()
+
+        for scheme, host in list(self._connections):
+            self._close(scheme, host)
@@ -0,0 +1,185 @@
+import bisect
+import datetime
+import threading
+
+DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def parse_time(hhmm: str) -> int:
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 3600 + int(minutes) * 60
+
+
+def week_start(when: datetime.datetime) -> datetime.datetime:
+    return when.replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=when.weekday())
+
+
+class WeeklyTimeline:
+    # A thermostat_schedule.json heat/cool section ({"monday": [["08:30", 21], ...], ...})
+    # flattened into one list sorted by offset from monday 00:00, so the next transition
+    # is a single bisect instead of a scan over every entry. Timelines are never modified
+    # once built, the scheduler thread can keep using one while a new one is derived.
+
+    def __init__(self, days: dict = None):
+        self.days = {}
+        self.offsets = []
+        self.temps = []
+
+        if days:
+            for day in DAYS:
+                if day in days:
+                    self._set_day(day, days[day])
+
+    @staticmethod
+    def _parse_day(day: str, dayEntries: list):
+        dayOffset = DAYS.index(day) * SECONDS_PER_DAY
+        entries = {}
+
+        for entry in dayEntries:
+            # Entries at the same time: the last one wins, as it did with one job per entry
+            entries[dayOffset + parse_time(entry[0])] = entry[1]
+
+        return sorted(entries.items())
+
+    def _set_day(self, day: str, dayEntries: list):
+        # Days occupy disjoint, ordered ranges of the week, so a day is one contiguous slice
+        dayStart = DAYS.index(day) * SECONDS_PER_DAY
+        lo = bisect.bisect_left(self.offsets, dayStart)
+        hi = bisect.bisect_left(self.offsets, dayStart + SECONDS_PER_DAY)
+        entries = self._parse_day(day, dayEntries)
+
+        self.offsets[lo:hi] = [offset for offset, temp in entries]
+        self.temps[lo:hi] = [temp for offset, temp in entries]
+        self.days[day] = [list(entry) for entry in dayEntries]
+
+    def with_days(self, days: dict):
+        # Returns (timeline, changed day names). Only the days whose entries differ are
+        # re-parsed; if nothing changed the same timeline is returned.
+        changed = [day for day in DAYS if days.get(day, []) != self.days.get(day, [])]
+
+        if not changed:
+            return self, changed
+
+        timeline = WeeklyTimeline()
+        timeline.days = dict(self.days)
+        timeline.offsets = list(self.offsets)
+        timeline.temps = list(self.temps)
+
+        for day in changed:
+            timeline._set_day(day, days.get(day, []))
+
+        return timeline, changed
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def next_after(self, when: datetime.datetime):
+        # Returns (due datetime, temp) of the first transition strictly after when, or None
+        if not self.offsets:
+            return None
+
+        start = week_start(when)
+        offset = (when - start).total_seconds()
+        i = bisect.bisect_right(self.offsets, offset)
+
+        if i == len(self.offsets):
+            i = 0
+            start += datetime.timedelta(days=7)
+
+        return start + datetime.timedelta(seconds=self.offsets[i]), self.temps[i]
+
+    def active_at(self, when: datetime.datetime):
+        # Temp of the last transition at or before when (wrapping into the previous week), or None
+        if not self.offsets:
+            return None
+
+        i = bisect.bisect_right(self.offsets, (when - week_start(when)).total_seconds()) - 1
+
+        return self.temps[i]
+
+
+class ScheduleRunner:
+    # Sleeps until the next transition of the active timeline and calls apply(temp).
+    # set_timeline() and wake() interrupt the sleep, so schedule and hold changes take
+    # effect immediately. Transitions that come due while is_held() is true are not
+    # applied; the latest of them is applied once the hold is released.
+
+    def __init__(self, apply, is_held, maxSleep: float = 60.0, now=datetime.datetime.now):
+        self.apply = apply
+        self.is_held = is_held
+        # Upper bound on a single sleep, so wall clock jumps (NTP sync at boot) are noticed
+        self.maxSleep = maxSleep
+        self.now = now
+        self.timeline = None
+        self.wakeups = 0
+        self._next = None
+        # The time _next was worked out from, a clock earlier than that stepped backwards
+        self._nextFrom = None
+        self._missed = None
+        self._stopped = False
+        self._cond = threading.Condition()
+
+    def set_timeline(self, timeline):
+        with self._cond:
+            self.timeline = timeline
+            self._next = None
+            self._missed = None
+            self._cond.notify_all()
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def next_transition(self):
+        return self._next
+
+    def run(self):
+        while True:
+            temp = None
+
+            with self._cond:
+                if self._stopped:
+                    return
+
+                self.wakeups += 1
+
+                if self._missed is not None and not self.is_held():
+                    temp = self._missed
+                    self._missed = None
+                elif self.timeline is None or len(self.timeline) == 0:
+                    self._cond.wait()
+                    continue
+                else:
+                    now = self.now()
+
+                    if self._next is None or now < self._nextFrom:
+                        self._next = self.timeline.next_after(now)
+                        self._nextFrom = now
+
+                    due, dueTemp = self._next
+                    delay = (due - now).total_seconds()
+
+                    if delay > 0:
+                        self._cond.wait(min(delay, self.maxSleep))
+                        continue
+
+                    # If several transitions passed (clock jump), only the latest one matters
+                    dueTemp = self.timeline.active_at(now)
+                    self._next = self.timeline.next_after(now)
+                    self._nextFrom = now
+
+                    if self.is_held():
+                        self._missed = dueTemp
+                    else:
+                        temp = dueTemp
+
+            # apply outside of the condition, so it may call back into set_timeline()/wake()
+            if temp is not None:
+                self.apply(temp)